@@ -1,35 +1,3279 @@
 from PyQt5.QtWidgets import QGraphicsPolygonItem, QGraphicsRectItem, QGraphicsTextItem, QVBoxLayout, QHBoxLayout, \
-    QListWidget, QPushButton, QGraphicsScene, QGraphicsView, QScrollArea, QWidget, QInputDialog, QApplication, \
-    QMessageBox, QCheckBox, QFileDialog, QSplitter, QLabel, QGraphicsEllipseItem
-from PyQt5.QtGui import QPixmap, QImage, QPen, QColor, QPolygonF, QBrush
-from PyQt5.QtCore import Qt, QPointF, QRectF
+    QListView, QPushButton, QGraphicsScene, QGraphicsView, QTableView, QHeaderView, QLineEdit, QWidget, QInputDialog, QApplication, \
+    QMessageBox, QCheckBox, QFileDialog, QSplitter, QLabel, QComboBox, QGraphicsPixmapItem, \
+    QGraphicsItemGroup, QStackedWidget, QStyledItemDelegate, QStyle, QDialog, QDialogButtonBox, QFormLayout, \
+    QPlainTextEdit, QProgressDialog, QSpinBox
+from PyQt5.QtGui import QPixmap, QImage, QPen, QColor, QPolygonF, QBrush, QPainter, QDoubleValidator
+from PyQt5 import sip
+from PyQt5.QtCore import Qt, QPointF, QRect, QRectF, QSize, QObject, QTimer, pyqtSignal, QThread, QAbstractListModel, QModelIndex, \
+    QAbstractTableModel, QSortFilterProxyModel, QFileSystemWatcher
 import sys
-from PIL import Image
+import re
+import math
+import time
 import os
 import json
-import xml.etree.ElementTree as ET
-
-def resize_image(image, max_width, max_height):
-    w_ratio = max_width / image.width
-    h_ratio = max_height / image.height
-    ratio = min(w_ratio, h_ratio)
-    new_size = (int(image.width * ratio), int(image.height * ratio))
-    return image.resize(new_size, Image.Resampling.LANCZOS), ratio
+import bisect
+import hashlib
+import sqlite3
+import argparse
+import multiprocessing
+import mmap
+import shutil
+import tempfile
+import threading
+import difflib
+import functools
+import importlib
+import types
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+
+class LazyModule(types.ModuleType):
+    """第一次访问属性时才导入的模块
+
+    NumPy、Pillow 和 ElementTree 的导入要花几百毫秒，延迟到第一次使用时（通常是后台线程解码第一张图片时）
+    再导入，启动时窗口不必等待。导入后把真实模块的属性复制到自身，之后的属性访问与普通模块一样快。
+    """
+
+    def __getattr__(self, name):
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, name)
+
+
+np = LazyModule('numpy')
+Image = LazyModule('PIL.Image')
+ET = LazyModule('xml.etree.ElementTree')
+
+# 支持的图片扩展名（比较时忽略大小写）
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+# 标注文件扩展名
+ANNOTATION_EXTENSIONS = ('.json', '.xml')
+# 单张图片的标注格式 -> 标注文件扩展名；COCO 是整个数据集一个 JSON 文件
+ANNOTATION_FORMATS = {'labelme': '.json', 'voc': '.xml'}
+CONVERT_TARGETS = ('labelme', 'voc', 'coco')
+# 显示区域大小
+DISPLAY_WIDTH = 800
+DISPLAY_HEIGHT = 600
+# 解码缓存的默认容量（字节）和预取深度（当前图片前后各预取几张）
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+PREFETCH_DEPTH = 3
+# 放大查看时使用的瓦片金字塔：瓦片边长和瓦片缓存容量（字节）
+TILE_SIZE = 256
+TILE_CACHE_BYTES = 128 * 1024 * 1024
+# 只能整张解码的原图（PNG、压缩 TIFF 等）生成瓦片时最多保留的像素数，超过时先整数倍缩小
+TILE_SOURCE_MAX_PIXELS = 64 * 1024 * 1024
+# 标注修改后延迟多久写回文件（毫秒），连续修改合并为一次写入
+ANNOTATION_FLUSH_DELAY_MS = 500
+# 标注命中测试使用的均匀网格的单元大小（显示坐标）
+GRID_CELL_SIZE = 32
+# 磁盘预览缓存的默认容量上限（字节）
+PREVIEW_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+# 多边形细节层次：显示时用 Douglas-Peucker 简化，允许的误差（屏幕像素）
+SIMPLIFY_TOLERANCE_PX = 0.5
+# 相邻顶点在屏幕上的平均间距小于该值（像素）时不画顶点标记
+VERTEX_HANDLE_MIN_SPACING_PX = 6
+# 两次切换图片的间隔小于该值（毫秒）时视为快速浏览：只显示图片，停下后再绘制标注
+NAVIGATION_SETTLE_MS = 150
+# 缩略图网格中缩略图的最大尺寸，以及缩略图缓存的容量
+THUMBNAIL_SIZE = (160, 120)
+THUMBNAIL_CACHE_BYTES = 64 * 1024 * 1024
+# 目录中的文件被外部程序修改后，等变化停止多久（毫秒）再一并处理；持续变化时最多等待 WATCH_MAX_DELAY_MS
+WATCH_DEBOUNCE_MS = 300
+WATCH_MAX_DELAY_MS = 2000
+# 对比两组标注：IoU 不低于阈值才算匹配；涉及多边形时在外接框交集内用 N 条水平扫描线估计交集面积
+COMPARE_IOU_THRESHOLD = 0.5
+IOU_RASTER_SAMPLES = 64
+# 对比模式中匹配、漏检（没有匹配的标注）、误检（没有匹配的对比标注）的颜色
+COMPARE_COLORS = {'match': '#00c000', 'miss': '#ff0000', 'false_positive': '#ff8c00'}
+# 文件列表和缩略图网格分批布局，每批的行数
+FILE_LIST_BATCH_SIZE = 1000
+# 上次打开的目录记录在用户缓存目录的 SESSION_FILE 中；各目录的文件列表快照和查看状态保存在
+# default_index_path(目录, 'session.json') 中，再次打开时不必重新扫描目录
+SESSION_FILE = 'last_session.json'
+# 缩放质量模式："fast" 用于快速浏览，"high" 用于仔细查看（值为 Image.Resampling 的成员名）
+RESIZE_FILTERS = {'fast': 'BILINEAR', 'high': 'LANCZOS'}
+DEFAULT_QUALITY = 'fast'
+
+
+class PerfRecorder:
+    """记录各阶段耗时，供界面上的计时浮层和 JSON lines 日志使用
+
+    默认关闭；关闭时 stage() 返回共享的空上下文，timed 装饰的函数只多一次属性判断。
+    每次计时都会记下阶段名和毫秒数，打开日志时同时逐行写入 {"stage", "ms", "time", "thread"}，
+    close() 时再写一行各阶段的 count/p50/p95/max 汇总。
+    """
+
+    class _Stage:
+        __slots__ = ('recorder', 'name', 'start')
+
+        def __init__(self, recorder, name):
+            self.recorder = recorder
+            self.name = name
+
+        def __enter__(self):
+            self.start = time.perf_counter()
+            return self
+
+        def __exit__(self, *exc_info):
+            self.recorder.record(self.name, (time.perf_counter() - self.start) * 1000)
+            return False
+
+    class _NullStage:
+        __slots__ = ()
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc_info):
+            return False
+
+    _NULL_STAGE = _NullStage()
+
+    def __init__(self):
+        self.enabled = False
+        self.samples = {}  # 阶段名 -> [毫秒, ...]
+        self.last = {}  # 阶段名 -> 最近一次的毫秒数
+        self._log = None
+        self._lock = threading.Lock()
+
+    def enable(self, log_path=None):
+        if log_path:
+            self._log = open(log_path, 'a', encoding='utf-8')
+        self.enabled = True
+
+    def stage(self, name):
+        """with perf.stage('decode'): ... 计时一个代码块"""
+        return self._Stage(self, name) if self.enabled else self._NULL_STAGE
+
+    def record(self, name, ms):
+        with self._lock:
+            self.samples.setdefault(name, []).append(ms)
+            self.last[name] = ms
+            if self._log is not None:
+                self._log.write(json.dumps({'stage': name, 'ms': round(ms, 3), 'time': time.time(),
+                                            'thread': threading.current_thread().name}) + '\n')
+
+    def summary(self):
+        """返回 {阶段名: {'count', 'p50', 'p95', 'max', 'last'}}，百分位按最近秩计算"""
+        with self._lock:
+            samples = {name: sorted(values) for name, values in self.samples.items()}
+            last = dict(self.last)
+        result = {}
+        for name, values in samples.items():
+            count = len(values)
+            result[name] = {'count': count,
+                            'p50': values[max(0, math.ceil(count * 0.50) - 1)],
+                            'p95': values[max(0, math.ceil(count * 0.95) - 1)],
+                            'max': values[-1], 'last': last[name]}
+        return result
+
+    def close(self):
+        """写入本次会话的汇总并关闭日志"""
+        if self._log is not None:
+            with self._lock:
+                log, self._log = self._log, None
+            log.write(json.dumps({'summary': self.summary(), 'time': time.time()}) + '\n')
+            log.close()
+
+
+# 全局计时器，由 --perf / --perf-log 打开
+perf = PerfRecorder()
+
+
+def timed(name):
+    """装饰器：计时整个函数调用，计时关闭时直接调用原函数"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not perf.enabled:
+                return func(*args, **kwargs)
+            with perf.stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def normalize_image_mode(image):
+    """把调色板、二值、CMYK 等模式转换为 L/RGB/RGBA，便于高质量缩放；16 位和浮点灰度保持原样"""
+    mode = image.mode
+    if mode in ('L', 'RGB', 'RGBA') or mode.startswith('I') or mode == 'F':
+        return image
+    if mode == 'P':
+        return image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+    if mode == '1':
+        return image.convert('L')
+    if mode in ('LA', 'La', 'PA', 'RGBa'):
+        return image.convert('RGBA')
+    return image.convert('RGB')
+
+
+def to_display_mode(image):
+    """转换为可以显示的 8 位模式（L/RGB/RGBA）
+
+    16 位灰度按满量程线性缩放到 8 位（直接 convert('L') 会把大于 255 的值截断成白色），
+    32 位整数和浮点灰度按实际的最小值、最大值拉伸。
+    """
+    image = normalize_image_mode(image)
+    if image.mode.startswith('I;16'):
+        pixels = np.asarray(image)
+        return Image.fromarray((pixels >> 8).astype(np.uint8))
+    if image.mode in ('I', 'F'):
+        pixels = np.asarray(image, dtype=np.float32)
+        low, high = float(pixels.min()), float(pixels.max())
+        scale = 255 / (high - low) if high > low else 0
+        return Image.fromarray(((pixels - low) * scale).astype(np.uint8))
+    return image
+
+
+# 显示模式 -> (QImage 格式, 与 QImage 像素内存布局相同的 Pillow 模式)
+QIMAGE_FORMATS = {'L': (QImage.Format_Grayscale8, 'L'),
+                  'RGB': (QImage.Format_RGBX8888, 'RGBX'),
+                  'RGBA': (QImage.Format_RGBA8888, 'RGBA')}
+
+
+def pil_to_qimage(image):
+    """把 Pillow 图片转换为 QImage，按图片模式选择格式，像素只复制一次
+
+    先分配 QImage，再用 Image.frombuffer 把它的像素内存包装成 Pillow 图片，直接粘贴进去，
+    不经过 tobytes() 的中间 bytes 对象，返回的 QImage 拥有自己的内存。
+    """
+    image = to_display_mode(image)
+    qformat, buffer_mode = QIMAGE_FORMATS[image.mode]
+    qimage = QImage(image.width, image.height, qformat)
+    buffer = qimage.bits()
+    buffer.setsize(qimage.byteCount())
+    target = Image.frombuffer(buffer_mode, image.size, buffer, 'raw', buffer_mode, qimage.bytesPerLine(), 1)
+    target.readonly = False  # frombuffer 默认只读，粘贴时会先复制一份；这里要直接写入 QImage 的内存
+    target.paste(image)
+    return qimage
+
+
+class MappedRaster:
+    """通过 mmap 按区域读取未压缩图片（BMP、未压缩的 TIFF 条带、PPM/PGM）的像素
+
+    只接受 Pillow 解析出的全部是 'raw' 编码、整行宽度的数据块（TIFF 的条带或整幅图片）。
+    每次读取只映射所需行所在的文件区域，由 Pillow 的 raw 解码器直接从映射内存中解包，
+    读完立即解除映射，内存占用与读取的区域大小成正比。
+    """
+    # 原始像素格式 -> (Pillow 模式, 每像素字节数)
+    RAW_LAYOUTS = {
+        'L': ('L', 1),
+        'I;16': ('I;16', 2),
+        'I;16B': ('I;16', 2),
+        'RGB': ('RGB', 3),
+        'BGR': ('RGB', 3),
+        'RGBX': ('RGB', 4),
+        'BGRX': ('RGB', 4),
+        'RGBA': ('RGBA', 4),
+        'BGRA': ('RGBA', 4),
+    }
+    CHUNK_BYTES = 16 * 1024 * 1024  # 缩小时每次读取的原图字节数上限
+
+    def __init__(self, file_path, image):
+        self.file_path = file_path
+        self.width, self.height = image.size
+        self.rawmode = None
+        self.strips = []  # (起始行, 结束行, 文件偏移, 行字节数, 方向)
+        for tile in image.tile:
+            codec, (x0, y0, x1, y1), offset, args = tile
+            if isinstance(args, str):
+                args = (args,)
+            rawmode, stride, orientation = (tuple(args) + (0, 1))[:3]
+            if codec != 'raw' or x0 != 0 or x1 != self.width or rawmode not in self.RAW_LAYOUTS:
+                raise ValueError(f"不支持映射读取的数据块: {codec} {rawmode}")
+            if self.rawmode is not None and rawmode != self.rawmode:
+                raise ValueError("数据块的像素格式不一致")
+            self.rawmode = rawmode
+            self.strips.append((y0, y1, offset, stride or self.width * self.RAW_LAYOUTS[rawmode][1], orientation))
+        if self.rawmode is None:
+            raise ValueError("没有像素数据")
+        self.mode = self.RAW_LAYOUTS[self.rawmode][0]
+
+    @classmethod
+    def open(cls, file_path, image=None):
+        """可以映射读取时返回 MappedRaster，否则返回 None（由调用方用 Pillow 正常解码）"""
+        try:
+            return cls(file_path, image if image is not None else Image.open(file_path))
+        except (ValueError, OSError):
+            return None
+
+    def read_rows(self, y0, y1):
+        """读取 [y0, y1) 行的完整宽度，返回 Pillow 图片"""
+        result = Image.new(self.mode, (self.width, y1 - y0))
+        with open(self.file_path, 'rb') as file:
+            for strip_y0, strip_y1, offset, stride, orientation in self.strips:
+                top, bottom = max(y0, strip_y0), min(y1, strip_y1)
+                if top >= bottom:
+                    continue
+                # 自下而上存储（BMP）时，文件中的行顺序与图片相反
+                first_row = top - strip_y0 if orientation > 0 else strip_y1 - bottom
+                start = offset + first_row * stride
+                length = (bottom - top) * stride
+                aligned = start - start % mmap.ALLOCATIONGRANULARITY
+                with mmap.mmap(file.fileno(), start + length - aligned, access=mmap.ACCESS_READ,
+                               offset=aligned) as mapped:
+                    view = memoryview(mapped)[start - aligned:start - aligned + length]
+                    rows = Image.frombuffer(self.mode, (self.width, bottom - top), view, 'raw', self.rawmode,
+                                            stride, orientation)
+                    result.paste(rows, (0, top - y0))
+                    del rows  # 解除映射前释放对映射内存的引用
+                    view.release()
+        return result
+
+    @property
+    def size(self):
+        return self.width, self.height
+
+    def crop(self, box):
+        """与 Image.crop 相同，只读取该区域所在的行"""
+        x0, y0, x1, y1 = box
+        return self.read_rows(y0, y1).crop((x0, 0, x1, y1 - y0))
+
+    def downsample(self, factor, box=None):
+        """按 factor x factor 的块取平均缩小整幅图片或 box 区域，分块读取，内存占用与原图大小无关"""
+        x0, y0, x1, y1 = box or (0, 0, self.width, self.height)
+        rows_per_chunk = max(1, self.CHUNK_BYTES // (self.width * self.RAW_LAYOUTS[self.rawmode][1] * factor))
+        chunk_height = rows_per_chunk * factor
+        parts = []
+        for top in range(y0, y1, chunk_height):
+            bottom = min(y1, top + chunk_height)
+            chunk = self.read_rows(top, bottom)
+            if factor > 1:
+                # reduce() 不支持 16 位灰度，先转换为 32 位整数再缩小
+                if self.mode == 'I;16':
+                    chunk = chunk.convert('I')
+                chunk = chunk.reduce(factor, (x0, 0, x1, bottom - top))
+            else:
+                chunk = chunk.crop((x0, 0, x1, bottom - top))
+            parts.append(chunk)
+        result = Image.new(parts[0].mode, (parts[0].width, sum(part.height for part in parts)))
+        y = 0
+        for part in parts:
+            result.paste(part, (0, y))
+            y += part.height
+        if result.mode != self.mode:
+            result = Image.fromarray(np.asarray(result).astype(np.uint16))
+        return result
+
+
+@timed('decode')
+def decode_display_image(file_path, max_width, max_height, quality=DEFAULT_QUALITY):
+    """按显示尺寸解码图片，返回 (缩放后的图片, 相对原图的缩放比例, 解码信息)
+
+    JPEG 先用 draft() 做 DCT 缩放解码；未压缩的 BMP/TIFF/PPM 通过 MappedRaster 分块映射读取并按整数倍
+    平均缩小，不把整张原图读进内存；之后再按质量模式缩放到目标大小。返回的图片已转换为 L/RGB/RGBA。
+    """
+    start = time.perf_counter()
+    image = Image.open(file_path)
+    source_width, source_height = image.size
+    ratio = min(max_width / source_width, max_height / source_height)
+    new_size = (max(1, int(source_width * ratio)), max(1, int(source_height * ratio)))
+
+    mapped_factor = 0
+    if image.format == 'JPEG':
+        # draft 只按 1/2、1/4、1/8 缩小解码，并保证结果不小于请求的尺寸
+        image.draft('RGB', new_size)
+    else:
+        raster = MappedRaster.open(file_path, image)
+        if raster is not None:
+            image.close()
+            mapped_factor = max(1, min(source_width // new_size[0], source_height // new_size[1]))
+            image = raster.downsample(mapped_factor)
+    draft_scale = source_width / image.width
+    # reducing_gap 让 Pillow 先用 reduce() 做整数倍缩小，其余格式也能少处理大部分像素
+    resized_image = normalize_image_mode(image).resize(new_size, Image.Resampling[RESIZE_FILTERS[quality]],
+                                                       reducing_gap=3.0)
+
+    info = {'quality': quality, 'source_size': (source_width, source_height), 'draft_scale': draft_scale,
+            'mapped_factor': mapped_factor, 'decode_ms': (time.perf_counter() - start) * 1000}
+    return to_display_mode(resized_image), ratio, info
+
+
+def format_decode_info(info):
+    """把解码信息格式化为状态栏文字"""
+    width, height = info['source_size']
+    text = f"解码: {info['quality']} | 原图 {width}x{height}"
+    if info.get('from_cache'):
+        text += " | 磁盘缓存"
+    elif info.get('mapped_factor'):
+        text += f" | mmap 1/{info['mapped_factor']}"
+    elif info['draft_scale'] > 1:
+        text += f" | DCT 1/{info['draft_scale']:g}"
+    return text + f" | {info['decode_ms']:.1f} ms"
+
+
 def point_in_polygon(point, polygon):
+    """射线法判断点是否在多边形内；顶点多时对所有边一次性向量化计算"""
     x, y = point
-    n = len(polygon)
-    inside = False
-    p1x, p1y = polygon[0]
-    for i in range(n + 1):
-        p2x, p2y = polygon[i % n]
-        if min(p1y, p2y) < y <= max(p1y, p2y):
-            if x <= max(p1x, p2x):
-                if p1y != p2y:
-                    xinters = (y - p1y) * (p2x - p1x) / (p2y - p1y) + p1x
-                if p1x == p2x or x <= xinters:
-                    inside = not inside
-        p1x, p1y = p2x, p2y
-    return inside
+    polygon = np.asarray(polygon, dtype=np.float64)
+    if len(polygon) < 64:
+        # 顶点少时 NumPy 的调用开销大于逐边循环
+        inside = False
+        vertices = polygon.tolist()
+        x1, y1 = vertices[-1]
+        for x2, y2 in vertices:
+            if (y1 < y) != (y2 < y) and x <= x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+                inside = not inside
+            x1, y1 = x2, y2
+        return inside
+    x1, y1 = polygon[:, 0], polygon[:, 1]
+    x2, y2 = np.roll(x1, -1), np.roll(y1, -1)
+    crosses = (y1 < y) != (y2 < y)  # 边跨过水平线 y（不含下端点，顶点处不会重复计数）
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_intersections = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+    return bool(np.count_nonzero(crosses & (x <= x_intersections)) % 2)
+
+
+def polygon_area(points):
+    """用鞋带公式计算多边形面积"""
+    points = np.asarray(points, dtype=np.float64)
+    if len(points) < 3:
+        return 0.0
+    x, y = points[:, 0], points[:, 1]
+    twice_area = np.dot(x[:-1], y[1:]) - np.dot(x[1:], y[:-1]) + x[-1] * y[0] - x[0] * y[-1]
+    return abs(float(twice_area)) / 2
+
+
+def image_to_display(points, ratio, x_offset, y_offset):
+    """原图坐标 -> 显示坐标，points 为 (N, 2) 数组，整体做一次仿射变换"""
+    return np.asarray(points, dtype=np.float64) * ratio + (x_offset, y_offset)
+
+
+def display_to_image(points, ratio, x_offset, y_offset):
+    """显示坐标 -> 原图坐标，是 image_to_display 的精确逆变换（不取整）"""
+    return (np.asarray(points, dtype=np.float64) - (x_offset, y_offset)) / ratio
+
+
+def polygon_from_points(points):
+    """用 (N, 2) 坐标数组一次性填充 QPolygonF 的内存，不逐点构造 QPointF"""
+    points = np.ascontiguousarray(points, dtype=np.float64)
+    polygon = QPolygonF(len(points))
+    if len(points):
+        buffer = polygon.data()
+        buffer.setsize(points.nbytes)
+        np.frombuffer(buffer, dtype=np.float64).reshape(-1, 2)[:] = points
+    return polygon
+
+
+def simplify_polygon(points, tolerance):
+    """Douglas-Peucker 简化闭合多边形，返回保留的顶点（原数组的子集，不修改原数组）
+
+    先以第一个顶点和离它最远的顶点把多边形分成两条折线，再分别迭代简化；
+    结果少于 3 个顶点时返回原多边形。
+    """
+    points = np.asarray(points, dtype=np.float64)
+    n = len(points)
+    if tolerance <= 0 or n <= 4:
+        return points
+    farthest = int(np.argmax(((points - points[0]) ** 2).sum(axis=1)))
+    ring = np.vstack([points, points[:1]])
+    keep = np.zeros(n + 1, dtype=bool)
+    keep[[0, farthest, n]] = True
+    stack = [(0, farthest), (farthest, n)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        (ax, ay), (bx, by) = ring[start], ring[end]
+        segment = ring[start + 1:end]
+        dx, dy = bx - ax, by - ay
+        length = math.hypot(dx, dy)
+        if length == 0:
+            distances = np.hypot(segment[:, 0] - ax, segment[:, 1] - ay)
+        else:
+            distances = np.abs(dx * (segment[:, 1] - ay) - dy * (segment[:, 0] - ax)) / length
+        i = int(np.argmax(distances))
+        if distances[i] > tolerance:
+            split = start + 1 + i
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    result = points[keep[:n]]
+    return result if len(result) >= 3 else points
+
+
+def add_annotation_geometry(annotation):
+    """为标注补充外接框 'bbox' (xmin, ymin, xmax, ymax) 和面积 'area'，供空间索引使用"""
+    points = annotation['points'] = np.asarray(annotation['points'], dtype=np.float64).reshape(-1, 2)
+    xmin, ymin = points.min(axis=0).tolist()
+    xmax, ymax = points.max(axis=0).tolist()
+    annotation['bbox'] = (xmin, ymin, xmax, ymax)
+    if annotation['type'] == 'rectangle':
+        annotation['area'] = (xmax - xmin) * (ymax - ymin)
+    else:
+        annotation['area'] = polygon_area(points)
+    return annotation
+
+
+class AnnotationGridIndex:
+    """标注外接框的均匀网格空间索引
+
+    每个标注登记在其外接框覆盖的所有网格单元中。点击时先取出所在单元里外接框包含该点的候选标注，
+    再对候选做精确的多边形/矩形包含测试。网格中保存的是标注字典本身，删除标注后重新编号也不影响索引。
+    """
+
+    def __init__(self, annotations=(), cell_size=GRID_CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = {}  # (列, 行) -> [标注, ...]
+        for annotation in annotations:
+            self.insert(annotation)
+
+    def _cell_range(self, bbox):
+        xmin, ymin, xmax, ymax = bbox
+        size = self.cell_size
+        for col in range(int(math.floor(xmin / size)), int(math.floor(xmax / size)) + 1):
+            for row in range(int(math.floor(ymin / size)), int(math.floor(ymax / size)) + 1):
+                yield col, row
+
+    def insert(self, annotation):
+        if 'bbox' not in annotation:
+            add_annotation_geometry(annotation)
+        for cell in self._cell_range(annotation['bbox']):
+            self.cells.setdefault(cell, []).append(annotation)
+
+    def remove(self, annotation):
+        for cell in self._cell_range(annotation['bbox']):
+            bucket = self.cells.get(cell)
+            if bucket is None:
+                continue
+            bucket[:] = [a for a in bucket if a is not annotation]
+            if not bucket:
+                del self.cells[cell]
+
+    def candidates(self, x, y):
+        """返回外接框包含点 (x, y) 的标注"""
+        bucket = self.cells.get((int(math.floor(x / self.cell_size)), int(math.floor(y / self.cell_size))), ())
+        return [a for a in bucket if a['bbox'][0] <= x <= a['bbox'][2] and a['bbox'][1] <= y <= a['bbox'][3]]
+
+    def hit_test(self, x, y):
+        """返回包含点 (x, y) 的所有标注，重叠时面积小的排在前面"""
+        hits = [a for a in self.candidates(x, y)
+                if a['type'] == 'rectangle' or point_in_polygon((x, y), a['points'])]
+        hits.sort(key=lambda a: a['area'])
+        return hits
+
+
+def natural_sort_key(text):
+    """自然排序键：img2 排在 img10 之前，且不区分大小写"""
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', text)]
+
+
+def is_image_file(name):
+    return name.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def image_sort_key(relative_path):
+    """图片在列表中的排序键，与 DirectoryScanner 的输出顺序一致：同一目录下先文件、后子目录"""
+    parts = relative_path.replace('\\', '/').split('/')
+    return [(1, natural_sort_key(part)) for part in parts[:-1]] + [(0, natural_sort_key(parts[-1]))]
+
+
+def iter_directory_files(directory, recursive=False, accept=is_image_file, is_cancelled=None):
+    """用 os.scandir 遍历目录：先按自然顺序输出当前目录中 accept(文件名) 为真的文件，再递归进入子目录"""
+    files, sub_dirs = [], []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if is_cancelled is not None and is_cancelled():
+                    return
+                try:
+                    if entry.is_file() and accept(entry.name):
+                        files.append(entry.name)
+                    elif recursive and not entry.name.startswith('.') and entry.is_dir(follow_symlinks=False):
+                        sub_dirs.append(entry.name)
+                except OSError:
+                    continue
+    except OSError as e:
+        print(f"Error: 无法读取目录 {directory}: {e}")
+        return
+    files.sort(key=natural_sort_key)
+    for name in files:
+        yield os.path.join(directory, name)
+    sub_dirs.sort(key=natural_sort_key)
+    for name in sub_dirs:
+        if is_cancelled is not None and is_cancelled():
+            return
+        yield from iter_directory_files(os.path.join(directory, name), recursive, accept, is_cancelled)
+
+
+def snapshot_directory(directory, is_cancelled=None):
+    """列出目录中的图片和标注文件，返回 ({文件名: (修改时间, 大小)}, [子目录名])，目录不存在时返回 None
+
+    比较同一目录的两次快照即可找出新增、删除和修改过的文件。is_cancelled() 为真时提前返回不完整的快照。
+    """
+    files, sub_dirs = {}, []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if is_cancelled is not None and is_cancelled():
+                    break
+                try:
+                    if entry.is_file():
+                        if is_image_file(entry.name) or entry.name.lower().endswith(ANNOTATION_EXTENSIONS):
+                            stat = entry.stat()
+                            files[entry.name] = (stat.st_mtime_ns, stat.st_size)
+                    elif not entry.name.startswith('.') and entry.is_dir(follow_symlinks=False):
+                        sub_dirs.append(entry.name)
+                except OSError:
+                    continue  # 列出目录后文件又被删除
+    except OSError:
+        return None
+    return files, sub_dirs
+
+
+def find_annotation_path(file_path):
+    """查找图片对应的标注文件，优先使用 JSON，其次 XML，找不到返回 None"""
+    base_path = file_path.rsplit('.', 1)[0]
+    for extension in ('.json', '.xml'):
+        if os.path.exists(base_path + extension):
+            return base_path + extension
+    return None
+
+
+class _JsonFieldReader:
+    """从二进制 JSON 文件中流式读取顶层对象的某个字段
+
+    逐块读取文件，只把目标字段的值放进内存解析；其他字段（例如几 MB 的 base64 imageData）
+    只扫描一遍找到结尾，已扫描的内容随即丢弃，不构造字符串对象。找到目标字段后立即停止读取。
+    """
+    CHUNK_SIZE = 64 * 1024
+    _STRUCTURE = re.compile(rb'["\[\]{}]')
+    _SCALAR_END = re.compile(rb'[,}\]\s]')
+    _WHITESPACE = b' \t\r\n'
+    _DECODER = json.JSONDecoder()
+
+    def __init__(self, file):
+        self.file = file
+        self.buf = b''
+        self.pos = 0
+
+    def _fill(self, discard=True, size=None):
+        """读入下一块数据；discard 为 True 时丢弃 self.pos 之前已经处理过的内容"""
+        chunk = self.file.read(size or self.CHUNK_SIZE)
+        if not chunk:
+            return False
+        if discard:
+            self.buf = self.buf[self.pos:] + chunk
+            self.pos = 0
+        else:
+            self.buf += chunk
+        return True
+
+    def _peek(self):
+        while self.pos >= len(self.buf):
+            if not self._fill():
+                raise ValueError("unexpected end of JSON")
+        return self.buf[self.pos:self.pos + 1]
+
+    def _skip_whitespace(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in self._WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf) or not self._fill():
+                return
+
+    def _expect(self, token):
+        self._skip_whitespace()
+        if self._peek() != token:
+            raise ValueError(f"expected {token!r}")
+        self.pos += 1
+
+    def _skip_string(self, keep):
+        """self.pos 位于开头引号之后，移动到结尾引号之后"""
+        while True:
+            quote = self.buf.find(b'"', self.pos)
+            if quote == -1:
+                if keep:
+                    self.pos = len(self.buf)
+                else:
+                    # 保留末尾连续的反斜杠，用来判断下一块开头的引号是否被转义
+                    self.pos = len(self.buf.rstrip(b'\\'))
+                if not self._fill(discard=not keep):
+                    raise ValueError("unterminated JSON string")
+                continue
+            backslash = quote - 1
+            while backslash >= 0 and self.buf[backslash] == 0x5C:
+                backslash -= 1
+            self.pos = quote + 1
+            if (quote - 1 - backslash) % 2 == 0:
+                return
+
+    def _skip_value(self, keep):
+        """把 self.pos 移动到当前值之后；keep 为 False 时扫描过的内容会被丢弃"""
+        token = self._peek()
+        if token == b'"':
+            self.pos += 1
+            self._skip_string(keep)
+            return
+        if token not in (b'[', b'{'):
+            # 数字、true、false、null
+            while True:
+                match = self._SCALAR_END.search(self.buf, self.pos)
+                if match is not None:
+                    self.pos = match.start()
+                    return
+                self.pos = len(self.buf)
+                if not self._fill(discard=not keep):
+                    return
+        depth = 0
+        while True:
+            match = self._STRUCTURE.search(self.buf, self.pos)
+            if match is None:
+                self.pos = len(self.buf)
+                if not self._fill(discard=not keep):
+                    raise ValueError("unexpected end of JSON")
+                continue
+            token = match.group()
+            self.pos = match.end()
+            if token == b'"':
+                self._skip_string(keep)
+            elif token in (b'[', b'{'):
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return
+
+    def _read_value(self):
+        """把当前值完整读入内存并用 C 实现的 JSON 解码器解析
+
+        值可能被截断在缓冲区末尾：解析失败、或解析结果恰好结束在缓冲区末尾（数字可能还没读完）时，
+        读入与当前缓冲区等量的数据后重试，重试次数与值的大小成对数关系。
+        """
+        self.buf = self.buf[self.pos:]
+        self.pos = 0
+        while True:
+            try:
+                text = self.buf.decode('utf-8')
+                value, end = self._DECODER.raw_decode(text)
+                if end < len(text):
+                    self.pos = len(text[:end].encode('utf-8'))
+                    return value
+            except (ValueError, UnicodeDecodeError):
+                value = None
+            if not self._fill(discard=False, size=max(self.CHUNK_SIZE, len(self.buf))):
+                if value is None:
+                    raise ValueError("invalid JSON value")
+                self.pos = len(self.buf)
+                return value
+
+    def read_fields(self, names):
+        """读取顶层对象中 names 中的字段，返回 {字段名: 值}，不存在的字段不出现在结果中
+
+        所有字段都找到后立即停止读取。
+        """
+        names = set(names)
+        values = {}
+        while len(self.buf) < 3 and self._fill():
+            pass
+        if self.buf.startswith(b'\xef\xbb\xbf'):
+            self.pos = 3  # UTF-8 BOM
+        self._expect(b'{')
+        while len(values) < len(names):
+            self._skip_whitespace()
+            token = self._peek()
+            if token == b'}':
+                break
+            if token == b',':
+                self.pos += 1
+                continue
+            key = self._read_value()
+            self._expect(b':')
+            self._skip_whitespace()
+            if key in names:
+                values[key] = self._read_value()
+            else:
+                self._skip_value(keep=False)
+        return values
+
+
+def read_json_fields(path, names):
+    """流式读取 JSON 文件顶层对象的多个字段，返回 {字段名: 值}；流式解析失败时退回完整解析"""
+    with open(path, 'rb') as file:
+        try:
+            return _JsonFieldReader(file).read_fields(names)
+        except (ValueError, UnicodeDecodeError):
+            file.seek(0)
+            document = json.loads(file.read().decode('utf-8-sig'))
+            return {name: document[name] for name in names if name in document}
+
+
+def rectangle_corners(xmin, ymin, xmax, ymax):
+    """矩形从左上角开始顺时针的四个角点"""
+    return np.array([(xmin, ymin), (xmax, ymin), (xmax, ymax), (xmin, ymax)], dtype=np.float64)
+
+
+def load_annotation_shapes(annotation_path, image_info=None):
+    """读取标注文件中的形状，坐标为原图坐标
+
+    返回 [{'type': 'polygon' 或 'rectangle', 'label': 标签, 'points': (N, 2) 浮点数组}, ...]，
+    矩形的 points 是从左上角开始顺时针的四个角点（LabelMe 的 rectangle 形状保存为两个对角点）。
+    JSON 只流式读取需要的字段，跳过 imageData；XML 用 iterparse 只处理 object 元素，处理完立即释放。
+    image_info 为 dict 时同时填入文件中记录的图片尺寸 'width'、'height'（XML 还有 'depth'）。
+    """
+    shapes = []
+    if annotation_path.endswith('.json'):
+        names = ('shapes', 'imageWidth', 'imageHeight') if image_info is not None else ('shapes',)
+        fields = read_json_fields(annotation_path, names)
+        for shape in fields['shapes']:
+            points = np.asarray(shape['points'], dtype=np.float64).reshape(-1, 2)
+            if shape.get('shape_type') == 'rectangle' and len(points) == 2:
+                (xmin, ymin), (xmax, ymax) = points.min(axis=0), points.max(axis=0)
+                shapes.append({'type': 'rectangle', 'label': shape['label'],
+                               'points': rectangle_corners(xmin, ymin, xmax, ymax)})
+            else:
+                shapes.append({'type': 'polygon', 'label': shape['label'], 'points': points})
+        if image_info is not None:
+            image_info.update(width=fields.get('imageWidth'), height=fields.get('imageHeight'))
+    elif annotation_path.endswith('.xml'):
+        depth = 0
+        for event, element in ET.iterparse(annotation_path, events=('start', 'end')):
+            if event == 'start':
+                depth += 1
+                continue
+            depth -= 1
+            if depth != 1:
+                continue
+            # 根元素的直接子元素
+            if element.tag == 'object':
+                bndbox = element.find('bndbox')
+                xmin = float(bndbox.find('xmin').text)
+                ymin = float(bndbox.find('ymin').text)
+                xmax = float(bndbox.find('xmax').text)
+                ymax = float(bndbox.find('ymax').text)
+                shapes.append({'type': 'rectangle', 'label': element.find('name').text,
+                               'points': rectangle_corners(xmin, ymin, xmax, ymax)})
+            elif element.tag == 'size' and image_info is not None:
+                for key in ('width', 'height', 'depth'):
+                    value = element.findtext(key)
+                    if value and value.strip():
+                        image_info[key] = int(float(value))
+            element.clear()
+    return shapes
+
+
+@timed('parse')
+def parse_annotation_file(annotation_path, ratio, x_offset, y_offset):
+    """解析 JSON/XML 标注文件，并把坐标换算到显示坐标系
+
+    所有形状的顶点拼成一个数组，整体做一次仿射变换后再按形状切分，坐标保持浮点数不取整。
+    """
+    shapes = load_annotation_shapes(annotation_path)
+    if not shapes:
+        return []
+    sizes = [len(shape['points']) for shape in shapes]
+    display_points = image_to_display(np.concatenate([shape['points'] for shape in shapes]), ratio, x_offset, y_offset)
+    annotations = []
+    for i, (shape, points) in enumerate(zip(shapes, np.split(display_points, np.cumsum(sizes)[:-1]))):
+        annotations.append(add_annotation_geometry(
+            {'type': shape['type'], 'points': points, 'label': shape['label'], 'index': i}))
+    return annotations
+
+
+def summarize_annotation_file(annotation_path):
+    """统计一个标注文件中的形状，在进程池中运行
+
+    返回 (路径, 条目)，条目记录文件的 mtime 和大小，以及每个形状的
+    [标签, 类型, 面积, 外接框面积, 顶点数, xmin, ymin, xmax, ymax]；文件无法读取（例如扫描后被删除）或
+    无法解析时记录错误信息。
+    """
+    entry = {'mtime_ns': None, 'size': None, 'shapes': [], 'error': None}
+    try:
+        stat = os.stat(annotation_path)
+        entry.update(mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+        for shape in load_annotation_shapes(annotation_path):
+            add_annotation_geometry(shape)
+            xmin, ymin, xmax, ymax = shape['bbox']
+            bbox_area = (xmax - xmin) * (ymax - ymin)
+            entry['shapes'].append([shape['label'], shape['type'], round(shape['area'], 2), round(bbox_area, 2),
+                                    len(shape['points']), xmin, ymin, xmax, ymax])
+    except Exception as e:
+        entry['shapes'] = []
+        entry['error'] = f"{type(e).__name__}: {e}"
+    return annotation_path, entry
+
+
+def make_process_pool(workers=None, from_gui=False):
+    """创建进程池；在已启动 Qt 线程的界面进程中使用 spawn，避免 fork 复制线程状态"""
+    context = multiprocessing.get_context('spawn') if from_gui else None
+    return ProcessPoolExecutor(max_workers=workers, mp_context=context)
+
+
+def process_map(func, items, workers=None, from_gui=False, is_cancelled=None):
+    """按顺序依次产生 func(item) 的结果，条目较多时使用进程池（func 必须是模块级函数）"""
+    if len(items) < 64 or workers == 1:
+        for item in items:
+            if is_cancelled is not None and is_cancelled():
+                return
+            yield func(item)
+        return
+    with make_process_pool(workers, from_gui) as pool:
+        for result in pool.map(func, items, chunksize=max(1, min(256, len(items) // 64))):
+            if is_cancelled is not None and is_cancelled():
+                pool.shutdown(wait=False, cancel_futures=True)
+                return
+            yield result
+
+
+def summarize_annotation_files(paths, workers=None, from_gui=False, is_cancelled=None):
+    """依次产生 summarize_annotation_file 的结果，文件较多时使用进程池"""
+    return process_map(summarize_annotation_file, paths, workers, from_gui, is_cancelled)
+
+
+def default_index_path(directory, name):
+    """数据集索引文件的默认位置：用户缓存目录下以数据集路径的哈希命名"""
+    digest = hashlib.sha1(os.path.abspath(directory).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(default_cache_dir(), 'index', f"{digest}.{name}")
+
+
+def build_dataset_index(directory, recursive=True, index_path=None, workers=None, progress=None):
+    """扫描数据集目录并统计所有标注文件，只重新解析 mtime 或大小变化过的文件
+
+    返回 (图片路径列表, {标注路径: 条目}, 本次重新解析的文件数)。结果以紧凑 JSON 保存在 index_path 中，供下次复用。
+    """
+    directory = os.path.abspath(directory)
+    index_path = index_path or default_index_path(directory, 'stats.json')
+    previous = {}
+    try:
+        with open(index_path, 'r') as file:
+            index = json.load(file)
+        if index.get('version') == 3 and index.get('root') == directory:
+            previous = index['files']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    images, annotation_paths = [], []
+    for path in iter_directory_files(directory, recursive,
+                                     accept=lambda name: is_image_file(name) or name.endswith(ANNOTATION_EXTENSIONS)):
+        (images if is_image_file(path) else annotation_paths).append(path)
+
+    entries, todo = {}, []
+    for path in annotation_paths:
+        cached = previous.get(os.path.relpath(path, directory))
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        if cached is not None and cached['mtime_ns'] == stat.st_mtime_ns and cached['size'] == stat.st_size:
+            entries[path] = cached
+        else:
+            todo.append(path)
+
+    for done, (path, entry) in enumerate(summarize_annotation_files(todo, workers), 1):
+        entries[path] = entry
+        if progress is not None and (done % 1000 == 0 or done == len(todo)):
+            progress(done, len(todo))
+
+    os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+    index = {'version': 3, 'root': directory,
+             'files': {os.path.relpath(path, directory): entry for path, entry in entries.items()}}
+    write_file_atomic(index_path, json.dumps(index, separators=(',', ':'), ensure_ascii=False).encode('utf-8'))
+    return images, entries, len(todo)
+
+
+def area_histogram(areas):
+    """按 2 的幂划分面积区间，返回 [(区间下限, 数量), ...]，下限 0 表示面积小于 1"""
+    counts = {}
+    for area in areas:
+        bucket = 0 if area < 1 else 2 ** int(math.floor(math.log2(area)))
+        counts[bucket] = counts.get(bucket, 0) + 1
+    return sorted(counts.items())
+
+
+def compute_dataset_report(images, entries):
+    """根据图片列表和标注统计条目汇总数据集报告"""
+    image_bases = {path.rsplit('.', 1)[0] for path in images}
+    annotation_by_base = {}
+    for path in entries:
+        annotation_by_base.setdefault(path.rsplit('.', 1)[0], []).append(path)
+
+    label_shapes, label_images = {}, {}
+    polygon_areas, bbox_areas = [], []
+    missing, empty, malformed = [], [], []
+    for image in images:
+        # 与查看器相同的规则：优先使用 JSON，其次 XML
+        base = image.rsplit('.', 1)[0]
+        candidates = annotation_by_base.get(base, [])
+        annotation_path = next((base + ext for ext in ANNOTATION_EXTENSIONS if base + ext in candidates), None)
+        if annotation_path is None:
+            missing.append(image)
+            continue
+        entry = entries[annotation_path]
+        for label in {shape[0] for shape in entry['shapes']}:
+            label_images[label] = label_images.get(label, 0) + 1
+        for label, shape_type, area, bbox_area in (shape[:4] for shape in entry['shapes']):
+            label_shapes[label] = label_shapes.get(label, 0) + 1
+            bbox_areas.append(bbox_area)
+            if shape_type == 'polygon':
+                polygon_areas.append(area)
+    for path in sorted(entries, key=natural_sort_key):
+        if entries[path]['error']:
+            malformed.append((path, entries[path]['error']))
+        elif not entries[path]['shapes']:
+            empty.append(path)
+    orphaned = sorted((path for base, paths in annotation_by_base.items() if base not in image_bases
+                       for path in paths), key=natural_sort_key)
+    return {
+        'images': len(images),
+        'annotation_files': len(entries),
+        'shapes': sum(label_shapes.values()),
+        'labels': {label: {'shapes': label_shapes[label], 'images': label_images[label]}
+                   for label in sorted(label_shapes, key=lambda l: -label_shapes[l])},
+        'bbox_area_histogram': area_histogram(bbox_areas),
+        'polygon_area_histogram': area_histogram(polygon_areas),
+        'missing_annotations': missing,
+        'orphaned_annotations': orphaned,
+        'empty_annotations': empty,
+        'malformed_annotations': [{'path': path, 'error': error} for path, error in malformed],
+    }
+
+
+def print_dataset_report(report, limit=20):
+    """以文本形式输出数据集报告，文件列表最多显示 limit 条"""
+    print(f"图片: {report['images']}  标注文件: {report['annotation_files']}  形状: {report['shapes']}")
+    print("\n标签统计（形状数 / 图片数）:")
+    for label, counts in report['labels'].items():
+        print(f"  {label}: {counts['shapes']} / {counts['images']}")
+    for key, title in (('bbox_area_histogram', '外接框面积分布'), ('polygon_area_histogram', '多边形面积分布')):
+        histogram = report[key]
+        if not histogram:
+            continue
+        print(f"\n{title}（原图像素）:")
+        largest = max(count for _, count in histogram)
+        for lower, count in histogram:
+            span = "< 1" if lower == 0 else f"{lower}-{lower * 2}"
+            print(f"  {span:>16}: {count:>8} {'#' * max(1, count * 40 // largest)}")
+    for key, title in (('missing_annotations', '缺少标注的图片'), ('orphaned_annotations', '没有对应图片的标注'),
+                       ('empty_annotations', '空标注文件'), ('malformed_annotations', '无法解析的标注文件')):
+        items = report[key]
+        print(f"\n{title}: {len(items)}")
+        for item in items[:limit]:
+            print(f"  {item['path']}: {item['error']}" if isinstance(item, dict) else f"  {item}")
+        if len(items) > limit:
+            print(f"  ...（还有 {len(items) - limit} 个）")
+
+
+def run_stats_command(args):
+    """命令行模式：统计数据集，不启动图形界面"""
+    start = time.perf_counter()
+
+    def progress(done, total):
+        print(f"解析标注文件 {done}/{total}", file=sys.stderr)
+
+    images, entries, parsed = build_dataset_index(args.stats, recursive=not args.no_recursive,
+                                                  index_path=args.index, workers=args.workers, progress=progress)
+    report = compute_dataset_report(images, entries)
+    if args.json:
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    else:
+        print_dataset_report(report)
+    print(f"重新解析 {parsed} 个标注文件，耗时 {time.perf_counter() - start:.2f} s", file=sys.stderr)
+    return 0
+
+
+def labelme_shape(label, points, shape_type='polygon'):
+    """构造 LabelMe 的 shape；矩形按 LabelMe 的约定保存为左上、右下两个对角点"""
+    points = np.asarray(points, dtype=np.float64)
+    if shape_type == 'rectangle':
+        points = np.array([points.min(axis=0), points.max(axis=0)])
+    return {'label': label, 'points': points.tolist(), 'group_id': None, 'shape_type': shape_type, 'flags': {}}
+
+
+def voc_object(label, points):
+    """构造 VOC 的 object 元素，bndbox 为 points 的外接框，四舍五入为整数像素
+
+    返回 (元素, (xmin, ymin, xmax, ymax))。
+    """
+    points = np.rint(np.asarray(points, dtype=np.float64))
+    xmin, ymin = points.min(axis=0).astype(int).tolist()
+    xmax, ymax = points.max(axis=0).astype(int).tolist()
+    obj = ET.Element('object')
+    ET.SubElement(obj, 'name').text = label
+    bndbox = ET.SubElement(obj, 'bndbox')
+    ET.SubElement(bndbox, 'xmin').text = str(xmin)
+    ET.SubElement(bndbox, 'ymin').text = str(ymin)
+    ET.SubElement(bndbox, 'xmax').text = str(xmax)
+    ET.SubElement(bndbox, 'ymax').text = str(ymax)
+    return obj, (xmin, ymin, xmax, ymax)
+
+
+def encode_annotation_document(document):
+    """把 LabelMe 文档（dict）或 VOC 文档（ElementTree）序列化为写入文件的字节"""
+    if isinstance(document, dict):
+        return json.dumps(document, indent=4).encode('utf-8')
+    return ET.tostring(document.getroot())
+
+
+def read_annotation_record(annotation_path, image_path):
+    """读取一张图片的标注，返回与格式无关的记录 {'width', 'height', 'depth', 'shapes'}
+
+    shapes 与 load_annotation_shapes 相同；标注文件中没有图片尺寸时只读取图片的文件头。
+    """
+    info = {}
+    shapes = load_annotation_shapes(annotation_path, info) if annotation_path is not None else []
+    if not info.get('width') or not info.get('height'):
+        with Image.open(image_path) as image:
+            info.update(width=image.width, height=image.height, depth=len(image.getbands()))
+    return {'width': info['width'], 'height': info['height'], 'depth': info.get('depth', 3), 'shapes': shapes}
+
+
+def labelme_document(record, image_path, annotation_path):
+    """由标注记录生成 LabelMe JSON 文档，imagePath 为图片相对标注文件的路径，不内嵌 imageData"""
+    return {'version': '5.0.1', 'flags': {},
+            'shapes': [labelme_shape(shape['label'], shape['points'], shape['type']) for shape in record['shapes']],
+            'imagePath': os.path.relpath(image_path, os.path.dirname(os.path.abspath(annotation_path))),
+            'imageData': None, 'imageHeight': record['height'], 'imageWidth': record['width']}
+
+
+def voc_document(record, image_path):
+    """由标注记录生成 VOC XML 文档，多边形保存为外接矩形"""
+    root = ET.Element('annotation')
+    ET.SubElement(root, 'folder').text = os.path.basename(os.path.dirname(os.path.abspath(image_path)))
+    ET.SubElement(root, 'filename').text = os.path.basename(image_path)
+    size = ET.SubElement(root, 'size')
+    ET.SubElement(size, 'width').text = str(record['width'])
+    ET.SubElement(size, 'height').text = str(record['height'])
+    ET.SubElement(size, 'depth').text = str(record['depth'])
+    ET.SubElement(root, 'segmented').text = '0'
+    for shape in record['shapes']:
+        root.append(voc_object(shape['label'], shape['points'])[0])
+    ET.indent(root)
+    return ET.ElementTree(root)
+
+
+def coco_annotation_body(shape):
+    """COCO 标注中与编号无关的字段（segmentation、area、bbox、iscrowd），序列化为不含花括号的 JSON 片段"""
+    points = np.asarray(shape['points'], dtype=np.float64)
+    (xmin, ymin), (xmax, ymax) = points.min(axis=0), points.max(axis=0)
+    area = (xmax - xmin) * (ymax - ymin) if shape['type'] == 'rectangle' else polygon_area(points)
+    body = {'segmentation': [points.ravel().tolist()], 'area': float(area),
+            'bbox': [float(xmin), float(ymin), float(xmax - xmin), float(ymax - ymin)], 'iscrowd': 0}
+    return json.dumps(body)[1:-1]
+
+
+def convert_annotation_file(task):
+    """转换一张图片的标注，在进程池中运行
+
+    task 包含 image_path、target，以及 annotation_path（读取标注文件）或 record（已读取的记录，例如来自 COCO）。
+    target 为 'labelme'/'voc' 时写入 task['output_path']；为 'coco' 时不写文件，把记录返回给主进程，
+    记录中的形状只保留标签和预先序列化的 COCO 字段，主进程只需编号和写入。
+    返回 {'image_path', 'record', 'boxed': 转换为外接矩形的多边形数, 'error'}。
+    """
+    result = {'image_path': task['image_path'], 'record': None, 'boxed': 0, 'error': None}
+    try:
+        record = task.get('record') or read_annotation_record(task['annotation_path'], task['image_path'])
+        target = task['target']
+        if target == 'coco':
+            shapes = [{'label': shape['label'], 'coco': coco_annotation_body(shape)} for shape in record['shapes']]
+            result['record'] = dict(record, shapes=shapes)
+        elif target == 'labelme':
+            document = labelme_document(record, task['image_path'], task['output_path'])
+        else:
+            document = voc_document(record, task['image_path'])
+            result['boxed'] = sum(1 for shape in record['shapes'] if shape['type'] == 'polygon')
+        if target != 'coco':
+            os.makedirs(os.path.dirname(os.path.abspath(task['output_path'])), exist_ok=True)
+            write_file_atomic(task['output_path'], encode_annotation_document(document))
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    return result
+
+
+class CocoWriter:
+    """流式写出 COCO JSON，内存占用与数据集大小无关
+
+    images 直接写入输出文件，annotations 先写入同目录的临时文件，结束时拼接到后面，
+    categories 在遇到新标签时编号，最后写入。整个文件先写到临时文件，完成后再重命名替换。
+    """
+
+    def __init__(self, path, categories=()):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, self._temp_path = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', suffix='.tmp',
+                                               dir=directory)
+        self._file = os.fdopen(fd, 'w', encoding='utf-8')
+        self._annotations = tempfile.TemporaryFile('w+', encoding='utf-8', dir=directory)
+        self.categories = {name: i for i, name in enumerate(categories, 1)}
+        self.image_count = 0
+        self.annotation_count = 0
+        self._file.write('{"info": {"description": "exported by ImageAnnotationViewer"}, "images": [')
+
+    def category_id(self, label):
+        if label not in self.categories:
+            self.categories[label] = len(self.categories) + 1
+        return self.categories[label]
+
+    def add_image(self, file_name, record):
+        """写入一张图片及其全部形状，返回图片 id；形状可以带有 coco_annotation_body 预先生成的 'coco' 片段"""
+        self.image_count += 1
+        image_id = self.image_count
+        image = {'id': image_id, 'file_name': file_name, 'width': record['width'], 'height': record['height']}
+        self._file.write((',' if image_id > 1 else '') + json.dumps(image, ensure_ascii=False))
+        for shape in record['shapes']:
+            body = shape.get('coco') or coco_annotation_body(shape)
+            self.annotation_count += 1
+            self._annotations.write(f'{"," if self.annotation_count > 1 else ""}{{"id": {self.annotation_count}, '
+                                    f'"image_id": {image_id}, "category_id": {self.category_id(shape["label"])}, '
+                                    f'{body}}}')
+        return image_id
+
+    def close(self):
+        """写完 annotations 和 categories，替换输出文件"""
+        self._file.write('], "annotations": [')
+        self._annotations.seek(0)
+        shutil.copyfileobj(self._annotations, self._file, 1024 * 1024)
+        self._annotations.close()
+        categories = [{'id': i, 'name': name, 'supercategory': ''} for name, i in self.categories.items()]
+        self._file.write('], "categories": ' + json.dumps(categories, ensure_ascii=False) + '}')
+        self._file.close()
+        set_replacement_mode(self._temp_path, self.path)
+        os.replace(self._temp_path, self.path)
+
+    def abort(self):
+        """放弃写入，删除临时文件"""
+        self._annotations.close()
+        self._file.close()
+        if os.path.exists(self._temp_path):
+            os.remove(self._temp_path)
+
+
+def iter_coco_records(coco_path):
+    """读取 COCO JSON，按 images 的顺序产生 (file_name, 标注记录)
+
+    多段的 segmentation 每段作为一个多边形；与 bbox 重合的轴对齐四边形还原为矩形；
+    没有多边形的标注（RLE 或只有 bbox）使用 bbox 作为矩形。
+    """
+    with open(coco_path, 'r', encoding='utf-8-sig') as file:
+        coco = json.load(file)
+    labels = {category['id']: category['name'] for category in coco.get('categories', [])}
+    shapes_by_image = {}
+    for annotation in coco.get('annotations', []):
+        label = labels.get(annotation['category_id'], str(annotation['category_id']))
+        x, y, w, h = annotation.get('bbox') or (0, 0, 0, 0)
+        box = rectangle_corners(x, y, x + w, y + h)
+        segmentation = annotation.get('segmentation')
+        polygons = [np.asarray(part, dtype=np.float64).reshape(-1, 2) for part in segmentation
+                    if len(part) >= 6] if isinstance(segmentation, list) else []
+        shapes = shapes_by_image.setdefault(annotation['image_id'], [])
+        for points in polygons or [box]:
+            is_box = len(points) == 4 and np.allclose(np.sort(points, axis=0), np.sort(box, axis=0))
+            shapes.append({'type': 'rectangle' if is_box else 'polygon', 'label': label,
+                           'points': box if is_box else points})
+    for image in coco.get('images', []):
+        yield image['file_name'], {'width': image['width'], 'height': image['height'], 'depth': 3,
+                                   'shapes': shapes_by_image.get(image['id'], [])}
+
+
+def convert_dataset(source, target, output=None, recursive=True, overwrite=False, workers=None,
+                    progress=None, from_gui=False, is_cancelled=None):
+    """在 LabelMe JSON、VOC XML 与 COCO JSON 之间批量转换标注，读取和写入在进程池中并行
+
+    source 为图片目录（每张图片按查看器的规则使用同名的 JSON 或 XML）或 COCO JSON 文件。
+    target 为 'labelme'/'voc' 时，每张图片写一个标注文件：output 为空时写在图片旁边，否则按相对路径写入 output 目录；
+    已经是目标格式、或目标文件已存在且 overwrite 为 False 的图片跳过。target 为 'coco' 时把整个目录流式写入
+    output（默认为目录旁边的 <目录名>.coco.json），没有标注的图片也会写入 images。
+    返回 {'converted', 'skipped', 'boxed', 'failed': [(路径, 错误)], 'output'}。
+    """
+    if target not in CONVERT_TARGETS:
+        raise ValueError(f"不支持的目标格式: {target}")
+    summary = {'converted': 0, 'skipped': 0, 'boxed': 0, 'failed': [], 'output': output}
+    tasks = []
+    if os.path.isfile(source):
+        if target == 'coco':
+            raise ValueError("源文件已经是 COCO 格式")
+        root = os.path.abspath(output or os.path.dirname(source))
+        summary['output'] = root
+        for file_name, record in iter_coco_records(source):
+            image_path = os.path.join(root, file_name)
+            output_path = image_path.rsplit('.', 1)[0] + ANNOTATION_FORMATS[target]
+            if os.path.exists(output_path) and not overwrite:
+                summary['skipped'] += 1
+                continue
+            tasks.append({'image_path': image_path, 'record': record, 'target': target, 'output_path': output_path})
+    else:
+        root = os.path.abspath(source)
+        if target == 'coco':
+            summary['output'] = output = output or root.rstrip(os.sep) + '.coco.json'
+        for image_path in iter_directory_files(root, recursive):
+            annotation_path = find_annotation_path(image_path)
+            if target == 'coco':
+                tasks.append({'image_path': image_path, 'annotation_path': annotation_path, 'target': target})
+                continue
+            base = os.path.relpath(image_path, root).rsplit('.', 1)[0] + ANNOTATION_FORMATS[target]
+            output_path = os.path.join(output, base) if output else os.path.join(root, base)
+            if (annotation_path is None or (output is None and annotation_path == output_path)
+                    or (os.path.exists(output_path) and not overwrite)):
+                summary['skipped'] += 1
+                continue
+            tasks.append({'image_path': image_path, 'annotation_path': annotation_path, 'target': target,
+                          'output_path': output_path})
+
+    writer = CocoWriter(output) if target == 'coco' else None
+    try:
+        for done, result in enumerate(process_map(convert_annotation_file, tasks, workers, from_gui, is_cancelled), 1):
+            if result['error']:
+                summary['failed'].append((result['image_path'], result['error']))
+            else:
+                if writer is not None:
+                    file_name = os.path.relpath(result['image_path'], root).replace(os.sep, '/')
+                    writer.add_image(file_name, result['record'])
+                summary['converted'] += 1
+                summary['boxed'] += result['boxed']
+            if progress is not None and (done % 100 == 0 or done == len(tasks)):
+                progress(done, len(tasks))
+        if is_cancelled is not None and is_cancelled():
+            raise InterruptedError("转换已取消")
+    except BaseException:
+        if writer is not None:
+            writer.abort()
+        raise
+    if writer is not None:
+        writer.close()
+    return summary
+
+
+def run_convert_command(args):
+    """命令行模式：批量转换标注格式，不启动图形界面"""
+    start = time.perf_counter()
+
+    def progress(done, total):
+        print(f"转换标注 {done}/{total}", file=sys.stderr)
+
+    summary = convert_dataset(args.convert, args.to, output=args.output, recursive=not args.no_recursive,
+                              overwrite=args.overwrite, workers=args.workers, progress=progress)
+    for path, error in summary['failed']:
+        print(f"  {path}: {error}", file=sys.stderr)
+    print(f"转换 {summary['converted']} 张，跳过 {summary['skipped']} 张，失败 {len(summary['failed'])} 张，"
+          f"{summary['boxed']} 个多边形转换为外接矩形，输出: {summary['output'] or '图片所在目录'}，"
+          f"耗时 {time.perf_counter() - start:.2f} s", file=sys.stderr)
+    return 1 if summary['failed'] else 0
+
+
+def polygon_intersection_areas(polygons_a, polygons_b, boxes, samples=IOU_RASTER_SAMPLES):
+    """估计每对多边形 (polygons_a[q], polygons_b[q]) 在框 boxes[q] = (xmin, ymin, xmax, ymax) 内的交集面积
+
+    在框内取 samples 条等距的水平扫描线，扫描线上的交集长度精确计算，再乘以线距求和。所有多边形的边
+    拼在一起一次性计算：求出每条边与扫描线的交点，按 (扫描线, x) 排序后，两个多边形各自交点个数的奇偶性
+    表示其后的线段是否在多边形内（射线法），两者都在内的线段长度即为交集长度。
+    """
+    count = len(boxes)
+    polygons = list(polygons_a) + list(polygons_b)
+    sizes = np.array([len(points) for points in polygons])
+    owner = np.repeat(np.arange(2 * count), sizes)  # 每条边属于第几个多边形
+    pair, side = owner % count, owner // count
+    start = np.concatenate(polygons)
+    following = np.arange(1, len(start) + 1)
+    following[np.cumsum(sizes) - 1] = np.cumsum(sizes) - sizes  # 最后一个顶点连回第一个
+    end = start[following]
+    # 扫描线 r 的纵坐标为 y0 + (r + 0.5) / samples * height；边跨过 min(y) < y <= max(y) 的扫描线（不含下端点，
+    # 交点成对出现），这些扫描线是连续的一段，直接算出首尾，不必逐条比较
+    y0, scale = boxes[pair, 1], samples / (boxes[pair, 3] - boxes[pair, 1])
+    low = np.floor((np.minimum(start[:, 1], end[:, 1]) - y0) * scale - 0.5).astype(np.intp) + 1
+    high = np.floor((np.maximum(start[:, 1], end[:, 1]) - y0) * scale - 0.5).astype(np.intp)
+    low, high = np.maximum(low, 0), np.minimum(high, samples - 1)
+    spans = np.maximum(high - low + 1, 0)
+    edges = np.repeat(np.arange(len(start)), spans)
+    rows = low[edges] + np.arange(len(edges)) - np.repeat(np.cumsum(spans) - spans, spans)
+    row_y = y0[edges] + (rows + 0.5) / scale[edges]
+    (x1, y1), (x2, y2) = start[edges].T, end[edges].T
+    x = x1 + (row_y - y1) * (x2 - x1) / (y2 - y1)
+    pair = pair[edges]
+    x = np.clip(x, boxes[pair, 0], boxes[pair, 2])  # 只统计框内的部分，截断不改变交点的顺序和奇偶性
+    line = pair * samples + rows
+    order = np.lexsort((x, line))
+    x, line, side = x[order], line[order], side[edges][order]
+    # 每条扫描线上两个多边形的交点个数都是偶数，全局累计的奇偶性在扫描线之间自然归零
+    inside = (np.cumsum(side == 0) % 2 == 1) & (np.cumsum(side == 1) % 2 == 1)
+    lengths = np.where(inside[:-1], np.diff(x), 0.0)
+    covered = np.bincount(line[:-1] // samples, weights=lengths, minlength=count)
+    return covered * (boxes[:, 3] - boxes[:, 1]) / samples
+
+
+def shape_iou_matrix(shapes_a, shapes_b, samples=IOU_RASTER_SAMPLES, max_edges=1 << 16):
+    """计算两组形状两两之间的 IoU，返回 (len(shapes_a), len(shapes_b)) 的数组
+
+    形状需带有 add_annotation_geometry 补充的 'bbox' 和 'area'。外接框的交集对所有形状对一次性向量化计算，
+    两个都是矩形时 IoU 是精确的；涉及多边形且外接框相交时，用 polygon_intersection_areas 在外接框交集内
+    扫描估计交集面积（所有这样的形状对一起计算，每批最多 max_edges 条边），并集由精确面积减去交集得到。
+    """
+    iou = np.zeros((len(shapes_a), len(shapes_b)))
+    if not shapes_a or not shapes_b:
+        return iou
+    boxes_a = np.array([shape['bbox'] for shape in shapes_a])
+    boxes_b = np.array([shape['bbox'] for shape in shapes_b])
+    x1 = np.maximum(boxes_a[:, None, 0], boxes_b[None, :, 0])
+    y1 = np.maximum(boxes_a[:, None, 1], boxes_b[None, :, 1])
+    x2 = np.minimum(boxes_a[:, None, 2], boxes_b[None, :, 2])
+    y2 = np.minimum(boxes_a[:, None, 3], boxes_b[None, :, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    rect_a = np.array([shape['type'] == 'rectangle' for shape in shapes_a])
+    rect_b = np.array([shape['type'] == 'rectangle' for shape in shapes_b])
+    rows, columns = np.nonzero((intersection > 0) & ~(rect_a[:, None] & rect_b[None, :]))
+    first, edges = 0, 0
+    for pair, (i, j) in enumerate(zip(rows.tolist(), columns.tolist())):
+        edges += len(shapes_a[i]['points']) + len(shapes_b[j]['points'])
+        if edges < max_edges and pair < len(rows) - 1:
+            continue
+        i, j = rows[first:pair + 1], columns[first:pair + 1]
+        boxes = np.stack([x1[i, j], y1[i, j], x2[i, j], y2[i, j]], axis=1)
+        intersection[i, j] = polygon_intersection_areas([shapes_a[index]['points'] for index in i],
+                                                        [shapes_b[index]['points'] for index in j], boxes, samples)
+        first, edges = pair + 1, 0
+    areas_a = np.array([shape['area'] for shape in shapes_a])
+    areas_b = np.array([shape['area'] for shape in shapes_b])
+    intersection = np.minimum(intersection, np.minimum(areas_a[:, None], areas_b[None, :]))
+    union = areas_a[:, None] + areas_b[None, :] - intersection
+    np.divide(intersection, union, out=iou, where=union > 0)
+    return iou
+
+
+def match_shapes(shapes, other_shapes, iou_threshold=COMPARE_IOU_THRESHOLD):
+    """按标签把两组形状一一匹配：同一标签内按 IoU 从大到小贪心配对，IoU 不低于阈值才算匹配
+
+    返回 (匹配 [(shapes 下标, other_shapes 下标, IoU)], shapes 中未匹配的下标, other_shapes 中未匹配的下标)。
+    """
+    by_label = {}
+    for i, shape in enumerate(shapes):
+        by_label.setdefault(shape['label'], ([], []))[0].append(i)
+    for j, shape in enumerate(other_shapes):
+        by_label.setdefault(shape['label'], ([], []))[1].append(j)
+    matches = []
+    for indices, other_indices in by_label.values():
+        if not indices or not other_indices:
+            continue
+        iou = shape_iou_matrix([shapes[i] for i in indices], [other_shapes[j] for j in other_indices])
+        rows, columns = np.nonzero(iou >= iou_threshold)
+        used_rows, used_columns = set(), set()
+        for k in np.argsort(-iou[rows, columns], kind='stable'):
+            row, column = int(rows[k]), int(columns[k])
+            if row not in used_rows and column not in used_columns:
+                used_rows.add(row)
+                used_columns.add(column)
+                matches.append((indices[row], other_indices[column], float(iou[row, column])))
+    matched = {i for i, _, _ in matches}
+    other_matched = {j for _, j, _ in matches}
+    return (sorted(matches), [i for i in range(len(shapes)) if i not in matched],
+            [j for j in range(len(other_shapes)) if j not in other_matched])
+
+
+def compare_annotation_file(task):
+    """比较一张图片的标注与对比目录中的标注，在进程池中运行
+
+    task 为 (图片路径, 对比目录中对应的图片路径, IoU 阈值)，图片本身不必存在于对比目录中，只按同名查找标注文件。
+    返回 {'image_path', 'labels': {标签: [匹配数, 漏检数, 误检数, 匹配的 IoU 之和]}, 'error'}。
+    """
+    image_path, other_image_path, iou_threshold = task
+    result = {'image_path': image_path, 'labels': {}, 'error': None}
+    try:
+        shapes, other_shapes = [], []
+        for path, target in ((find_annotation_path(image_path), shapes),
+                             (find_annotation_path(other_image_path), other_shapes)):
+            if path is not None:
+                target.extend(add_annotation_geometry(shape) for shape in load_annotation_shapes(path))
+        matches, misses, false_positives = match_shapes(shapes, other_shapes, iou_threshold)
+        labels = result['labels']
+        for i, _, iou in matches:
+            counts = labels.setdefault(shapes[i]['label'], [0, 0, 0, 0.0])
+            counts[0] += 1
+            counts[3] += iou
+        for i in misses:
+            labels.setdefault(shapes[i]['label'], [0, 0, 0, 0.0])[1] += 1
+        for j in false_positives:
+            labels.setdefault(other_shapes[j]['label'], [0, 0, 0, 0.0])[2] += 1
+    except Exception as e:
+        result['labels'] = {}
+        result['error'] = f"{type(e).__name__}: {e}"
+    return result
+
+
+def compare_datasets(directory, other_directory, iou_threshold=COMPARE_IOU_THRESHOLD, recursive=True, workers=None,
+                     progress=None, from_gui=False, is_cancelled=None):
+    """把 directory 中每张图片的标注（真值）与 other_directory 中相同相对路径的标注（预测）比较，在进程池中并行
+
+    返回报告：{'images', 'iou_threshold', 'labels': {标签: 统计}, 'overall': 统计, 'failed': [{'path', 'error'}]}，
+    统计包括 matched/missed/false_positives、precision、recall 和匹配的平均 IoU。
+    """
+    root = os.path.abspath(directory)
+    other_root = os.path.abspath(other_directory)
+    tasks = [(image_path, os.path.join(other_root, os.path.relpath(image_path, root)), iou_threshold)
+             for image_path in iter_directory_files(root, recursive)]
+    totals, failed = {}, []
+    for done, result in enumerate(process_map(compare_annotation_file, tasks, workers, from_gui, is_cancelled), 1):
+        if result['error']:
+            failed.append({'path': result['image_path'], 'error': result['error']})
+        for label, counts in result['labels'].items():
+            total = totals.setdefault(label, [0, 0, 0, 0.0])
+            for k, value in enumerate(counts):
+                total[k] += value
+        if progress is not None and (done % 1000 == 0 or done == len(tasks)):
+            progress(done, len(tasks))
+
+    def summarize(matched, missed, false_positives, iou_sum):
+        return {'matched': matched, 'missed': missed, 'false_positives': false_positives,
+                'precision': matched / (matched + false_positives) if matched + false_positives else None,
+                'recall': matched / (matched + missed) if matched + missed else None,
+                'mean_iou': iou_sum / matched if matched else None}
+
+    overall = [sum(counts[k] for counts in totals.values()) for k in range(4)]
+    return {'images': len(tasks), 'iou_threshold': iou_threshold,
+            'labels': {label: summarize(*totals[label]) for label in sorted(totals, key=natural_sort_key)},
+            'overall': summarize(*overall), 'failed': failed}
+
+
+def print_compare_report(report, limit=20):
+    """以表格形式输出对比报告，失败的文件最多显示 limit 条"""
+    def percent(value):
+        return '-' if value is None else f"{value * 100:.1f}%"
+
+    print(f"图片: {report['images']}  IoU 阈值: {report['iou_threshold']}")
+    print(f"\n{'标签':<20} {'匹配':>8} {'漏检':>8} {'误检':>8} {'精确率':>8} {'召回率':>8} {'平均IoU':>8}")
+    rows = list(report['labels'].items()) + [('(全部)', report['overall'])]
+    for label, stats in rows:
+        mean_iou = '-' if stats['mean_iou'] is None else f"{stats['mean_iou']:.3f}"
+        print(f"{label:<20} {stats['matched']:>8} {stats['missed']:>8} {stats['false_positives']:>8} "
+              f"{percent(stats['precision']):>8} {percent(stats['recall']):>8} {mean_iou:>8}")
+    failed = report['failed']
+    if failed:
+        print(f"\n无法比较的图片: {len(failed)}")
+        for item in failed[:limit]:
+            print(f"  {item['path']}: {item['error']}")
+        if len(failed) > limit:
+            print(f"  ...（还有 {len(failed) - limit} 个）")
+
+
+def run_compare_command(args):
+    """命令行模式：比较两组标注，输出各标签的精确率和召回率，不启动图形界面"""
+    start = time.perf_counter()
+
+    def progress(done, total):
+        print(f"比较标注 {done}/{total}", file=sys.stderr)
+
+    directory, other_directory = args.compare
+    report = compare_datasets(directory, other_directory, iou_threshold=args.iou, recursive=not args.no_recursive,
+                              workers=args.workers, progress=progress)
+    if args.json:
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    else:
+        print_compare_report(report)
+    print(f"比较 {report['images']} 张图片，耗时 {time.perf_counter() - start:.2f} s", file=sys.stderr)
+    return 1 if report['failed'] else 0
+
+
+def parse_rename_rules(rules):
+    """解析重命名规则 ['旧标签=新标签', '旧标签1,旧标签2=新标签', ...]，返回 {旧标签: 新标签}
+
+    一条规则中逗号分隔的多个旧标签都改为同一个新标签（合并标签）；格式错误或同一个旧标签对应不同的新标签时抛出 ValueError。
+    """
+    mapping = {}
+    for rule in rules:
+        old_labels, sep, new_label = rule.rpartition('=')
+        olds = [label.strip() for label in old_labels.split(',') if label.strip()]
+        new_label = new_label.strip()
+        if not sep or not olds or not new_label:
+            raise ValueError(f"无法解析重命名规则: {rule}（格式为 旧标签=新标签，多个旧标签用逗号分隔）")
+        for old in olds:
+            if mapping.setdefault(old, new_label) != new_label:
+                raise ValueError(f"标签 {old} 对应了多个新标签")
+    return mapping
+
+
+def make_edit_operations(rename=None, delete=(), min_area=None, max_area=None, min_vertices=None, max_vertices=None,
+                         filter_labels=()):
+    """检查并整理批量编辑的操作，返回传给 edit_annotation_document 的 dict
+
+    rename 为 {旧标签: 新标签}，多个旧标签对应同一个新标签即为合并；delete 中的标签的形状全部删除；
+    面积（原图像素）或顶点数在范围之外的形状被过滤掉，顶点数只对多边形生效，filter_labels 非空时只过滤这些标签。
+    删除和过滤都按形状原来的标签判断，之后再重命名。没有任何操作或范围无效时抛出 ValueError。
+    """
+    rename = {old: new for old, new in (rename or {}).items() if old != new}
+    delete = frozenset(delete)
+    conflicts = sorted(delete & rename.keys(), key=natural_sort_key)
+    if conflicts:
+        raise ValueError(f"标签既要重命名又要删除: {', '.join(conflicts)}")
+    for low, high, name in ((min_area, max_area, '面积'), (min_vertices, max_vertices, '顶点数')):
+        if low is not None and high is not None and low > high:
+            raise ValueError(f"{name}的下限大于上限")
+    operations = {'rename': rename, 'delete': delete, 'min_area': min_area, 'max_area': max_area,
+                  'min_vertices': min_vertices, 'max_vertices': max_vertices, 'filter_labels': frozenset(filter_labels)}
+    if not rename and not delete and all(operations[key] is None for key in
+                                         ('min_area', 'max_area', 'min_vertices', 'max_vertices')):
+        raise ValueError("没有指定任何操作")
+    return operations
+
+
+def edit_annotation_document(document, operations):
+    """按 make_edit_operations 的 operations 就地修改 LabelMe 文档（dict）或 VOC 文档（ElementTree）中的形状
+
+    返回 {'renamed': {旧标签: 数量}, 'deleted': {标签: 数量}, 'filtered': {标签: 数量}}，都为空表示文档没有变化。
+    """
+    counts = {'renamed': {}, 'deleted': {}, 'filtered': {}}
+    rename, delete, filter_labels = operations['rename'], operations['delete'], operations['filter_labels']
+    min_area, max_area = operations['min_area'], operations['max_area']
+    min_vertices, max_vertices = operations['min_vertices'], operations['max_vertices']
+    check_area = min_area is not None or max_area is not None
+
+    def action(label, area, vertices):
+        """返回 'deleted'/'filtered'/'renamed' 或 None；area 为计算面积的函数，vertices 为 None 表示矩形"""
+        if label in delete:
+            return 'deleted'
+        if not filter_labels or label in filter_labels:
+            if check_area:
+                value = area()
+                if (min_area is not None and value < min_area) or (max_area is not None and value > max_area):
+                    return 'filtered'
+            if vertices is not None and ((min_vertices is not None and vertices < min_vertices)
+                                         or (max_vertices is not None and vertices > max_vertices)):
+                return 'filtered'
+        return 'renamed' if label in rename else None
+
+    if isinstance(document, dict):
+        shapes = document.get('shapes')
+        if not isinstance(shapes, list):
+            raise ValueError("不是 LabelMe 标注文件（没有 shapes）")
+        kept = []
+        for shape in shapes:
+            label, points = shape['label'], shape['points']
+            if shape.get('shape_type') == 'rectangle' and len(points) == 2:
+                (x1, y1), (x2, y2) = points
+                result = action(label, lambda: abs((x2 - x1) * (y2 - y1)), None)
+            else:
+                result = action(label, lambda: polygon_area(points), len(points))
+            if result is not None:
+                counts[result][label] = counts[result].get(label, 0) + 1
+            if result == 'renamed':
+                shape['label'] = rename[label]
+            if result in (None, 'renamed'):
+                kept.append(shape)
+        if len(kept) != len(shapes):
+            document['shapes'] = kept
+    else:
+        root = document.getroot()
+        for obj in root.findall('object'):
+            name = obj.find('name')
+            bndbox = obj.find('bndbox')
+            result = action(name.text, lambda: ((float(bndbox.find('xmax').text) - float(bndbox.find('xmin').text))
+                                                * (float(bndbox.find('ymax').text) - float(bndbox.find('ymin').text))),
+                            None)
+            if result is not None:
+                counts[result][name.text] = counts[result].get(name.text, 0) + 1
+            if result == 'renamed':
+                name.text = rename[name.text]
+            elif result is not None:
+                root.remove(obj)
+    return counts
+
+
+def edit_annotation_file(task):
+    """批量编辑一张图片的标注文件，在进程池中运行
+
+    task 为 (图片路径, operations, dry_run)。文件有变化且不是试运行时原子地写回：中途取消或出错时
+    文件要么是原来的内容，要么是修改后的完整内容。
+    返回 {'image_path', 'annotation_path', 'counts': edit_annotation_document 的计数（没有变化时为 None）, 'error'}。
+    """
+    image_path, operations, dry_run = task
+    result = {'image_path': image_path, 'annotation_path': None, 'counts': None, 'error': None}
+    try:
+        annotation_path = result['annotation_path'] = find_annotation_path(image_path)
+        if annotation_path is None:
+            return result
+        if annotation_path.endswith('.json'):
+            with open(annotation_path, 'rb') as file:
+                document = json.loads(file.read())
+            if not isinstance(document, dict):
+                raise ValueError("不是 LabelMe 标注文件")
+        else:
+            document = ET.parse(annotation_path)
+        counts = edit_annotation_document(document, operations)
+        if any(counts.values()):
+            result['counts'] = counts
+            if not dry_run:
+                write_file_atomic(annotation_path, encode_annotation_document(document))
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    return result
+
+
+def edit_annotations(image_paths, operations, dry_run=False, workers=None, progress=None, from_gui=False,
+                     is_cancelled=None):
+    """批量重命名、合并、删除标签或过滤形状，每张图片的标注文件在进程池中读取、修改并原子地写回
+
+    dry_run 为 True 时只统计，不写入文件。取消后不再提交新的文件，已经在处理的文件写完后返回，
+    'cancelled' 为 True，这些文件可能没有统计在内。
+    返回 {'images', 'files': 标注文件数, 'changed': [(图片路径, 标注文件路径)], 'renamed', 'deleted', 'filtered',
+    'failed': [(路径, 错误)], 'dry_run', 'cancelled'}，计数的含义同 edit_annotation_document。
+    """
+    tasks = [(image_path, operations, dry_run) for image_path in image_paths]
+    summary = {'images': len(tasks), 'files': 0, 'changed': [], 'renamed': {}, 'deleted': {}, 'filtered': {},
+               'failed': [], 'dry_run': dry_run, 'cancelled': False}
+    for done, result in enumerate(process_map(edit_annotation_file, tasks, workers, from_gui, is_cancelled), 1):
+        if result['error']:
+            summary['failed'].append((result['annotation_path'] or result['image_path'], result['error']))
+        elif result['annotation_path'] is not None:
+            summary['files'] += 1
+        if result['counts']:
+            summary['changed'].append((result['image_path'], result['annotation_path']))
+            for key, counts in result['counts'].items():
+                total = summary[key]
+                for label, count in counts.items():
+                    total[label] = total.get(label, 0) + count
+        if progress is not None and (done % 100 == 0 or done == len(tasks)):
+            progress(done, len(tasks))
+    summary['cancelled'] = is_cancelled is not None and is_cancelled()
+    return summary
+
+
+def format_edit_summary(summary, operations, limit=20):
+    """把 edit_annotations 的结果整理为文本，失败的文件最多列出 limit 条"""
+    changed = len(summary['changed'])
+    if summary['dry_run']:
+        lines = [f"试运行：{summary['images']} 张图片，{summary['files']} 个标注文件，将修改 {changed} 个文件"]
+    else:
+        lines = [f"{summary['images']} 张图片，{summary['files']} 个标注文件，已修改 {changed} 个文件"]
+    for label, count in sorted(summary['renamed'].items(), key=lambda item: natural_sort_key(item[0])):
+        lines.append(f"  重命名 {label} -> {operations['rename'][label]}: {count} 个形状")
+    for label, count in sorted(summary['deleted'].items(), key=lambda item: natural_sort_key(item[0])):
+        lines.append(f"  删除标签 {label}: {count} 个形状")
+    for label, count in sorted(summary['filtered'].items(), key=lambda item: natural_sort_key(item[0])):
+        lines.append(f"  过滤 {label}（面积或顶点数超出范围）: {count} 个形状")
+    if summary['cancelled']:
+        lines.append("已取消：已写入的文件都是完整的，取消时正在处理的文件可能没有统计在内")
+    failed = summary['failed']
+    if failed:
+        lines.append(f"失败的文件: {len(failed)}")
+        lines.extend(f"  {path}: {error}" for path, error in failed[:limit])
+        if len(failed) > limit:
+            lines.append(f"  ...（还有 {len(failed) - limit} 个）")
+    return '\n'.join(lines)
+
+
+def run_edit_command(args):
+    """命令行模式：批量重命名、合并、删除标签或过滤形状，不启动图形界面"""
+    start = time.perf_counter()
+    try:
+        operations = make_edit_operations(parse_rename_rules(args.rename or []), args.delete or (),
+                                          args.min_area, args.max_area, args.min_vertices, args.max_vertices,
+                                          args.filter_label or ())
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+
+    def progress(done, total):
+        print(f"编辑标注 {done}/{total}", file=sys.stderr)
+
+    image_paths = list(iter_directory_files(os.path.abspath(args.edit), not args.no_recursive))
+    summary = edit_annotations(image_paths, operations, dry_run=args.dry_run, workers=args.workers,
+                               progress=progress)
+    if args.json:
+        json.dump(summary, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    else:
+        print(format_edit_summary(summary, operations))
+    print(f"编辑 {summary['images']} 张图片的标注，耗时 {time.perf_counter() - start:.2f} s", file=sys.stderr)
+    return 1 if summary['failed'] else 0
+
+
+class AnnotationIndexDB:
+    """图片 -> 标注的 SQLite 索引，用于按标签、数量、面积搜索图片
+
+    images 表记录每张图片对应的标注文件及其 mtime/大小，shapes 表记录每个形状的标签、类型、
+    外接框、面积和顶点数（原图坐标）。update 只重新解析标注文件有变化的图片。
+    每个线程使用自己的连接，数据库使用 WAL 模式，后台更新时界面仍可查询。
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS images (
+            id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, annotation_path TEXT,
+            mtime_ns INTEGER, size INTEGER, shape_count INTEGER NOT NULL DEFAULT 0, error TEXT);
+        CREATE TABLE IF NOT EXISTS shapes (
+            image_id INTEGER NOT NULL, label TEXT NOT NULL, type TEXT NOT NULL,
+            xmin REAL, ymin REAL, xmax REAL, ymax REAL, area REAL, vertices INTEGER);
+        CREATE INDEX IF NOT EXISTS shapes_label ON shapes (label COLLATE NOCASE, image_id);
+        CREATE INDEX IF NOT EXISTS shapes_image ON shapes (image_id);
+    """
+    _TERM = re.compile(r'^(label|type|count|area|vertices)(>=|<=|!=|=|>|<|:)(.+)$', re.IGNORECASE)
+    _OPERATORS = {'>=': '>=', '<=': '<=', '!=': '!=', '=': '=', '>': '>', '<': '<', ':': '='}
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._connections = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.connection().executescript(self.SCHEMA)
+
+    def connection(self):
+        """返回当前线程的数据库连接"""
+        conn = getattr(self._connections, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._connections.conn = conn
+        return conn
+
+    def close(self):
+        conn = getattr(self._connections, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._connections.conn = None
+
+    def update(self, image_paths, prune=True, workers=None, progress=None, is_cancelled=None):
+        """按标注文件的 mtime/大小增量更新索引；prune 为 True 时删除列表中已不存在的图片"""
+        conn = self.connection()
+        existing = {row[1]: row for row in conn.execute(
+            'SELECT id, path, annotation_path, mtime_ns, size FROM images')}
+        todo = []  # (图片路径, 标注路径)
+        for image_path in image_paths:
+            if is_cancelled is not None and is_cancelled():
+                return
+            annotation_path = find_annotation_path(image_path)
+            try:
+                stat = os.stat(annotation_path) if annotation_path else None
+            except OSError:
+                annotation_path, stat = None, None
+            row = existing.get(image_path)
+            key = (annotation_path, stat.st_mtime_ns if stat else None, stat.st_size if stat else None)
+            if row is None or tuple(row[2:]) != key:
+                todo.append((image_path, annotation_path))
+
+        if prune:
+            current = set(image_paths)
+            removed = [(row[0],) for path, row in existing.items() if path not in current]
+            conn.executemany('DELETE FROM shapes WHERE image_id = ?', removed)
+            conn.executemany('DELETE FROM images WHERE id = ?', removed)
+            conn.commit()
+
+        # 没有标注文件的图片也登记，形状数为 0
+        for image_path, annotation_path in todo:
+            if annotation_path is None:
+                self._store(conn, existing.get(image_path), image_path, None,
+                            {'mtime_ns': None, 'size': None, 'shapes': [], 'error': None})
+        image_by_annotation = {annotation_path: image_path for image_path, annotation_path in todo if annotation_path}
+        paths = list(image_by_annotation)
+        for done, (annotation_path, entry) in enumerate(
+                summarize_annotation_files(paths, workers, from_gui=True, is_cancelled=is_cancelled), 1):
+            image_path = image_by_annotation[annotation_path]
+            self._store(conn, existing.get(image_path), image_path, annotation_path, entry)
+            if done % 1000 == 0:
+                conn.commit()
+                if progress is not None:
+                    progress(done, len(paths))
+        conn.commit()
+        if progress is not None:
+            progress(len(paths), len(paths))
+
+    def _store(self, conn, row, image_path, annotation_path, entry):
+        values = (annotation_path, entry['mtime_ns'], entry['size'], len(entry['shapes']), entry['error'])
+        if row is None:
+            image_id = conn.execute(
+                'INSERT INTO images (annotation_path, mtime_ns, size, shape_count, error, path) '
+                'VALUES (?, ?, ?, ?, ?, ?)', values + (image_path,)).lastrowid
+        else:
+            image_id = row[0]
+            conn.execute('UPDATE images SET annotation_path = ?, mtime_ns = ?, size = ?, shape_count = ?, error = ? '
+                         'WHERE id = ?', values + (image_id,))
+        conn.execute('DELETE FROM shapes WHERE image_id = ?', (image_id,))
+        conn.executemany(
+            'INSERT INTO shapes (image_id, label, type, area, vertices, xmin, ymin, xmax, ymax) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [(image_id, label, shape_type, area, vertices, xmin, ymin, xmax, ymax)
+             for label, shape_type, area, _, vertices, xmin, ymin, xmax, ymax in entry['shapes']])
+
+    def parse_query(self, text):
+        """把搜索文字解析为 SQL 条件
+
+        空格分隔的条件同时成立：不带前缀的词或 label:xxx 匹配标签（支持 * 通配符，多个标签为"或"），
+        type:polygon/rectangle 匹配类型，area、vertices 比较单个形状的面积、顶点数，
+        count 比较一张图片中满足以上条件的形状数量（默认 count>=1）。
+        """
+        labels, conditions, params = [], [], []
+        count_op, count_value = '>=', 1
+        for term in text.split():
+            match = self._TERM.match(term)
+            if match is None:
+                labels.append(term)
+                continue
+            field, operator, value = match.group(1).lower(), self._OPERATORS[match.group(2)], match.group(3)
+            if field == 'label':
+                labels.append(value)
+            elif field == 'type':
+                conditions.append('type = ?')
+                params.append(value.lower())
+            elif field == 'count':
+                count_op, count_value = operator, int(value)
+            else:
+                conditions.append(f'{field} {operator} ?')
+                params.append(float(value))
+        if labels:
+            label_conditions = []
+            for label in labels:
+                if '*' in label:
+                    label_conditions.append("label LIKE ? ESCAPE '\\'")
+                    params.append(label.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+                                  .replace('*', '%'))
+                else:
+                    label_conditions.append('label = ? COLLATE NOCASE')
+                    params.append(label)
+            conditions.append('(' + ' OR '.join(label_conditions) + ')')
+        return conditions, params, count_op, count_value
+
+    def search(self, text):
+        """返回满足搜索条件的图片路径集合"""
+        conditions, params, count_op, count_value = self.parse_query(text)
+        where = ' AND '.join(conditions) or '1'
+        counts = f'SELECT image_id FROM shapes WHERE {where} GROUP BY image_id'
+        zero_matches = {'>=': 0 >= count_value, '<=': 0 <= count_value, '=': count_value == 0,
+                        '!=': count_value != 0, '>': 0 > count_value, '<': 0 < count_value}[count_op]
+        conn = self.connection()
+        if zero_matches:
+            # 条件对 0 个形状也成立：所有图片减去数量不满足条件的图片
+            rows = conn.execute(f'SELECT path FROM images WHERE id NOT IN ({counts} HAVING NOT (COUNT(*) {count_op} ?))',
+                                params + [count_value])
+        else:
+            rows = conn.execute(f'SELECT path FROM images WHERE id IN ({counts} HAVING COUNT(*) {count_op} ?)',
+                                params + [count_value])
+        return {row[0] for row in rows}
+
+
+class AnnotationIndexBuilder(QThread):
+    """在后台线程中增量更新 SQLite 标注索引"""
+    progress = pyqtSignal(int, int)
+
+    def __init__(self, index_db, image_paths, prune=True):
+        super().__init__()
+        self.index_db = index_db
+        self.image_paths = image_paths
+        self.prune = prune
+        self._cancelled = False
+
+    def cancel(self):
+        self._cancelled = True
+
+    def run(self):
+        try:
+            self.index_db.update(self.image_paths, prune=self.prune, progress=self.progress.emit,
+                                 is_cancelled=lambda: self._cancelled)
+        except sqlite3.Error as e:
+            print(f"Error: 更新标注索引失败: {e}")
+        finally:
+            self.index_db.close()
+
+
+class BatchEditWorker(QThread):
+    """在后台线程中批量编辑标注，文件的读写在进程池中并行；结束后 summary 为结果，出错时 error 为错误信息"""
+    progress = pyqtSignal(int, int)
+
+    def __init__(self, image_paths, operations, dry_run):
+        super().__init__()
+        self.image_paths = image_paths
+        self.operations = operations
+        self.dry_run = dry_run
+        self.summary = None
+        self.error = None
+        self._cancelled = False
+
+    def cancel(self):
+        self._cancelled = True
+
+    def run(self):
+        try:
+            self.summary = edit_annotations(self.image_paths, self.operations, dry_run=self.dry_run,
+                                            progress=self.progress.emit, from_gui=True,
+                                            is_cancelled=lambda: self._cancelled)
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+
+
+# 进程的 umask：os.umask 只能在设置的同时读取，在多线程中调用不安全，因此只在导入时读取一次
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def set_replacement_mode(temp_path, path):
+    """mkstemp 创建的文件权限为 0600：替换已有文件时保持原文件的权限，新文件使用 open() 的默认权限"""
+    if os.path.exists(path):
+        shutil.copymode(path, temp_path)
+    else:
+        os.chmod(temp_path, 0o666 & ~_UMASK)
+
+
+def write_file_atomic(path, data):
+    """先写入同目录下的临时文件再重命名替换，任何时候读到的都是完整的文件"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        set_replacement_mode(temp_path, path)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+class AnnotationStore(QObject):
+    """在内存中保存正在编辑的标注文档，并在后台线程中延迟、原子地写回文件
+
+    JSON 文档保存为 dict，XML 文档保存为 ElementTree。修改后调用 mark_dirty，
+    连续的修改在 ANNOTATION_FLUSH_DELAY_MS 内合并为一次写入；写入由单线程执行器按提交顺序完成，
+    先写临时文件再重命名。切换图片或关闭程序时调用 flush/flush_all 立即写回。
+    """
+    write_failed = pyqtSignal(str, str)  # (文件路径, 错误信息)
+
+    def __init__(self, parent=None, delay_ms=ANNOTATION_FLUSH_DELAY_MS):
+        super().__init__(parent)
+        self.documents = {}  # 标注文件路径 -> 文档
+        self.dirty = set()
+        self._pending_writes = {}  # 标注文件路径 -> 最近一次写入的 Future
+        self._written = {}  # 标注文件路径 -> 本程序最近一次写入后的 (修改时间, 大小)
+        self._lock = threading.Lock()
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='annotation-writer')
+        self._flush_timer = QTimer(self)
+        self._flush_timer.setSingleShot(True)
+        self._flush_timer.setInterval(delay_ms)
+        self._flush_timer.timeout.connect(self.flush_all)
+
+    def document(self, annotation_path):
+        """返回标注文档，第一次访问时从文件解析"""
+        document = self.documents.get(annotation_path)
+        if document is None:
+            self.wait_pending(annotation_path)
+            if annotation_path.endswith('.json'):
+                with open(annotation_path, 'r') as file:
+                    document = json.load(file)
+            else:
+                document = ET.parse(annotation_path)
+            self.documents[annotation_path] = document
+        return document
+
+    def mark_dirty(self, annotation_path):
+        """记录文档已修改，延迟写回"""
+        self.dirty.add(annotation_path)
+        self._flush_timer.start()
+
+    def flush(self, annotation_path, release=False):
+        """立即把文档的修改提交到后台写入；release 为 True 时写入后不再在内存中保留该文档"""
+        if annotation_path in self.dirty:
+            self.dirty.discard(annotation_path)
+            document = self.documents[annotation_path]
+            # 在 UI 线程中取快照：JSON 只复制顶层和 shapes 列表，XML 直接序列化
+            if isinstance(document, dict):
+                snapshot = dict(document)
+                snapshot['shapes'] = list(document.get('shapes', []))
+            else:
+                snapshot = ET.tostring(document.getroot())
+            future = self.writer.submit(self._write, annotation_path, snapshot)
+            with self._lock:
+                self._pending_writes[annotation_path] = future
+        if release:
+            self.documents.pop(annotation_path, None)
+
+    def flush_all(self, wait=False):
+        """写回所有已修改的文档；wait 为 True 时等待写入全部完成"""
+        self._flush_timer.stop()
+        for annotation_path in list(self.dirty):
+            self.flush(annotation_path)
+        if wait:
+            with self._lock:
+                futures = list(self._pending_writes.values())
+            for future in futures:
+                future.exception()  # 只等待完成，错误已通过 write_failed 报告
+
+    def wait_pending(self, annotation_path):
+        """等待该文件尚未完成的写入（后台加载标注前调用，避免读到旧内容）"""
+        with self._lock:
+            future = self._pending_writes.get(annotation_path)
+        if future is not None:
+            future.exception()
+            with self._lock:
+                if self._pending_writes.get(annotation_path) is future:
+                    del self._pending_writes[annotation_path]
+
+    def release_all(self):
+        """写回并释放所有文档（例如切换文件夹时）"""
+        self.flush_all()
+        self.documents.clear()
+
+    @timed('write')
+    def _write(self, annotation_path, snapshot):
+        try:
+            if isinstance(snapshot, dict):
+                data = json.dumps(snapshot, indent=4).encode('utf-8')
+            else:
+                data = snapshot
+            write_file_atomic(annotation_path, data)
+            stat = os.stat(annotation_path)
+            with self._lock:
+                self._written[annotation_path] = (stat.st_mtime_ns, stat.st_size)
+        except Exception as e:
+            self.write_failed.emit(annotation_path, str(e))
+            raise
+
+    def is_own_write(self, annotation_path):
+        """文件的当前内容是否就是本程序最近一次写入的内容（用于忽略自己保存引起的目录变化通知）"""
+        with self._lock:
+            written = self._written.get(annotation_path)
+        if written is None:
+            return False
+        try:
+            stat = os.stat(annotation_path)
+        except OSError:
+            return False
+        return (stat.st_mtime_ns, stat.st_size) == written
+
+    def reload(self, annotation_path):
+        """文件被外部程序修改：丢弃内存中的文档，下次访问时重新解析
+
+        文档还有未写回的修改时保留内存中的版本（随后写回时会覆盖外部的修改），返回 False。
+        """
+        if annotation_path in self.dirty:
+            return False
+        self.documents.pop(annotation_path, None)
+        with self._lock:
+            self._written.pop(annotation_path, None)
+        return True
+
+    def shutdown(self):
+        """写回所有修改并等待完成"""
+        self.flush_all(wait=True)
+        self.writer.shutdown(wait=True)
+
+
+def default_cache_dir():
+    """返回本程序的用户缓存目录（Linux 下遵循 XDG_CACHE_HOME）"""
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'ImageAnnotationViewer')
+
+
+def read_session(path):
+    """读取会话文件，文件不存在或已损坏时返回 {}"""
+    try:
+        with open(path, 'rb') as file:
+            session = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    return session if isinstance(session, dict) else {}
+
+
+def write_session(path, session):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_file_atomic(path, json.dumps(session, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+
+class PreviewDiskCache:
+    """持久化的显示尺寸预览缓存
+
+    以原图的绝对路径、修改时间、文件大小以及显示尺寸和质量模式作为键，把 decode_display_image
+    生成的预览保存为 JPEG。原图被修改后键随之改变，旧预览不会再被读到，由淘汰过程清理。
+    缩放比例等信息写在 JPEG 的 EXIF ImageDescription 中。
+    """
+
+    META_TAG = 0x010E  # EXIF ImageDescription
+
+    def __init__(self, directory=None, max_bytes=PREVIEW_CACHE_MAX_BYTES, jpeg_quality=90):
+        self.directory = directory or os.path.join(default_cache_dir(), 'previews')
+        self.max_bytes = max_bytes
+        self.jpeg_quality = jpeg_quality
+        self._bytes_since_evict = 0
+        self._evict_lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _entry_path(self, file_path, max_width, max_height, quality):
+        stat = os.stat(file_path)
+        raw = f"{os.path.abspath(file_path)}|{stat.st_mtime_ns}|{stat.st_size}|{max_width}x{max_height}|{quality}"
+        digest = hashlib.sha1(raw.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest + '.jpg')
+
+    @timed('preview_cache')
+    def load(self, file_path, max_width, max_height, quality):
+        """读取缓存的预览，未命中时返回 None；命中时返回值与 decode_display_image 相同"""
+        start = time.perf_counter()
+        entry_path = self._entry_path(file_path, max_width, max_height, quality)
+        try:
+            image = Image.open(entry_path)
+            image.load()
+            meta = json.loads(image.getexif()[self.META_TAG])
+            os.utime(entry_path)  # 更新修改时间，淘汰时按最近使用排序
+        except (OSError, KeyError, ValueError):
+            return None
+        info = {'quality': quality, 'source_size': tuple(meta['source_size']), 'draft_scale': 1,
+                'decode_ms': (time.perf_counter() - start) * 1000, 'from_cache': True}
+        return image, meta['ratio'], info
+
+    def store(self, file_path, image, ratio, info, max_width, max_height, quality):
+        """保存预览；先写临时文件再重命名，其他线程不会读到写了一半的文件"""
+        entry_path = self._entry_path(file_path, max_width, max_height, quality)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        exif = Image.Exif()
+        exif[self.META_TAG] = json.dumps({'ratio': ratio, 'source_size': list(info['source_size'])})
+        if image.mode not in ('RGB', 'L'):
+            return  # JPEG 不能保存透明通道，带透明通道的预览每次重新解码
+        temp_path = f"{entry_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            image.save(temp_path, 'JPEG', quality=self.jpeg_quality, exif=exif)
+            os.replace(temp_path, entry_path)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+        self._bytes_since_evict += os.path.getsize(entry_path)
+        if self._bytes_since_evict > self.max_bytes // 20:
+            self._bytes_since_evict = 0
+            threading.Thread(target=self.evict, daemon=True).start()
+
+    def evict(self):
+        """总大小超过上限时，按最近使用时间删除最旧的预览，直到降到上限的 90%"""
+        if not self._evict_lock.acquire(blocking=False):
+            return  # 已有淘汰在进行
+        try:
+            entries = []
+            total = 0
+            for sub_dir in os.scandir(self.directory):
+                if not sub_dir.is_dir():
+                    continue
+                for entry in os.scandir(sub_dir.path):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+            if total <= self.max_bytes:
+                return
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes * 0.9:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+        finally:
+            self._evict_lock.release()
+
+
+def load_display_data(file_path, max_width=DISPLAY_WIDTH, max_height=DISPLAY_HEIGHT, quality=DEFAULT_QUALITY,
+                      disk_cache=None):
+    """解码并缩放图片、解析标注，返回可以直接显示的数据（可在后台线程中调用）"""
+    annotation_path = find_annotation_path(file_path)
+    if annotation_path is None:
+        return {'file_path': file_path, 'annotation_path': None, 'nbytes': 0}
+
+    # 优先读取磁盘预览缓存，未命中时再解码原图并写入缓存
+    cached = disk_cache.load(file_path, max_width, max_height, quality) if disk_cache is not None else None
+    if cached is not None:
+        resized_image, ratio, decode_info = cached
+    else:
+        resized_image, ratio, decode_info = decode_display_image(file_path, max_width, max_height, quality)
+        if disk_cache is not None:
+            disk_cache.store(file_path, resized_image, ratio, decode_info, max_width, max_height, quality)
+    x_offset = (max_width - resized_image.width) / 2
+    y_offset = (450 - resized_image.height) / 2  # 调整为450，图片和标注更匹配
+
+    annotations = parse_annotation_file(annotation_path, ratio, x_offset, y_offset)
+
+    qimage = pil_to_qimage(resized_image)
+    # 粗略估算标注占用的内存：坐标数组加上每个标注约 512 字节的字典开销
+    nbytes = qimage.byteCount() + sum(a['points'].nbytes + 512 for a in annotations)
+    return {'file_path': file_path, 'annotation_path': annotation_path, 'qimage': qimage, 'ratio': ratio,
+            'x_offset': x_offset, 'y_offset': y_offset, 'annotations': annotations, 'decode_info': decode_info,
+            'nbytes': nbytes}
+
+
+@timed('placeholder')
+def load_placeholder_image(file_path, max_width=DISPLAY_WIDTH, max_height=DISPLAY_HEIGHT, reduction=4):
+    """快速解码低分辨率占位图，在完整图片加载完成前显示
+
+    只处理 JPEG：draft() 按 1/8 做 DCT 缩放解码，再缩小到显示尺寸的 1/reduction，
+    其余格式无法廉价地低分辨率解码，返回 None。返回 (QImage, 显示宽度, 显示高度)。
+    """
+    image = Image.open(file_path)
+    if image.format != 'JPEG':
+        return None
+    source_width, source_height = image.size
+    ratio = min(max_width / source_width, max_height / source_height)
+    display_size = (max(1, int(source_width * ratio)), max(1, int(source_height * ratio)))
+    size = (max(1, display_size[0] // reduction), max(1, display_size[1] // reduction))
+    image.draft('RGB', size)
+    image = normalize_image_mode(image).resize(size, Image.Resampling.BILINEAR, reducing_gap=2.0)
+    return pil_to_qimage(image), display_size[0], display_size[1]
+
+
+def render_thumbnail(task):
+    """生成一张缩略图，在进程池中运行
+
+    task 为 (图片路径, 宽, 高)。返回 (缩略图, [(标签, 类型, 缩略图坐标的 float32 顶点数组)], 错误信息)，
+    多边形已按缩略图的像素简化，界面线程只需叠加绘制。
+    """
+    file_path, width, height = task
+    try:
+        image, ratio, _ = decode_display_image(file_path, width, height, 'fast')
+        shapes = []
+        annotation_path = find_annotation_path(file_path)
+        if annotation_path is not None:
+            for annotation in parse_annotation_file(annotation_path, ratio, 0, 0):
+                points = annotation['points']
+                if annotation['type'] == 'polygon':
+                    points = simplify_polygon(points, SIMPLIFY_TOLERANCE_PX)
+                shapes.append((annotation['label'], annotation['type'], points.astype(np.float32)))
+        return image, shapes, None
+    except Exception as e:
+        return None, [], f"{type(e).__name__}: {e}"
+
+
+class LRUByteCache:
+    """按占用字节数（而不是条目数）限制容量的线程安全 LRU 缓存
+
+    最近写入的条目总是保留，即使它本身超过总容量：容量设得很小时，刚加载好的数据也能取回使用。
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries = OrderedDict()  # key -> (value, nbytes)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """读取缓存，命中时把条目移到最近使用的位置"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def put(self, key, value, nbytes):
+        """写入缓存，超出容量时淘汰最久未使用的条目（刚写入的条目除外）"""
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+            self._entries[key] = (value, nbytes)
+            self.current_bytes += nbytes
+            while self.current_bytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_bytes
+
+    def discard(self, key):
+        """删除指定条目"""
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+
+class ImagePrefetcher:
+    """使用线程池提前解码当前图片前后的若干张图片，结果保存在 LRU 缓存中"""
+
+    def __init__(self, cache_bytes=CACHE_MAX_BYTES, depth=PREFETCH_DEPTH, workers=None, quality=DEFAULT_QUALITY,
+                 disk_cache=None):
+        self.cache = LRUByteCache(cache_bytes)
+        self.depth = depth
+        self.quality = quality
+        self.disk_cache = disk_cache
+        self.annotation_store = None  # 设置后，加载标注前先等待该文件尚未完成的写入
+        # Pillow 解码和缩放时会释放 GIL，线程池可以真正并行
+        self.executor = ThreadPoolExecutor(max_workers=workers or min(4, os.cpu_count() or 1),
+                                           thread_name_prefix='prefetch')
+        # 占位图使用单独的线程，不排在完整加载任务之后
+        self.placeholder_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='placeholder')
+        self._placeholder_future = None
+        self._pending = {}  # file_path -> Future
+        self._lock = threading.Lock()
+        self._entry_bytes = 0  # 最近加载的一张图片的显示数据大小，用于估计缓存能放下几张
+
+    def _load_data(self, file_path):
+        if self.annotation_store is not None:
+            annotation_path = find_annotation_path(file_path)
+            if annotation_path is not None:
+                self.annotation_store.wait_pending(annotation_path)
+        data = load_display_data(file_path, quality=self.quality, disk_cache=self.disk_cache)
+        self.cache.put(file_path, data, data['nbytes'])
+        self._entry_bytes = data['nbytes']
+        return data
+
+    def _load(self, file_path):
+        try:
+            return self._load_data(file_path)
+        finally:
+            with self._lock:
+                self._pending.pop(file_path, None)
+
+    def submit(self, file_path):
+        """提交后台预取任务，已缓存或正在加载的图片不会重复提交"""
+        if file_path in self.cache:
+            return None
+        return self._pending_future(file_path)
+
+    def _pending_future(self, file_path):
+        """返回正在加载该图片的任务，没有时提交一个"""
+        with self._lock:
+            future = self._pending.get(file_path)
+            if future is None:
+                future = self.executor.submit(self._load, file_path)
+                self._pending[file_path] = future
+            return future
+
+    def request(self, file_path, callback):
+        """请求显示一张图片：在后台加载，完成后在工作线程中调用 callback(file_path, 显示数据, 异常)
+
+        成功时异常为 None，失败时显示数据为 None。显示数据直接随回调传出，不必再从缓存中读取（缓存可能已经淘汰它）。
+        已缓存时立即调用 callback；请求被取消时不调用（取消它的一方会重新请求需要的图片）。
+        调用方应随后调用 prefetch_around，不再需要的请求会被取消。
+        """
+        def done(future):
+            if not future.cancelled():
+                error = future.exception()
+                callback(file_path, None if error is not None else future.result(), error)
+
+        data = self.cache.get(file_path)
+        if data is not None:
+            callback(file_path, data, None)
+        else:
+            self._pending_future(file_path).add_done_callback(done)
+
+    def request_placeholder(self, file_path, callback):
+        """在后台解码低分辨率占位图，成功后调用 callback(file_path, (QImage, 显示宽度, 显示高度))
+
+        只保留最近一次请求：之前尚未开始的占位图任务会被取消。
+        """
+        def load():
+            result = load_placeholder_image(file_path)
+            if result is not None:
+                callback(file_path, result)
+
+        with self._lock:
+            if self._placeholder_future is not None:
+                self._placeholder_future.cancel()
+            self._placeholder_future = self.placeholder_executor.submit(load)
+
+    def set_quality(self, quality):
+        """切换缩放质量模式，已缓存的图片按新模式重新解码"""
+        if quality != self.quality:
+            self.quality = quality
+            self.clear()
+
+    def prefetch_around(self, image_files, index):
+        """预取 index 及其前后各 depth 张图片，并取消已经不在预取范围内的排队任务
+
+        缓存放不下这么多张时只预取离 index 最近的几张，避免预取的图片互相淘汰后又被重新解码。
+        """
+        wanted = [image_files[index]] if 0 <= index < len(image_files) else []
+        for step in range(1, self.depth + 1):
+            for i in (index + step, index - step):
+                if 0 <= i < len(image_files):
+                    wanted.append(image_files[i])
+        if self._entry_bytes:
+            del wanted[max(1, self.cache.max_bytes // self._entry_bytes):]
+        wanted_set = set(wanted)
+        with self._lock:
+            for file_path, future in list(self._pending.items()):
+                if file_path not in wanted_set and future.cancel():
+                    del self._pending[file_path]
+        for file_path in wanted:  # 按距离由近到远提交
+            self.submit(file_path)
+
+    def invalidate(self, file_path):
+        """图片或标注被修改后，丢弃对应的缓存"""
+        with self._lock:
+            future = self._pending.pop(file_path, None)
+        if future is not None:
+            future.cancel()
+        self.cache.discard(file_path)
+
+    def clear(self):
+        """清空缓存并取消所有排队任务（例如切换文件夹时）"""
+        with self._lock:
+            for future in self._pending.values():
+                future.cancel()
+            self._pending.clear()
+        self.cache.clear()
+
+    def shutdown(self):
+        self.clear()
+        self.executor.shutdown(wait=False)
+        self.placeholder_executor.shutdown(wait=False, cancel_futures=True)
+
+
+class ThumbnailLoader(QObject):
+    """在进程池中生成带标注叠加层的缩略图，结果缓存在按字节数限制容量的 LRU 缓存中
+
+    只为 request 传入的路径生成缩略图，已不在其中且尚未开始的任务会被取消，因此快速滚动时
+    不会积压离开视野的请求。标注形状在界面线程中按查看器的标签颜色半透明地画到缩略图上。
+    """
+    thumbnail_ready = pyqtSignal(str)  # 缩略图已放入缓存
+    _finished = pyqtSignal(str, object)  # (图片路径, Future)，由进程池的回调线程发出
+
+    def __init__(self, color_for_label, size=THUMBNAIL_SIZE, cache_bytes=THUMBNAIL_CACHE_BYTES, workers=None,
+                 parent=None):
+        super().__init__(parent)
+        self.color_for_label = color_for_label
+        self.size = size
+        self.workers = workers
+        self.cache = LRUByteCache(cache_bytes)  # 图片路径 -> QImage
+        self.failed = set()  # 无法生成缩略图的图片
+        self.pending = {}  # 图片路径 -> Future
+        self.pool = None  # 第一次请求时创建
+        self._finished.connect(self._on_finished)
+
+    def get(self, file_path):
+        return self.cache.get(file_path)
+
+    def request(self, file_paths):
+        """按顺序为缺少缩略图的图片提交任务，取消不在 file_paths 中且尚未开始的任务"""
+        wanted = set(file_paths)
+        for file_path, future in list(self.pending.items()):
+            # cancel 会在当前线程同步调用完成回调，先移出 pending，回调中就会忽略它
+            if file_path not in wanted and not future.running():
+                del self.pending[file_path]
+                future.cancel()
+        for file_path in file_paths:
+            if file_path in self.pending or file_path in self.cache or file_path in self.failed:
+                continue
+            if self.pool is None:
+                self.pool = make_process_pool(self.workers, from_gui=True)
+            future = self.pool.submit(render_thumbnail, (file_path,) + self.size)
+            self.pending[file_path] = future
+            future.add_done_callback(functools.partial(self._finished.emit, file_path))
+
+    def _on_finished(self, file_path, future):
+        if future.cancelled() or self.pending.get(file_path) is not future:
+            return  # 已被取消、清空或失效的旧结果
+        del self.pending[file_path]
+        try:
+            image, shapes, error = future.result()
+        except Exception as e:  # 工作进程异常退出
+            image, shapes, error = None, [], str(e)
+        if error is not None:
+            print(f"Error: 无法生成缩略图 {file_path}: {error}")
+            self.failed.add(file_path)
+            return
+        qimage = pil_to_qimage(image)
+        if shapes:
+            if qimage.format() != QImage.Format_RGBA8888:
+                qimage = qimage.convertToFormat(QImage.Format_RGB32)  # 灰度图上也要画彩色的标注
+            painter = QPainter(qimage)  # 缩略图尺寸下抗锯齿几乎看不出，却会让绘制慢数倍
+            for label, _, points in shapes:
+                color = self.color_for_label(label)
+                fill = QColor(color)
+                fill.setAlpha(60)
+                painter.setPen(QPen(color, 1))
+                painter.setBrush(fill)
+                painter.drawPolygon(polygon_from_points(points))
+            painter.end()
+        self.cache.put(file_path, qimage, qimage.byteCount())
+        self.thumbnail_ready.emit(file_path)
+
+    def invalidate(self, file_path):
+        """标注或图片修改后丢弃缓存的缩略图"""
+        self.cache.discard(file_path)
+        self.failed.discard(file_path)
+        future = self.pending.pop(file_path, None)
+        if future is not None:
+            future.cancel()
+
+    def clear(self):
+        pending, self.pending = self.pending, {}
+        for future in pending.values():
+            future.cancel()
+        self.cache.clear()
+        self.failed.clear()
+
+    def shutdown(self):
+        self.clear()
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+class DirectoryScanner(QThread):
+    """在后台线程中用 os.scandir 增量扫描图片目录，按自然顺序分批发出结果"""
+    batch_ready = pyqtSignal(list)
+    scan_finished = pyqtSignal()
+
+    FIRST_BATCH_SIZE = 256
+    MAX_BATCH_SIZE = 4096
+
+    def __init__(self, directory, recursive=False):
+        super().__init__()
+        self.directory = directory
+        self.recursive = recursive
+        self._cancelled = False
+
+    def cancel(self):
+        self._cancelled = True
+
+    @timed('discover')
+    def run(self):
+        # 第一批较小，让第一张图片尽快显示；之后逐步增大批次，减少信号次数
+        batch_size = self.FIRST_BATCH_SIZE
+        batch = []
+        for file_path in self._scan(self.directory):
+            batch.append(file_path)
+            if len(batch) >= batch_size:
+                self.batch_ready.emit(batch)
+                batch = []
+                batch_size = min(batch_size * 2, self.MAX_BATCH_SIZE)
+        if batch and not self._cancelled:
+            self.batch_ready.emit(batch)
+        if not self._cancelled:
+            self.scan_finished.emit()
+
+    def _scan(self, directory):
+        return iter_directory_files(directory, self.recursive, is_cancelled=lambda: self._cancelled)
+
+
+class DirectoryWatcher(QObject):
+    """监视已加载的目录，外部程序增删或改写图片、标注文件后报告变化的文件
+
+    QFileSystemWatcher 监视各个目录（新增、删除和重命名文件，包括先写临时文件再重命名的保存方式），
+    另外单独监视当前图片的标注文件，覆盖原地改写的情况。通知在 WATCH_DEBOUNCE_MS 内没有新的变化时
+    才一并处理（持续变化时最多等待 WATCH_MAX_DELAY_MS），由后台线程重新列出收到通知的目录，与上一次的
+    快照比较修改时间和大小，只报告真正变化的文件。
+    """
+    # {'added'/'removed'/'modified': [图片路径], 'annotations': [(图片路径, 变化的标注文件路径)]}
+    changes_ready = pyqtSignal(object)
+    snapshot_ready = pyqtSignal()  # 开始监视后的初始快照已建立
+    _scanned = pyqtSignal(object)  # 后台扫描的 Future，由执行器线程发出
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self._on_changed)
+        self.watcher.fileChanged.connect(self._on_changed)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='directory-watcher')
+        self.root = None
+        self.recursive = False
+        self.snapshots = {}  # 目录 -> snapshot_directory 的结果
+        self.watched_file = None
+        self._dirty = set()  # 收到通知、还没有重新列出的目录
+        self._first_change = None
+        self._scan = None  # 正在进行的后台扫描
+        self._scan_cancelled = threading.Event()  # 取消正在进行的后台扫描
+        self._report = False  # 第一次扫描只建立快照，不报告变化
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self._rescan)
+        self._scanned.connect(self._on_scanned)
+
+    def start(self, root, recursive=False):
+        """开始监视 root（recursive 为 True 时包括子目录），在后台建立初始快照"""
+        self.stop()
+        self.root = root
+        self.recursive = recursive
+        self._submit([root], report=False)
+
+    def stop(self):
+        self.root = None
+        self._scan = None  # 之后到达的扫描结果被忽略
+        self._scan_cancelled.set()
+        self._timer.stop()
+        self._dirty.clear()
+        self._first_change = None
+        self.snapshots.clear()
+        watched = self.watcher.directories() + self.watcher.files()
+        if watched:
+            self.watcher.removePaths(watched)
+        self.watched_file = None
+
+    def watch_file(self, file_path):
+        """单独监视一个文件（当前图片的标注文件），原地改写时目录不会发出通知"""
+        if self.watched_file in self.watcher.files():
+            self.watcher.removePath(self.watched_file)
+        self.watched_file = file_path
+        if file_path and self.root is not None:
+            self.watcher.addPath(file_path)
+
+    def shutdown(self):
+        """停止监视并等待已取消的扫描结束，之后不会再从后台线程发出信号"""
+        self.stop()
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def image_files(self):
+        """快照中的所有图片路径（无序）"""
+        return [os.path.join(directory, name) for directory, (files, _) in self.snapshots.items()
+                for name in files if is_image_file(name)]
+
+    def _on_changed(self, path):
+        if self.root is None:
+            return
+        self._dirty.add(path if path in self.snapshots else os.path.dirname(path))
+        now = time.perf_counter()
+        if self._first_change is None:
+            self._first_change = now
+        if (now - self._first_change) * 1000 < WATCH_MAX_DELAY_MS:
+            self._timer.start(WATCH_DEBOUNCE_MS)  # 重新计时，连续的变化合并为一次处理
+        elif not self._timer.isActive():
+            self._timer.start(0)
+
+    def _rescan(self):
+        if self._scan is not None or not self._dirty:
+            return  # 上一次扫描完成后会再处理积累的目录
+        directories, self._dirty = self._dirty, set()
+        self._first_change = None
+        self._submit(directories, report=True)
+
+    def _submit(self, directories, report):
+        self._scan_cancelled = threading.Event()
+        future = self.executor.submit(self.scan_directories, list(directories), dict(self.snapshots), self.recursive,
+                                      self._scan_cancelled.is_set)
+        self._scan = future
+        self._report = report
+        future.add_done_callback(self._scanned.emit)
+
+    @staticmethod
+    def scan_directories(directories, snapshots, recursive, is_cancelled=None):
+        """重新列出目录并与 snapshots 中的旧快照比较，在后台线程中运行
+
+        返回 ({目录: 新快照，目录已删除时为 None}, 变化)。递归模式下新建的子目录整个加入，
+        删除的子目录连同其下已知的目录一起移除。被取消时返回的结果不完整，由调用方丢弃。
+        """
+        new_snapshots = {}
+        changes = {'added': [], 'removed': [], 'modified': [], 'annotations': []}
+        queue = list(directories)
+        while queue and not (is_cancelled is not None and is_cancelled()):
+            directory = queue.pop()
+            if directory in new_snapshots:
+                continue
+            old_files, old_dirs = snapshots.get(directory) or ({}, [])
+            snapshot = snapshot_directory(directory, is_cancelled)
+            new_snapshots[directory] = snapshot
+            files, sub_dirs = snapshot or ({}, [])
+            if recursive:
+                for name in sub_dirs:
+                    if os.path.join(directory, name) not in snapshots:
+                        queue.append(os.path.join(directory, name))
+                for name in set(old_dirs) - set(sub_dirs):
+                    removed = os.path.join(directory, name)
+                    queue.extend(path for path in snapshots if path == removed or path.startswith(removed + os.sep))
+            changed_annotations = {}  # 文件名去掉扩展名 -> [标注文件路径]
+            for name in files.keys() | old_files.keys():
+                stat, old_stat = files.get(name), old_files.get(name)
+                if stat == old_stat:
+                    continue
+                path = os.path.join(directory, name)
+                if not is_image_file(name):
+                    changed_annotations.setdefault(name.rsplit('.', 1)[0], []).append(path)
+                elif old_stat is None:
+                    changes['added'].append(path)
+                elif stat is None:
+                    changes['removed'].append(path)
+                else:
+                    changes['modified'].append(path)
+            if changed_annotations:
+                # 标注文件与同名（扩展名不同）的图片对应，与 find_annotation_path 一致
+                for name in files:
+                    stem = name.rsplit('.', 1)[0]
+                    if stem in changed_annotations and is_image_file(name):
+                        image_path = os.path.join(directory, name)
+                        changes['annotations'].extend((image_path, path) for path in changed_annotations[stem])
+        return new_snapshots, changes
+
+    def _on_scanned(self, future):
+        if future is not self._scan:
+            return  # 已停止或重新开始监视
+        self._scan = None
+        try:
+            new_snapshots, changes = future.result()
+        except Exception as e:
+            print(f"Error: 无法检查目录变化: {e}")
+            return
+        added_dirs, removed_dirs = [], []
+        for directory, snapshot in new_snapshots.items():
+            if snapshot is None:
+                if self.snapshots.pop(directory, None) is not None:
+                    removed_dirs.append(directory)
+            else:
+                if directory not in self.snapshots:
+                    added_dirs.append(directory)
+                self.snapshots[directory] = snapshot
+        watched = set(self.watcher.directories())
+        if added_dirs:
+            self.watcher.addPaths(added_dirs)
+        removed_dirs = [directory for directory in removed_dirs if directory in watched]
+        if removed_dirs:
+            self.watcher.removePaths(removed_dirs)
+        # 先写临时文件再重命名的保存会替换掉原文件，需要重新监视
+        if self.watched_file and self.watched_file not in self.watcher.files() and os.path.exists(self.watched_file):
+            self.watcher.addPath(self.watched_file)
+        if not self._report:
+            self.snapshot_ready.emit()
+        elif any(changes.values()):
+            self.changes_ready.emit(changes)
+        if self._dirty:
+            self._timer.start(WATCH_DEBOUNCE_MS)
+
+
+class FileListModel(QAbstractListModel):
+    """图片文件列表模型：只保存路径，视图只为可见的行取数据，扫描结果分批追加"""
+    FilePathRole = Qt.UserRole  # 图片的完整路径
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.root = None
+        self.files = []  # 与 ImageAnnotationViewer.image_files 是同一个列表对象
+        self.visible = None  # 搜索筛选后可见的文件下标（升序），None 表示不筛选
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.files) if self.visible is None else len(self.visible)
+
+    def file_index(self, row):
+        """视图中的行号 -> image_files 中的下标"""
+        return row if self.visible is None else self.visible[row]
+
+    def row_of(self, file_index):
+        """image_files 中的下标 -> 视图中的行号，不可见时返回 -1"""
+        if self.visible is None:
+            return file_index
+        row = bisect.bisect_left(self.visible, file_index)
+        return row if row < len(self.visible) and self.visible[row] == file_index else -1
+
+    def neighbor(self, file_index, step):
+        """筛选状态下 file_index 之前 (step<0) 或之后 (step>0) 最近的可见文件下标，没有时返回 -1"""
+        if self.visible is None:
+            target = file_index + step
+            return target if 0 <= target < len(self.files) else -1
+        if step > 0:
+            row = bisect.bisect_right(self.visible, file_index)
+            return self.visible[row] if row < len(self.visible) else -1
+        row = bisect.bisect_left(self.visible, file_index) - 1
+        return self.visible[row] if row >= 0 else -1
+
+    def set_filter(self, file_indices):
+        """只显示指定下标的文件；传入 None 取消筛选"""
+        self.beginResetModel()
+        self.visible = None if file_indices is None else sorted(file_indices)
+        self.endResetModel()
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= self.rowCount():
+            return None
+        file_path = self.files[self.file_index(index.row())]
+        if role == Qt.DisplayRole:
+            return os.path.relpath(file_path, self.root) if self.root else os.path.basename(file_path)
+        if role in (Qt.ToolTipRole, self.FilePathRole):
+            return file_path
+        return None
+
+    def reset_files(self, root):
+        """切换到新目录，清空列表（原地清空，保持列表对象不变）"""
+        self.beginResetModel()
+        self.root = root
+        self.files.clear()
+        self.visible = None
+        self.endResetModel()
+
+    def append_files(self, file_paths):
+        if not file_paths:
+            return
+        if self.visible is not None:
+            self.files.extend(file_paths)  # 筛选状态下新文件不可见，行数不变
+            return
+        first = len(self.files)
+        self.beginInsertRows(QModelIndex(), first, first + len(file_paths) - 1)
+        self.files.extend(file_paths)
+        self.endInsertRows()
+
+    def position(self, file_path):
+        """file_path 在列表中的位置（不在列表中时为应插入的位置），列表按 image_sort_key 排序"""
+        key = image_sort_key(os.path.relpath(file_path, self.root))
+        low, high = 0, len(self.files)
+        while low < high:
+            middle = (low + high) // 2
+            if image_sort_key(os.path.relpath(self.files[middle], self.root)) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def insert_files(self, file_paths):
+        """把新出现的文件按顺序插入列表，只通知视图新增的行"""
+        for file_path in file_paths:
+            index = self.position(file_path)
+            if index < len(self.files) and self.files[index] == file_path:
+                continue
+            if self.visible is None:
+                self.beginInsertRows(QModelIndex(), index, index)
+                self.files.insert(index, file_path)
+                self.endInsertRows()
+            else:
+                # 筛选状态下新文件不可见，只需移动后面可见文件的下标
+                self.files.insert(index, file_path)
+                for row in range(bisect.bisect_left(self.visible, index), len(self.visible)):
+                    self.visible[row] += 1
+
+    def remove_files(self, file_paths):
+        """从列表中删除文件，只通知视图删除的行"""
+        for file_path in file_paths:
+            index = self.position(file_path)
+            if index >= len(self.files) or self.files[index] != file_path:
+                continue
+            if self.visible is None:
+                self.beginRemoveRows(QModelIndex(), index, index)
+                del self.files[index]
+                self.endRemoveRows()
+                continue
+            row = self.row_of(index)
+            if row >= 0:
+                self.beginRemoveRows(QModelIndex(), row, row)
+                del self.visible[row]
+            del self.files[index]
+            for later in range(bisect.bisect_left(self.visible, index), len(self.visible)):
+                self.visible[later] -= 1
+            if row >= 0:
+                self.endRemoveRows()
+
+
+class AnnotationListModel(QAbstractTableModel):
+    """右侧标注列表的模型：第 0 列是可勾选的 "标签 #编号"，第 1 列是删除操作
+
+    直接引用查看器的 annotations 列表，可见性保存在标注字典的 'visible' 键中；
+    视图只渲染可见的行，单个标注变化时只刷新对应的行。
+    """
+    LabelRole = Qt.UserRole + 1
+    visibility_changed = pyqtSignal(int, bool)  # (标注 index, 是否可见)
+
+    COLUMN_LABEL = 0
+    COLUMN_DELETE = 1
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.annotations = []
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.annotations)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 2
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return '标签' if section == self.COLUMN_LABEL else '操作'
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self.annotations):
+            return None
+        annotation = self.annotations[index.row()]
+        if index.column() == self.COLUMN_LABEL:
+            if role == Qt.DisplayRole:
+                return f"{annotation['label']} #{annotation['index']}"
+            if role == Qt.CheckStateRole:
+                return Qt.Checked if annotation.get('visible', True) else Qt.Unchecked
+            if role == self.LabelRole:
+                return annotation['label']
+        elif index.column() == self.COLUMN_DELETE:
+            if role == Qt.DisplayRole:
+                return '删除'
+            if role == Qt.ForegroundRole:
+                return QBrush(QColor('red'))
+            if role == Qt.TextAlignmentRole:
+                return Qt.AlignCenter
+        return None
+
+    def flags(self, index):
+        if index.column() == self.COLUMN_LABEL:
+            return Qt.ItemIsEnabled | Qt.ItemIsSelectable | Qt.ItemIsUserCheckable
+        return Qt.ItemIsEnabled
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if role != Qt.CheckStateRole or index.column() != self.COLUMN_LABEL:
+            return False
+        self.set_visible(index.row(), value == Qt.Checked)
+        return True
+
+    def set_annotations(self, annotations):
+        """切换到新图片的标注列表"""
+        self.beginResetModel()
+        self.annotations = annotations
+        self.endResetModel()
+
+    def set_visible(self, row, visible):
+        """修改一个标注的可见性，只刷新这一行"""
+        annotation = self.annotations[row]
+        if annotation.get('visible', True) == visible:
+            return
+        annotation['visible'] = visible
+        model_index = self.index(row, self.COLUMN_LABEL)
+        self.dataChanged.emit(model_index, model_index, [Qt.CheckStateRole])
+        self.visibility_changed.emit(annotation['index'], visible)
+
+    def append_annotation(self, annotation):
+        row = len(self.annotations)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.annotations.append(annotation)
+        self.endInsertRows()
+
+    def remove_row(self, row):
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self.annotations[row]
+        self.endRemoveRows()
+
+    def replace_rows(self, row, count, annotations):
+        """把 row 开始的 count 行替换为 annotations，只通知视图删除和新增的行"""
+        if count:
+            self.beginRemoveRows(QModelIndex(), row, row + count - 1)
+            del self.annotations[row:row + count]
+            self.endRemoveRows()
+        if annotations:
+            self.beginInsertRows(QModelIndex(), row, row + len(annotations) - 1)
+            self.annotations[row:row] = annotations
+            self.endInsertRows()
+
+    def refresh_labels(self, first_row):
+        """标注重新编号后刷新 first_row 之后各行的显示文字"""
+        if first_row < len(self.annotations):
+            self.dataChanged.emit(self.index(first_row, self.COLUMN_LABEL),
+                                  self.index(len(self.annotations) - 1, self.COLUMN_LABEL), [Qt.DisplayRole])
+
+
+class TileSignals(QObject):
+    """后台线程解码完瓦片后，通过信号把结果交回 UI 线程"""
+    tile_ready = pyqtSignal(object, object)  # (瓦片键, QImage)
+
+
+class TiledImageLayer:
+    """放大查看用的多分辨率瓦片金字塔
+
+    第 level 层的一个瓦片覆盖原图中 TILE_SIZE * 2**level 见方的区域，缩小 2**level 倍后显示。
+    瓦片按需在后台线程中从原图裁剪生成，只有当前视野内、当前层级的瓦片会放到场景中；
+    生成的瓦片保存在按字节数限制容量的 LRU 缓存中，所以无论图片多大、放得多大，内存占用都有上限。
+    既不是 JPEG 也无法映射读取的原图（PNG、压缩 TIFF 等）只能整张解码，超过 TILE_SOURCE_MAX_PIXELS
+    时保留缩小后的原图，细层级的瓦片由它放大生成，清晰度会低于原图。
+    """
+
+    def __init__(self, view, scene, cache_bytes=TILE_CACHE_BYTES):
+        self.view = view
+        self.scene = scene
+        self.cache = LRUByteCache(cache_bytes)  # (file_path, level, col, row) -> QImage
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='tiles')
+        self.signals = TileSignals()
+        self.signals.tile_ready.connect(self._on_tile_ready)
+        self.file_path = None
+        self.source_size = (0, 0)
+        self.ratio = 1
+        self.level = None
+        self.items = {}  # (file_path, level, col, row) -> QGraphicsPixmapItem
+        self._pending = {}  # (file_path, level, col, row) -> Future
+        self._sources = {}  # 解码缩放倍数 -> (PIL 图片, x 方向倍数, y 方向倍数)
+        self._source_lock = threading.Lock()
+        # 缩放/平移结束后稍等片刻再更新瓦片，避免连续滚轮时反复计算
+        self._update_timer = QTimer()
+        self._update_timer.setSingleShot(True)
+        self._update_timer.setInterval(50)
+        self._update_timer.timeout.connect(self.update_tiles)
+
+    def set_image(self, file_path, source_size, ratio):
+        """切换到新图片；场景中的旧瓦片已随 scene.clear() 一起删除"""
+        self.reset()
+        self.file_path = file_path
+        self.source_size = source_size
+        self.ratio = ratio
+
+    def reset(self):
+        """丢弃当前图片的瓦片和已解码的原图"""
+        for future in self._pending.values():
+            future.cancel()
+        self._pending.clear()
+        self.items.clear()
+        self.level = None
+        self.file_path = None
+        with self._source_lock:
+            self._sources.clear()
+
+    def schedule_update(self):
+        if self.file_path is not None:
+            self._update_timer.start()
+
+    def _wanted_level(self):
+        """根据视图缩放比例选择层级；底图已经足够清晰时返回 None"""
+        view_scale = self.view.transform().m11()
+        if view_scale <= 1.0:
+            return None  # 底图的一个像素不大于一个屏幕像素，无需瓦片
+        downsample = 1 / (view_scale * self.ratio)  # 每个屏幕像素对应的原图像素数
+        level = max(0, int(math.floor(math.log2(downsample)))) if downsample >= 1 else 0
+        if 2 ** level >= 1 / self.ratio:
+            return None  # 该层级并不比底图更清晰
+        return level
+
+    def update_tiles(self):
+        """放置当前视野内需要的瓦片，移除其余瓦片"""
+        if self.file_path is None:
+            return
+        level = self._wanted_level()
+        wanted = set()
+        if level is not None:
+            source_width, source_height = self.source_size
+            span = TILE_SIZE * 2 ** level  # 一个瓦片覆盖的原图像素数
+            visible = self.view.mapToScene(self.view.viewport().rect()).boundingRect()
+            x0 = max(0.0, visible.left() / self.ratio)
+            y0 = max(0.0, visible.top() / self.ratio)
+            x1 = min(float(source_width), visible.right() / self.ratio)
+            y1 = min(float(source_height), visible.bottom() / self.ratio)
+            if x1 > x0 and y1 > y0:
+                for row in range(int(y0 // span), int(math.ceil(y1 / span))):
+                    for col in range(int(x0 // span), int(math.ceil(x1 / span))):
+                        wanted.add((self.file_path, level, col, row))
+        self.level = level
+
+        for key in list(self.items):
+            if key not in wanted:
+                self.scene.removeItem(self.items.pop(key))
+        for key in list(self._pending):
+            if key not in wanted and self._pending[key].cancel():
+                del self._pending[key]
+        for key in wanted:
+            if key in self.items or key in self._pending:
+                continue
+            qimage = self.cache.get(key)
+            if qimage is not None:
+                self._add_tile_item(key, qimage)
+            else:
+                self._pending[key] = self.executor.submit(self._render_tile, key)
+
+    def _get_source(self, level):
+        """取得用于生成该层瓦片的原图；JPEG 在较粗的层级用 draft() 缩小解码以节省内存"""
+        with self._source_lock:
+            image = Image.open(self.file_path)
+            scale = min(2 ** level, 8) if image.format == 'JPEG' else 1
+            if scale not in self._sources:
+                if scale > 1:
+                    width, height = self.source_size
+                    image.draft('RGB', (math.ceil(width / scale), math.ceil(height / scale)))
+                # 未压缩的图片每个瓦片只映射读取需要的区域，不把整张原图读进内存
+                raster = MappedRaster.open(self.file_path, image) if image.format != 'JPEG' else None
+                if raster is not None:
+                    image = raster
+                else:
+                    image = normalize_image_mode(image)
+                    image.load()
+                    reduce_factor = 1
+                    while image.width * image.height > TILE_SOURCE_MAX_PIXELS * reduce_factor ** 2:
+                        reduce_factor *= 2
+                    if reduce_factor > 1:
+                        # 整张解码的大图按 2 的幂缩小后再保留（与层级对齐），解码出的原图随即释放
+                        image = image.reduce(reduce_factor)
+                # 只保留最近使用的一份原图，避免同时持有多个层级的大图
+                self._sources = {scale: (image, self.source_size[0] / image.width,
+                                         self.source_size[1] / image.height)}
+            return self._sources[scale]
+
+    def _render_tile(self, key):
+        """在后台线程中生成一个瓦片"""
+        file_path, level, col, row = key
+        if file_path != self.file_path:
+            return
+        image, scale_x, scale_y = self._get_source(level)
+        span = TILE_SIZE * 2 ** level
+        box = (int(col * span / scale_x), int(row * span / scale_y),
+               min(image.width, int(math.ceil((col + 1) * span / scale_x))),
+               min(image.height, int(math.ceil((row + 1) * span / scale_y))))
+        factor = max(1, int(round(2 ** level / scale_x)))
+        if isinstance(image, MappedRaster):
+            # 映射读取时边读边缩小，粗层级的瓦片不需要先读出整块原图区域
+            tile = image.downsample(factor, box)
+        else:
+            tile = image.crop(box)
+            if factor > 1:
+                tile = tile.reduce(factor)
+            elif scale_x > 2 ** level:
+                # 原图已被缩小到比该层级更粗，放大回瓦片应有的尺寸
+                source_width, source_height = self.source_size
+                tile = tile.resize((math.ceil((min(source_width, (col + 1) * span) - col * span) / 2 ** level),
+                                    math.ceil((min(source_height, (row + 1) * span) - row * span) / 2 ** level)),
+                                   Image.Resampling.BILINEAR)
+        qimage = pil_to_qimage(tile)
+        self.cache.put(key, qimage, qimage.byteCount())
+        self.signals.tile_ready.emit(key, qimage)
+
+    def _on_tile_ready(self, key, qimage):
+        self._pending.pop(key, None)
+        # 只添加仍然需要的瓦片：图片或层级已变化的结果直接丢弃
+        if key[0] != self.file_path or key[1] != self.level or key in self.items:
+            return
+        self._add_tile_item(key, qimage)
+
+    def _add_tile_item(self, key, qimage):
+        _, level, col, row = key
+        span = TILE_SIZE * 2 ** level
+        item = QGraphicsPixmapItem(QPixmap.fromImage(qimage))
+        item.setTransformationMode(Qt.SmoothTransformation)
+        item.setPos(col * span * self.ratio, row * span * self.ratio)
+        # 瓦片中的一个像素对应原图中 2**level 个像素
+        item.setScale(span * self.ratio / TILE_SIZE)
+        item.setZValue(-1)  # 位于底图之上、标注之下
+        self.scene.addItem(item)
+        self.items[key] = item
+
+    def shutdown(self):
+        self.reset()
+        self.executor.shutdown(wait=False)
+
+
+class PolygonAnnotationItem(QGraphicsPolygonItem):
+    """按缩放级别绘制的多边形标注
+
+    缩小时绘制 Douglas-Peucker 简化后的多边形（按 2 的幂分级缓存），放大到相邻顶点足够分开时
+    才在同一次 paint 中批量画出顶点标记，不再为每个顶点创建一个图形项。
+    简化只影响绘制，标注数据和 polygon() 始终是完整的顶点。
+    """
+    HANDLE_SIZE = 4
+
+    def __init__(self, points, color):
+        self.points = np.asarray(points, dtype=np.float64)
+        super().__init__(polygon_from_points(self.points))
+        self.setPen(QPen(color, 2))  # 设置多边形线条颜色和宽度
+        self.handle_pen = QPen(color, self.HANDLE_SIZE, Qt.SolidLine, Qt.RoundCap)
+        edges = np.diff(np.vstack([self.points, self.points[:1]]), axis=0)
+        self.mean_edge_length = float(np.hypot(edges[:, 0], edges[:, 1]).mean()) if len(self.points) else 0.0
+        self.simplified = {}  # 简化等级 -> QPolygonF
+
+    def boundingRect(self):
+        margin = self.HANDLE_SIZE / 2
+        return super().boundingRect().adjusted(-margin, -margin, margin, margin)
+
+    def polygon_for_scale(self, scale):
+        """返回在给定缩放比例下绘制的多边形"""
+        tolerance = SIMPLIFY_TOLERANCE_PX / scale
+        if tolerance < 0.25 or len(self.points) <= 8:
+            return self.polygon()
+        level = math.ceil(math.log2(tolerance))
+        polygon = self.simplified.get(level)
+        if polygon is None:
+            polygon = self.simplified[level] = polygon_from_points(simplify_polygon(self.points, 2.0 ** level))
+        return polygon
+
+    def paint(self, painter, option, widget=None):
+        scale = option.levelOfDetailFromTransform(painter.worldTransform())
+        painter.setPen(self.pen())
+        painter.setBrush(self.brush())
+        painter.drawPolygon(self.polygon_for_scale(scale))
+        if self.mean_edge_length * scale >= VERTEX_HANDLE_MIN_SPACING_PX:
+            # 绘制顶点标记，使用相同的颜色
+            painter.setPen(self.handle_pen)
+            painter.drawPoints(self.polygon())
+
+
 class ZoomableGraphicsView(QGraphicsView):
     def __init__(self, parent_viewer, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -37,6 +3281,7 @@ class ZoomableGraphicsView(QGraphicsView):
         self.scale_factor = 1.15
         self.is_annotation_mode = False  # 标注模式标识
         self.drawing_points = []
+        self.drawing_items = []  # 绘制过程中临时显示的顶点
         self.parent_viewer = parent_viewer
         self.annotation_type = None
 
@@ -47,6 +3292,16 @@ class ZoomableGraphicsView(QGraphicsView):
             self.scale(self.scale_factor, self.scale_factor)  # 放大
         else:
             self.scale(1 / self.scale_factor, 1 / self.scale_factor)  # 缩小
+        self.parent_viewer.tile_layer.schedule_update()
+
+    def scrollContentsBy(self, dx, dy):
+        """平移后更新视野内的瓦片"""
+        super().scrollContentsBy(dx, dy)
+        self.parent_viewer.tile_layer.schedule_update()
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.parent_viewer.tile_layer.schedule_update()
 
     def mousePressEvent(self, event):
         """根据标注模式或正常模式处理鼠标点击事件"""
@@ -56,10 +3311,11 @@ class ZoomableGraphicsView(QGraphicsView):
             # 处于标注模式，根据类型绘制多边形或矩形
             if self.annotation_type == 'polygon':
                 self.drawing_points.append((scene_pos.x(), scene_pos.y()))
-                # 绘制当前点击的点
-                self.parent_viewer.graphics_scene.addEllipse(scene_pos.x() - 2, scene_pos.y() - 2, 4, 4,
-                                                             QPen(QColor('blue')),
-                                                             QBrush(QColor('blue')))
+                # 绘制当前点击的点，完成或退出标注时删除
+                marker = self.parent_viewer.graphics_scene.addEllipse(scene_pos.x() - 2, scene_pos.y() - 2, 4, 4,
+                                                                      QPen(QColor('blue')),
+                                                                      QBrush(QColor('blue')))
+                self.drawing_items.append(marker)
             elif self.annotation_type == 'rectangle':
                 self.drawing_points.append((scene_pos.x(), scene_pos.y()))
                 if len(self.drawing_points) == 2:
@@ -95,11 +3351,204 @@ class ZoomableGraphicsView(QGraphicsView):
         self.is_annotation_mode = False
         self.annotation_type = None
         self.drawing_points = []
+        for item in self.drawing_items:
+            if not sip.isdeleted(item) and item.scene() is not None:
+                item.scene().removeItem(item)
+        self.drawing_items = []
         self.setCursor(Qt.ArrowCursor)
 
 
+class ThumbnailDelegate(QStyledItemDelegate):
+    """绘制缩略图网格的一个格子：缓存中有缩略图时画缩略图，否则画灰色占位，下方显示文件名"""
+    PADDING = 4
+    TEXT_HEIGHT = 20
+
+    def __init__(self, loader, parent=None):
+        super().__init__(parent)
+        self.loader = loader
+
+    def cell_size(self):
+        width, height = self.loader.size
+        return QSize(width + 2 * self.PADDING, height + 2 * self.PADDING + self.TEXT_HEIGHT)
+
+    def sizeHint(self, option, index):
+        return self.cell_size()
+
+    def paint(self, painter, option, index):
+        rect = option.rect
+        if option.state & QStyle.State_Selected:
+            painter.fillRect(rect, option.palette.highlight())
+        width, height = self.loader.size
+        image = self.loader.get(index.data(FileListModel.FilePathRole))
+        if image is not None:
+            painter.drawImage(rect.x() + self.PADDING + (width - image.width()) // 2,
+                              rect.y() + self.PADDING + (height - image.height()) // 2, image)
+        else:
+            painter.fillRect(rect.x() + self.PADDING, rect.y() + self.PADDING, width, height, QColor(64, 64, 64))
+        text_rect = QRect(rect.x() + self.PADDING, rect.bottom() - self.TEXT_HEIGHT, width, self.TEXT_HEIGHT)
+        name = option.fontMetrics.elidedText(os.path.basename(index.data()), Qt.ElideMiddle, width)
+        painter.setPen(option.palette.highlightedText().color() if option.state & QStyle.State_Selected
+                       else option.palette.text().color())
+        painter.drawText(text_rect, Qt.AlignCenter, name)
+
+
+class ThumbnailGridView(QListView):
+    """缩略图网格：与文件列表共用 FileListModel，Qt 只绘制滚动到视野内的格子
+
+    视野变化后只为可见的格子以及前后各一屏请求缩略图，内存占用与可见格子数有关，与数据集大小无关。
+    """
+
+    def __init__(self, loader, parent=None):
+        super().__init__(parent)
+        self.loader = loader
+        self.delegate = ThumbnailDelegate(loader, self)
+        self.setItemDelegate(self.delegate)
+        self.setViewMode(QListView.IconMode)
+        self.setMovement(QListView.Static)
+        self.setResizeMode(QListView.Adjust)
+        self.setUniformItemSizes(True)
+        self.setLayoutMode(QListView.Batched)
+        self.setBatchSize(FILE_LIST_BATCH_SIZE)
+        self.setSpacing(0)
+        self.setGridSize(self.delegate.cell_size())
+        self.setVerticalScrollMode(QListView.ScrollPerPixel)
+        self.setSelectionMode(QListView.SingleSelection)
+        # 滚动、缩放和列表变化时每 30 ms 最多请求一次，持续滚动时也会陆续请求
+        self.request_timer = QTimer(self)
+        self.request_timer.setSingleShot(True)
+        self.request_timer.setInterval(30)
+        self.request_timer.timeout.connect(self.request_visible)
+        self.verticalScrollBar().valueChanged.connect(self.schedule_request)
+        self._last_request_offset = None
+        # 缩略图陆续到达时合并为一次重绘
+        loader.thumbnail_ready.connect(lambda _: self.viewport().update())
+
+    def setModel(self, model):
+        super().setModel(model)
+        model.modelReset.connect(self.schedule_request)
+        model.rowsInserted.connect(self.schedule_request)
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.schedule_request()
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.schedule_request()
+
+    def schedule_request(self, *args):
+        if not self.request_timer.isActive():
+            self.request_timer.start()
+
+    def visible_rows(self, margin_pages=1):
+        """返回可见的行号范围，以及前后各 margin_pages 屏的行号范围：(可见, 预取)"""
+        model = self.model()
+        grid = self.gridSize()
+        columns = max(1, self.viewport().width() // grid.width())
+        offset = self.verticalScrollBar().value()
+        first_line = offset // grid.height()
+        last_line = (offset + self.viewport().height()) // grid.height()
+        page = last_line - first_line + 1
+        count = model.rowCount()
+        visible = range(min(count, first_line * columns), min(count, (last_line + 1) * columns))
+        nearby = range(min(count, max(0, first_line - margin_pages * page) * columns),
+                       min(count, (last_line + 1 + margin_pages * page) * columns))
+        return visible, nearby
+
+    def request_visible(self):
+        """请求可见格子的缩略图，其次是向下、向上一屏的格子
+
+        快速滚动时只请求可见格子，等滚动停下后再补充预取的格子，避免反复提交和取消大量任务。
+        """
+        model = self.model()
+        if model is None or not self.isVisible():
+            return
+        offset = self.verticalScrollBar().value()
+        scrolling = offset != self._last_request_offset
+        self._last_request_offset = offset
+        if scrolling:
+            visible, _ = self.visible_rows()
+            self.loader.request([model.files[model.file_index(row)] for row in visible])
+            self.request_timer.start()  # 滚动停下后补充预取
+            return
+        visible, nearby = self.visible_rows()
+        rows = list(visible) + list(range(visible.stop, nearby.stop)) + list(range(visible.start - 1,
+                                                                                      nearby.start - 1, -1))
+        self.loader.request([model.files[model.file_index(row)] for row in rows])
+
+
+class BatchEditDialog(QDialog):
+    """批量编辑对话框：填写重命名、删除和过滤条件，先预览将要修改的数量，再执行
+
+    预览和执行按钮由查看器连接到实际的处理；结果显示在下方的文本框中。
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle('批量编辑标注')
+        self.resize(560, 480)
+        layout = QVBoxLayout(self)
+        form = QFormLayout()
+        self.rename_edit = QLineEdit()
+        self.rename_edit.setPlaceholderText('旧标签=新标签；多个旧标签合并：a,b=c；多条规则用分号分隔')
+        form.addRow('重命名/合并', self.rename_edit)
+        self.delete_edit = QLineEdit()
+        self.delete_edit.setPlaceholderText('要删除的标签，用逗号分隔')
+        form.addRow('删除标签', self.delete_edit)
+        area_layout = QHBoxLayout()
+        self.min_area_edit, self.max_area_edit = QLineEdit(), QLineEdit()
+        for edit, text in ((self.min_area_edit, '最小'), (self.max_area_edit, '最大')):
+            edit.setValidator(QDoubleValidator(0, 1e12, 2, edit))
+            edit.setPlaceholderText(f'{text}（留空不限）')
+            area_layout.addWidget(edit)
+        form.addRow('面积（原图像素）', area_layout)
+        vertices_layout = QHBoxLayout()
+        self.min_vertices_spin, self.max_vertices_spin = QSpinBox(), QSpinBox()
+        for spin, text in ((self.min_vertices_spin, '最少'), (self.max_vertices_spin, '最多')):
+            spin.setRange(0, 1000000)
+            spin.setPrefix(f'{text} ')
+            spin.setSpecialValueText(f'{text}（不限）')  # 0 表示不限
+            vertices_layout.addWidget(spin)
+        form.addRow('多边形顶点数', vertices_layout)
+        self.filter_labels_edit = QLineEdit()
+        self.filter_labels_edit.setPlaceholderText('面积和顶点数过滤只作用于这些标签，留空为所有标签')
+        form.addRow('过滤的标签', self.filter_labels_edit)
+        layout.addLayout(form)
+
+        self.summary_edit = QPlainTextEdit()
+        self.summary_edit.setReadOnly(True)
+        self.summary_edit.setPlaceholderText('先预览将要修改的形状和文件数量；删除的形状无法撤销')
+        layout.addWidget(self.summary_edit)
+
+        buttons = QDialogButtonBox(QDialogButtonBox.Close)
+        self.preview_button = buttons.addButton('预览', QDialogButtonBox.ActionRole)
+        self.apply_button = buttons.addButton('执行', QDialogButtonBox.ActionRole)
+        buttons.rejected.connect(self.reject)
+        layout.addWidget(buttons)
+
+    def operations(self):
+        """返回 make_edit_operations 整理后的操作，输入无效时抛出 ValueError"""
+        def labels(text):
+            return [label.strip() for label in text.split(',') if label.strip()]
+
+        def number(edit):
+            text = edit.text().strip()
+            return float(text) if text else None
+
+        rules = [rule for rule in self.rename_edit.text().split(';') if rule.strip()]
+        return make_edit_operations(parse_rename_rules(rules), labels(self.delete_edit.text()),
+                                    number(self.min_area_edit), number(self.max_area_edit),
+                                    self.min_vertices_spin.value() or None, self.max_vertices_spin.value() or None,
+                                    labels(self.filter_labels_edit.text()))
+
+
 class ImageAnnotationViewer(QWidget):
-    def __init__(self):
+    # 后台加载完成的通知，从工作线程发出，排队到界面线程处理
+    display_loaded = pyqtSignal(str, object, object)
+    placeholder_loaded = pyqtSignal(str, object)
+
+    def __init__(self, cache_size_mb=CACHE_MAX_BYTES // (1024 * 1024), prefetch_depth=PREFETCH_DEPTH,
+                 preview_cache_mb=PREVIEW_CACHE_MAX_BYTES // (1024 * 1024)):
         super().__init__()
         self.setWindowTitle("Skysys")
         self.setGeometry(100, 100, 1200, 800)
@@ -116,10 +3565,65 @@ class ImageAnnotationViewer(QWidget):
         self.image_ratio = 1
         self.x_offset = 0
         self.y_offset = 0
-        self.image_files = []
+        self.file_model = FileListModel()
+        self.image_files = self.file_model.files
+        self.scanner = None
+        self.scan_in_progress = False
         self.current_index = 0
-        self.annotation_checkboxes = {}  # 保存复选框
+        self.annotation_items = {}  # 标注 index -> 场景中对应的 QGraphicsItemGroup
+        self.annotation_index = AnnotationGridIndex()  # 点击命中测试用的空间索引
+        self.compare_dir = None  # 对比模式下对比标注（如模型预测）所在的目录
+        self.comparison_items = []  # 场景中绘制的对比标注
         self.last_label_name = "Default Label"  # 默认的标签名称
+        # 后台预取前后图片，切换到已缓存的图片时 UI 线程不再解码
+        # 磁盘预览缓存：再次打开浏览过的数据集时直接读取预览，不再解码原图
+        disk_cache = None
+        if preview_cache_mb > 0:
+            try:
+                disk_cache = PreviewDiskCache(max_bytes=preview_cache_mb * 1024 * 1024)
+                threading.Thread(target=disk_cache.evict, daemon=True).start()
+            except OSError as e:
+                print(f"Error: 无法创建预览缓存目录: {e}")
+        self.prefetcher = ImagePrefetcher(cache_size_mb * 1024 * 1024, prefetch_depth, disk_cache=disk_cache)
+        # 标注的修改保存在内存中，延迟并在后台线程中写回文件
+        self.annotation_store = AnnotationStore(self)
+        self.annotation_store.write_failed.connect(self.on_annotation_write_failed)
+        self.prefetcher.annotation_store = self.annotation_store
+        # 切换图片时不在界面线程中加载：连续按键只显示最后一次请求的图片
+        self.loading_file_path = None  # 正在后台加载、等待显示的图片
+        self.display_requested_at = 0.0  # 最近一次切换请求的时间，用于记录切换延迟
+        self.navigation_settle_ms = NAVIGATION_SETTLE_MS
+        self.skimming = False  # 正在快速连续切换图片
+        self.displayed_file_path = None  # 已完整显示（图片和标注）的图片
+        self.display_loaded.connect(self.on_display_loaded)
+        self.placeholder_loaded.connect(self.on_placeholder_loaded)
+        self.display_timer = QTimer(self)
+        self.display_timer.setSingleShot(True)
+        self.display_timer.setInterval(0)
+        self.display_timer.timeout.connect(self.show_current_image)
+        self.settle_timer = QTimer(self)
+        self.settle_timer.setSingleShot(True)
+        self.settle_timer.timeout.connect(self.on_navigation_settled)
+        # 标注索引：按标签、数量、面积搜索图片
+        self.index_db = None
+        self.index_builder = None
+        self.index_progress = None  # (已解析, 总数)，None 表示没有在更新
+        self.search_pending = False  # 搜索等待后台索引更新完成后再执行
+        self.edited_images = set()  # 本次会话中修改过标注（包括被外部程序修改）的图片，搜索前重新索引
+        self.batch_edit_worker = None
+        # 缩略图网格：在进程池中生成带标注叠加层的缩略图
+        self.thumbnail_loader = ThumbnailLoader(self.get_label_color, parent=self)
+        # 监视目录：外部程序修改标注或增删图片后增量更新，不用重新加载
+        self.directory_watcher = DirectoryWatcher(self)
+        self.directory_watcher.changes_ready.connect(self.on_directory_changed)
+        self.directory_watcher.snapshot_ready.connect(self.on_watch_snapshot_ready)
+        # 会话：文件列表快照、当前图片、缩放和隐藏的标签，下次打开同一目录时恢复
+        self.file_list_recursive = False  # 当前文件列表是否包含子文件夹
+        self.validating_file_list = False  # 文件列表来自快照，等待监视器的初始快照核对
+        self.opening_file_path = None  # 打开目录后要显示的图片（扫描到它之前不显示第一张）
+        self.restored_view = None  # (图片路径, 相对适应窗口的缩放倍数, 视图中心的场景坐标)
+        self.fit_scale = 1.0  # 当前图片适应窗口时视图的缩放比例
+        self.hidden_labels = set()  # 所有标注都被取消勾选的标签，之后的图片中也默认隐藏
 
         # 设置主布局
         main_layout = QVBoxLayout(self)
@@ -129,6 +3633,36 @@ class ImageAnnotationViewer(QWidget):
         self.load_button = QPushButton('加载文件夹')
         self.load_button.clicked.connect(self.load_files)
         control_layout.addWidget(self.load_button)
+
+        # 是否同时加载子文件夹中的图片
+        self.recursive_checkbox = QCheckBox('包含子文件夹')
+        self.recursive_checkbox.toggled.connect(self.on_recursive_toggled)
+        control_layout.addWidget(self.recursive_checkbox)
+
+        # 缩放质量：浏览时用双线性，仔细查看时用 LANCZOS
+        self.quality_combo = QComboBox()
+        self.quality_combo.addItem('快速浏览（双线性）', 'fast')
+        self.quality_combo.addItem('精细查看（LANCZOS）', 'high')
+        self.quality_combo.setCurrentIndex(self.quality_combo.findData(self.prefetcher.quality))
+        self.quality_combo.currentIndexChanged.connect(self.on_quality_changed)
+        control_layout.addWidget(self.quality_combo)
+
+        # 在单张查看和缩略图网格之间切换
+        self.grid_button = QPushButton('网格浏览')
+        self.grid_button.setCheckable(True)
+        self.grid_button.toggled.connect(self.set_grid_mode)
+        control_layout.addWidget(self.grid_button)
+
+        # 与另一个目录中的同名标注对比：匹配、漏检、误检用不同颜色显示
+        self.compare_button = QPushButton('对比标注')
+        self.compare_button.setCheckable(True)
+        self.compare_button.toggled.connect(self.set_compare_mode)
+        control_layout.addWidget(self.compare_button)
+
+        # 对整个目录批量重命名、合并、删除标签或按面积、顶点数过滤形状
+        self.batch_edit_button = QPushButton('批量编辑')
+        self.batch_edit_button.clicked.connect(self.batch_edit_annotations)
+        control_layout.addWidget(self.batch_edit_button)
         main_layout.addLayout(control_layout)
 
         # 使用 QSplitter 实现拖动调整大小的功能
@@ -141,9 +3675,32 @@ class ImageAnnotationViewer(QWidget):
         self.image_count_label = QLabel("当前第 0 张，共 0 张")
         left_layout.addWidget(self.image_count_label)
 
+        # 显示当前图片的解码模式和耗时
+        self.decode_info_label = QLabel()
+        left_layout.addWidget(self.decode_info_label)
+
+        # 对比模式下当前图片的匹配统计
+        self.compare_label = QLabel()
+        left_layout.addWidget(self.compare_label)
+
+        # 按标注搜索图片，例如 "car count>=3"、"person area<500"、"type:rectangle"
+        self.search_edit = QLineEdit()
+        self.search_edit.setPlaceholderText("搜索标注：标签 count>=N area<N vertices>N type:polygon，回车筛选")
+        self.search_edit.setClearButtonEnabled(True)
+        self.search_edit.returnPressed.connect(self.on_search)
+        left_layout.addWidget(self.search_edit)
+
         # 左侧：图片文件列表
-        self.file_list = QListWidget()
-        self.file_list.currentRowChanged.connect(self.on_select_file)  # 添加行变化信号的连接
+        # 使用模型/视图，只渲染可见的行，十几万张图片也不会卡顿
+        self.file_list = QListView()
+        self.file_list.setUniformItemSizes(True)
+        # 分批布局：恢复十万条的文件列表快照后不必等所有行布局完成就能显示图片
+        self.file_list.setLayoutMode(QListView.Batched)
+        self.file_list.setBatchSize(FILE_LIST_BATCH_SIZE)
+        self.file_list.setModel(self.file_model)
+        self.file_list.selectionModel().currentRowChanged.connect(
+            lambda current, previous: self.on_select_file(self.file_model.file_index(current.row())
+                                                          if current.isValid() else -1))  # 添加行变化信号的连接
         left_layout.addWidget(self.file_list)
 
         # 创建一个 QWidget 来包含左侧布局，并将其添加到 splitter
@@ -155,14 +3712,70 @@ class ImageAnnotationViewer(QWidget):
         self.graphics_view = ZoomableGraphicsView(self)
         self.graphics_scene = QGraphicsScene()
         self.graphics_view.setScene(self.graphics_scene)
-        splitter.addWidget(self.graphics_view)  # 将图片显示区域添加到splitter
+        # 放大时按需加载高分辨率瓦片
+        self.tile_layer = TiledImageLayer(self.graphics_view, self.graphics_scene)
+        # 标注增删或切换显示后重新排布标签，连续修改合并为一次
+        self.label_layout_timer = QTimer(self)
+        self.label_layout_timer.setSingleShot(True)
+        self.label_layout_timer.setInterval(0)
+        self.label_layout_timer.timeout.connect(self.layout_annotation_labels)
+        # 计时浮层：打开计时（--perf）时显示各阶段最近一次和 p50/p95 耗时，F12 切换显示
+        self.perf_overlay = None
+        if perf.enabled:
+            self.perf_overlay = QLabel(self.graphics_view)
+            self.perf_overlay.setAttribute(Qt.WA_TransparentForMouseEvents)
+            self.perf_overlay.setStyleSheet(
+                "background-color: rgba(0, 0, 0, 160); color: white; font-family: monospace; padding: 4px;")
+            self.perf_overlay.move(8, 8)
+            self.perf_overlay_timer = QTimer(self)
+            self.perf_overlay_timer.timeout.connect(self.update_perf_overlay)
+            self.perf_overlay_timer.start(500)
+        # 缩略图网格：双击或回车打开图片
+        self.thumbnail_view = ThumbnailGridView(self.thumbnail_loader)
+        self.thumbnail_view.setModel(self.file_model)
+        self.thumbnail_view.selectionModel().currentRowChanged.connect(
+            lambda current, previous: self.on_select_file(self.file_model.file_index(current.row())
+                                                          if current.isValid() else -1))
+        self.thumbnail_view.activated.connect(lambda index: self.grid_button.setChecked(False))
+
+        self.view_stack = QStackedWidget()
+        self.view_stack.addWidget(self.graphics_view)
+        self.view_stack.addWidget(self.thumbnail_view)
+        splitter.addWidget(self.view_stack)  # 将图片显示区域添加到splitter
 
         # 右侧：标签选择框
-        self.label_frame = QScrollArea()
-        self.label_frame.setWidgetResizable(True)
-        self.label_frame_content = QWidget()
-        self.label_frame_layout = QVBoxLayout(self.label_frame_content)
-        self.label_frame.setWidget(self.label_frame_content)
+        self.annotation_model = AnnotationListModel(self)
+        self.annotation_model.visibility_changed.connect(self.set_annotation_visible)
+        # 按标签筛选列表
+        self.annotation_filter_model = QSortFilterProxyModel(self)
+        self.annotation_filter_model.setSourceModel(self.annotation_model)
+        self.annotation_filter_model.setFilterRole(AnnotationListModel.LabelRole)
+        self.annotation_filter_model.setFilterKeyColumn(AnnotationListModel.COLUMN_LABEL)
+        self.annotation_filter_model.setFilterCaseSensitivity(Qt.CaseInsensitive)
+
+        self.label_frame = QWidget()
+        label_frame_layout = QVBoxLayout(self.label_frame)
+        label_frame_layout.setContentsMargins(0, 0, 0, 0)
+        self.label_filter_edit = QLineEdit()
+        self.label_filter_edit.setPlaceholderText('按标签筛选')
+        self.label_filter_edit.setClearButtonEnabled(True)
+        self.label_filter_edit.textChanged.connect(self.annotation_filter_model.setFilterFixedString)
+        label_frame_layout.addWidget(self.label_filter_edit)
+
+        # 使用表格视图，只渲染可见的行；固定行高避免逐行计算尺寸
+        self.annotation_view = QTableView()
+        self.annotation_view.setModel(self.annotation_filter_model)
+        self.annotation_view.verticalHeader().hide()
+        self.annotation_view.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.annotation_view.verticalHeader().setDefaultSectionSize(20)  # 固定高度，紧凑排列
+        self.annotation_view.horizontalHeader().setSectionResizeMode(AnnotationListModel.COLUMN_LABEL,
+                                                                     QHeaderView.Stretch)
+        self.annotation_view.horizontalHeader().setSectionResizeMode(AnnotationListModel.COLUMN_DELETE,
+                                                                     QHeaderView.Fixed)
+        self.annotation_view.setColumnWidth(AnnotationListModel.COLUMN_DELETE, 50)
+        self.annotation_view.setSelectionMode(QTableView.NoSelection)
+        self.annotation_view.clicked.connect(self.on_annotation_view_clicked)
+        label_frame_layout.addWidget(self.annotation_view)
         splitter.addWidget(self.label_frame)  # 将标签选择框添加到splitter
 
         splitter.setSizes([200, 800, 200])
@@ -179,45 +3792,338 @@ class ImageAnnotationViewer(QWidget):
         self.add_label_button.clicked.connect(self.add_label)
         button_layout.addWidget(self.add_label_button)
 
+        # 在 JSON（多边形）与 XML（矩形）之间转换当前图片的标注文件
+        self.convert_button = QPushButton('转换标注格式')
+        self.convert_button.clicked.connect(self.convert_current_annotation)
+        button_layout.addWidget(self.convert_button)
+
         self.next_button = QPushButton('下一张图片')
         self.next_button.clicked.connect(self.next_image)
         button_layout.addWidget(self.next_button)
 
         main_layout.addLayout(button_layout)
 
-    def load_files(self):
-        """加载图片文件目录"""
-        directory = QFileDialog.getExistingDirectory(self, "Select Directory")
+    def open_path(self, path=None):
+        """启动时打开命令行指定的目录或图片；没有指定时恢复上次的会话"""
+        last_session = read_session(os.path.join(default_cache_dir(), SESSION_FILE))
+        if path is None:
+            path = last_session.get('directory')
+            if not path or not os.path.isdir(path):
+                return
+        path = os.path.abspath(path)
+        current_file = None
+        if os.path.isfile(path):
+            path, current_file = os.path.dirname(path), path
+        elif not os.path.isdir(path):
+            QMessageBox.critical(self, "File Not Found", f"Could not find the file: {path}")
+            return
+        if path == last_session.get('directory'):
+            self.recursive_checkbox.setChecked(bool(last_session.get('recursive')))
+        self.load_files(path, current_file)
+
+    def load_files(self, directory=None, current_file=None):
+        """加载图片文件目录；有上次保存的文件列表快照时直接使用，否则在后台线程中增量扫描
+
+        使用快照时目录的实际内容由监视器建立初始快照后核对，期间新增或删除的图片再合并到列表中。
+        current_file 为打开后要显示的图片，默认显示上次查看的图片（没有会话时为第一张）。
+        """
+        if not directory:
+            directory = QFileDialog.getExistingDirectory(self, "Select Directory")
         if directory:
-            self.image_files = [os.path.join(directory, f) for f in os.listdir(directory)
-                                if f.endswith(('.png', '.jpg', '.jpeg', '.bmp'))]
-            self.file_list.clear()
-            for file in self.image_files:
-                self.file_list.addItem(os.path.basename(file))
+            self.save_session()  # 保存上一个目录的会话
+            self.stop_scanner()
+            self.stop_index_builder()
+            self.directory_watcher.stop()
+            self.annotation_store.release_all()
+            self.prefetcher.clear()
+            self.thumbnail_loader.clear()
+            self.file_model.reset_files(directory)
+            self.search_edit.clear()
+            self.edited_images.clear()
+            if self.index_db is not None:
+                self.index_db.close()
+            try:
+                self.index_db = AnnotationIndexDB(default_index_path(directory, 'sqlite'))
+            except (OSError, sqlite3.Error) as e:
+                print(f"Error: 无法打开标注索引: {e}")
+                self.index_db = None
             self.current_index = 0
-            if self.image_files:
-                self.update_image_display(self.image_files[self.current_index])
+            self.current_file_path = None
+            self.loading_file_path = None
+            self.displayed_file_path = None
+            recursive = self.file_list_recursive = self.recursive_checkbox.isChecked()
+            session = read_session(default_index_path(directory, 'session.json'))
+            self.hidden_labels = set(session.get('hidden_labels', ()))
+            prefix = os.path.join(directory, '')
+            if current_file is None and session.get('current_file'):
+                current_file = prefix + session['current_file']
+                if session.get('zoom'):
+                    self.restored_view = (current_file, session['zoom'], session['center'])
+            files = session.get('files') if session.get('recursive') == recursive else None
+            if files is not None:
+                # 直接使用文件列表快照（相对路径，已按 image_sort_key 排序），不扫描目录
+                self.file_model.append_files([prefix + name for name in files])
+                if self.image_files:
+                    position = self.file_model.position(current_file) if current_file else 0
+                    if position >= len(self.image_files) or self.image_files[position] != current_file:
+                        position = min(session.get('current_index', 0), len(self.image_files) - 1)
+                    self.current_index = position
+                    self.update_image_display(self.image_files[position])
+                self.validating_file_list = True
+                self.directory_watcher.start(directory, recursive)
+            else:
+                self.validating_file_list = False
+                self.opening_file_path = current_file
+                self.scanner = DirectoryScanner(directory, recursive)
+                self.scanner.batch_ready.connect(self.on_files_batch)
+                self.scanner.scan_finished.connect(self.on_scan_finished)
+                self.scan_in_progress = True
+                self.scanner.start()
             # 更新图片计数标签
             self.update_image_count_label()
 
+    def save_session(self):
+        """保存当前目录的文件列表快照和查看状态，并记录为上次打开的目录"""
+        root = self.file_model.root
+        if not root:
+            return
+        prefix = os.path.join(root, '')
+        session = {'recursive': self.file_list_recursive, 'current_index': self.current_index,
+                   'current_file': self.current_file_path[len(prefix):] if self.current_file_path else None,
+                   'hidden_labels': sorted(self.hidden_labels)}
+        if self.current_file_path is not None and self.current_file_path == self.displayed_file_path:
+            center = self.graphics_view.mapToScene(self.graphics_view.viewport().rect().center())
+            session['zoom'] = self.graphics_view.transform().m11() / self.fit_scale
+            session['center'] = (center.x(), center.y())
+        if not self.scan_in_progress:
+            # 扫描完成后的列表（之后的增删已由监视器合并）；相对路径直接截取，不逐个调用 os.path.relpath
+            session['files'] = [file_path[len(prefix):] for file_path in self.image_files]
+        try:
+            write_session(default_index_path(root, 'session.json'), session)
+            write_session(os.path.join(default_cache_dir(), SESSION_FILE),
+                          {'directory': root, 'recursive': self.file_list_recursive})
+        except OSError as e:
+            print(f"Error: 无法保存会话: {e}")
+
+    def stop_scanner(self):
+        """停止正在进行的目录扫描"""
+        if self.scanner is not None:
+            self.scanner.cancel()
+            self.scanner.batch_ready.disconnect()
+            self.scanner.scan_finished.disconnect()
+            self.scanner.wait()
+            self.scanner = None
+            self.scan_in_progress = False
+
+    def on_files_batch(self, file_paths):
+        """扫描线程每发现一批图片就追加到列表，第一批到达时立即显示第一张（或扫描到要打开的图片时显示它）"""
+        was_empty = not self.image_files
+        self.file_model.append_files(file_paths)
+        if self.opening_file_path is not None:
+            if self.opening_file_path in file_paths:
+                self.current_index = len(self.image_files) - len(file_paths) + file_paths.index(self.opening_file_path)
+                self.opening_file_path = None
+                self.update_image_display(self.image_files[self.current_index])
+        elif was_empty and self.image_files:
+            self.update_image_display(self.image_files[self.current_index])
+        self.update_image_count_label()
+
+    def on_scan_finished(self):
+        self.scan_in_progress = False
+        if self.opening_file_path is not None:
+            # 要打开的图片已不存在，显示第一张
+            self.opening_file_path = None
+            self.restored_view = None
+            if self.image_files:
+                self.update_image_display(self.image_files[0])
+        self.directory_watcher.start(self.file_model.root, self.scanner.recursive)
+        self.start_index_builder()
+        self.update_image_count_label()
+
+    def on_watch_snapshot_ready(self):
+        """文件列表来自快照时，与监视器初始快照中的图片比较，合并期间新增或删除的图片，再更新标注索引"""
+        if not self.validating_file_list:
+            return
+        self.validating_file_list = False
+        files = set(self.directory_watcher.image_files())
+        listed = set(self.image_files)
+        if files != listed:
+            self.merge_image_files(files - listed, listed - files)
+        self.start_index_builder()
+
+    def start_index_builder(self, image_paths=None, prune=True):
+        """在后台增量更新标注索引：扫描完成后更新所有图片，搜索前只更新 image_paths（prune 为 False）"""
+        if self.index_db is None:
+            return
+        self.index_builder = AnnotationIndexBuilder(self.index_db, list(self.image_files if image_paths is None
+                                                                        else image_paths), prune)
+        self.index_builder.progress.connect(self.on_index_progress)
+        self.index_builder.finished.connect(self.on_index_finished)
+        self.index_progress = (0, 0)
+        self.index_builder.start()
+
+    def stop_index_builder(self):
+        if self.index_builder is not None:
+            self.index_builder.cancel()
+            self.index_builder.progress.disconnect()
+            self.index_builder.finished.disconnect()
+            self.index_builder.wait()
+            self.index_builder = None
+            self.index_progress = None
+        self.search_pending = False
+
+    def on_index_progress(self, done, total):
+        self.index_progress = (done, total)
+        self.update_image_count_label()
+
+    def on_index_finished(self):
+        self.index_builder = None
+        self.index_progress = None
+        self.update_image_count_label()
+        if self.search_pending:
+            self.search_pending = False
+            self.on_search()
+
+    def on_search(self):
+        """按搜索条件筛选文件列表，并跳到第一张匹配的图片"""
+        text = self.search_edit.text().strip()
+        if not text:
+            self.file_model.set_filter(None)
+        elif self.index_db is not None:
+            # 先写回内存中的修改；本次会话中改过的图片在后台重新索引，完成后再搜索
+            self.annotation_store.flush_all(wait=True)
+            if self.edited_images:
+                self.search_pending = True
+                if self.index_builder is None:
+                    self.start_index_builder(sorted(self.edited_images), prune=False)
+                    self.edited_images.clear()
+                self.update_image_count_label()
+                return
+            try:
+                matches = self.index_db.search(text)
+            except ValueError:
+                QMessageBox.warning(self, "Search", f"无法解析搜索条件: {text}")
+                return
+            except sqlite3.Error as e:
+                QMessageBox.critical(self, "Error", f"查询标注索引失败: {e}")
+                return
+            self.file_model.set_filter([i for i, path in enumerate(self.image_files) if path in matches])
+            if self.file_model.visible and self.file_model.row_of(self.current_index) < 0:
+                # 当前图片不匹配时跳到之后（或之前）最近的匹配
+                target = self.file_model.neighbor(self.current_index, 1)
+                if target < 0:
+                    target = self.file_model.neighbor(self.current_index, -1)
+                self.current_index = target
+                self.update_image_display(self.image_files[target])
+        if self.image_files:
+            self.file_list.setCurrentIndex(self.file_model.index(self.file_model.row_of(self.current_index)))
+        self.update_image_count_label()
+
+    def set_grid_mode(self, enabled):
+        """在单张查看和缩略图网格之间切换"""
+        if enabled:
+            # 先写回未保存的修改，缩略图读取的是文件中的标注
+            self.annotation_store.flush_all(wait=True)
+            self.view_stack.setCurrentWidget(self.thumbnail_view)
+            self.thumbnail_view.scrollTo(self.thumbnail_view.currentIndex())
+            self.thumbnail_view.setFocus()
+        else:
+            self.view_stack.setCurrentWidget(self.graphics_view)
+            self.graphics_view.setFocus()
+
+    def set_compare_mode(self, enabled):
+        """开启时选择对比标注所在的目录，之后每张图片都与其中相同相对路径的标注比较；关闭时恢复按标签着色"""
+        if enabled:
+            directory = QFileDialog.getExistingDirectory(self, "选择对比标注文件夹")
+            if not directory:
+                self.compare_button.setChecked(False)
+                return
+            self.compare_dir = directory
+        else:
+            self.compare_dir = None
+        if self.displayed_file_path is not None and self.displayed_file_path == self.current_file_path:
+            self.update_comparison()
+
+    def update_comparison(self):
+        """按 IoU 把当前标注与对比目录中的标注匹配：标注按匹配/漏检着色，对比标注画成虚线，误检单独着色
+
+        只重建匹配状态变化的标注图形项；关闭对比模式时（compare_dir 为 None）清除对比标注并恢复颜色。
+        """
+        for item in self.comparison_items:
+            if not sip.isdeleted(item):  # 切换图片时已随场景一起删除
+                self.graphics_scene.removeItem(item)
+        self.comparison_items = []
+        statuses, matches, false_positives, predictions = {}, [], [], []
+        if self.compare_dir:
+            relative_path = os.path.relpath(self.current_file_path, self.file_model.root)
+            annotation_path = find_annotation_path(os.path.join(self.compare_dir, relative_path))
+            if annotation_path is not None:
+                try:
+                    predictions = parse_annotation_file(annotation_path, self.image_ratio, self.x_offset, self.y_offset)
+                except Exception as e:
+                    print(f"Error: 无法解析对比标注文件 {annotation_path}: {e}")
+            matches, misses, false_positives = match_shapes(self.annotations, predictions)
+            statuses = dict.fromkeys(misses, 'miss')
+            statuses.update((i, 'match') for i, _, _ in matches)
+            self.compare_label.setText(f"对比：匹配 {len(matches)}，漏检 {len(misses)}，误检 {len(false_positives)}")
+        else:
+            self.compare_label.setText("")
+
+        for i, annotation in enumerate(self.annotations):
+            status = statuses.get(i)
+            if annotation.get('compare') == status:
+                continue
+            annotation['compare'] = status
+            item = self.annotation_items.pop(annotation['index'], None)
+            if item is not None:
+                self.graphics_scene.removeItem(item)
+                self.add_annotation_item(annotation).setVisible(annotation.get('visible', True))
+
+        ious = {j: iou for _, j, iou in matches}
+        for j, prediction in enumerate(predictions):
+            status = 'match' if j in ious else 'false_positive'
+            item = QGraphicsPolygonItem(polygon_from_points(prediction['points']))
+            item.setPen(QPen(QColor(COMPARE_COLORS[status]), 2, Qt.DashLine))
+            item.setToolTip(f"{prediction['label']} IoU {ious[j]:.2f}" if j in ious else f"{prediction['label']} 误检")
+            item.setZValue(0.5)  # 画在标注之上
+            self.graphics_scene.addItem(item)
+            self.comparison_items.append(item)
+
+    def on_recursive_toggled(self, checked):
+        """切换是否包含子文件夹后重新加载当前目录"""
+        if self.file_model.root:
+            self.load_files(self.file_model.root)
+
     def update_image_display(self, file_path):
         """更新图片显示和标注"""
+        if self.current_annotation_path and file_path != self.current_file_path:
+            # 离开当前图片时立即写回尚未保存的修改
+            self.annotation_store.flush(self.current_annotation_path, release=True)
         self.current_file_path = file_path
-        self.file_list.setCurrentRow(self.current_index)
+        now = time.perf_counter()
+        self.skimming = (now - self.display_requested_at) * 1000 < self.navigation_settle_ms
+        if self.skimming:
+            self.settle_timer.start(self.navigation_settle_ms)
+        self.display_requested_at = now
+        current = self.file_model.index(self.file_model.row_of(self.current_index))
+        self.file_list.setCurrentIndex(current)
+        self.thumbnail_view.setCurrentIndex(current)
         self.update_annotations_display(file_path)
 
     def prev_image(self):
-        """显示前一张图片"""
-        if self.current_index > 0:
-            self.current_index -= 1
+        """显示前一张图片，筛选时显示前一张匹配的图片"""
+        target = self.file_model.neighbor(self.current_index, -1)
+        if target >= 0:
+            self.current_index = target
             self.update_image_display(self.image_files[self.current_index])
             # 更新图片计数标签
             self.update_image_count_label()
 
     def next_image(self):
-        """显示下一张图片"""
-        if self.current_index < len(self.image_files) - 1:
-            self.current_index += 1
+        """显示下一张图片，筛选时显示下一张匹配的图片"""
+        target = self.file_model.neighbor(self.current_index, 1)
+        if target >= 0:
+            self.current_index = target
             self.update_image_display(self.image_files[self.current_index])
             # 更新图片计数标签
             self.update_image_count_label()
@@ -226,7 +4132,27 @@ class ImageAnnotationViewer(QWidget):
         """更新图片计数标签"""
         total_images = len(self.image_files)
         current_image = self.current_index + 1 if self.image_files else 0
-        self.image_count_label.setText(f"当前第 {current_image} 张，共 {total_images} 张")
+        text = f"当前第 {current_image} 张，共 {total_images} 张"
+        if self.file_model.visible is not None:
+            text += f"，匹配 {len(self.file_model.visible)} 张"
+        if self.scan_in_progress:
+            text += "（扫描中…）"
+        elif self.index_progress is not None:
+            done, total = self.index_progress
+            text += f"（索引中 {done}/{total}）" if total else "（索引中…）"
+        if self.search_pending:
+            text += "，索引更新后搜索"
+        self.image_count_label.setText(text)
+
+    def update_perf_overlay(self):
+        """刷新计时浮层的文字"""
+        if not self.perf_overlay.isVisible():
+            return
+        lines = [f"{'stage':<14}{'last':>9}{'p50':>9}{'p95':>9}{'n':>6}"]
+        for name, stats in sorted(perf.summary().items()):
+            lines.append(f"{name:<14}{stats['last']:>9.1f}{stats['p50']:>9.1f}{stats['p95']:>9.1f}{stats['count']:>6}")
+        self.perf_overlay.setText('\n'.join(lines))
+        self.perf_overlay.adjustSize()
 
     def keyPressEvent(self, event):
         """捕获键盘事件，用于切换图片"""
@@ -234,59 +4160,159 @@ class ImageAnnotationViewer(QWidget):
             self.prev_image()  # 按下A键或左箭头键，显示上一张图片
         elif event.key() == Qt.Key_D or event.key() == Qt.Key_Right:
             self.next_image()  # 按下D键或右箭头键，显示下一张图片
+        elif event.key() == Qt.Key_F12 and self.perf_overlay is not None:
+            self.perf_overlay.setVisible(not self.perf_overlay.isVisible())  # 按下 F12 显示/隐藏计时浮层
+            self.update_perf_overlay()
     def on_select_file(self, index):
         """当用户选择文件时，显示对应的图片和标注"""
         if index >= 0 and index < len(self.image_files):
+            if index == self.current_index and self.current_file_path == self.image_files[index]:
+                return  # 由 update_image_display 同步选中行触发，图片已经在显示
             self.current_index = index
             self.update_image_display(self.image_files[index])
             # 更新图片计数标签
             self.update_image_count_label()
 
     def update_annotations_display(self, file_path):
-        """更新图片和标注的显示"""
-        base_path = file_path.rsplit('.', 1)[0]
-        json_path = base_path + '.json'
-        xml_path = base_path + '.xml'
-
-        if os.path.exists(json_path):
-            self.current_annotation_path = json_path
-        elif os.path.exists(xml_path):
-            self.current_annotation_path = xml_path
-        else:
-            QMessageBox.critical(self, "File Not Found", "No corresponding JSON or XML annotation file found.")
+        """更新图片和标注的显示
+
+        实际显示推迟到事件循环空闲时进行：连续按键时排队的切换请求合并为一次，只显示最后一张。
+        """
+        self.display_timer.start()
+
+    def show_current_image(self):
+        """显示当前图片：已缓存时直接显示，否则先显示占位图，完整数据在后台加载"""
+        file_path = self.current_file_path
+        if not file_path:
+            return
+        data = self.prefetcher.cache.get(file_path)
+        if data is not None:
+            self.loading_file_path = None
+            self.show_display_data(file_path, data)
+            return
+        if file_path != self.displayed_file_path:
+            self.show_loading()
+            self.prefetcher.request_placeholder(file_path, self.placeholder_loaded.emit)
+        self.loading_file_path = file_path
+        self.prefetcher.request(file_path, self.display_loaded.emit)
+        # 当前图片排在最前面，不在范围内的旧请求被取消
+        self.prefetcher.prefetch_around(self.image_files, self.current_index)
+
+    def on_navigation_settled(self):
+        """快速浏览停下后，为当前图片绘制标注"""
+        self.skimming = False
+        if self.current_file_path and self.current_file_path not in (self.displayed_file_path, self.loading_file_path):
+            self.show_current_image()
+
+    def show_loading(self):
+        """清空上一张图片的画面和标注，等待占位图和完整数据"""
+        self.displayed_file_path = None
+        self.current_annotation_path = None  # 加载完成前不能编辑标注
+        self.annotations = []
+        self.annotation_index = AnnotationGridIndex()
+        self.tile_layer.reset()
+        self.graphics_scene.clear()
+        self.annotation_items.clear()
+        self.update_annotation_checkboxes()
+        self.decode_info_label.setText("加载中…")
+
+    def on_placeholder_loaded(self, file_path, result):
+        """占位图解码完成，完整数据还没到时放大显示"""
+        if file_path != self.loading_file_path or file_path == self.displayed_file_path:
+            return  # 已经切换到别的图片，或完整数据已经显示
+        qimage, width, height = result
+        item = self.graphics_scene.addPixmap(QPixmap.fromImage(qimage))
+        item.setTransformationMode(Qt.SmoothTransformation)
+        item.setScale(width / qimage.width())
+        item.setZValue(-2)
+        self.graphics_view.fitInView(QRectF(0, 0, width, height), Qt.KeepAspectRatio)
+
+    def on_display_loaded(self, file_path, data, error):
+        """后台加载完成或失败；只处理仍在等待的那张图片，过时的结果留在缓存中"""
+        if file_path != self.loading_file_path:
             return
+        self.loading_file_path = None
+        if error is None:
+            self.show_display_data(file_path, data)
+        elif isinstance(error, FileNotFoundError):
+            QMessageBox.critical(self, "File Not Found", f"Could not find the file: {error.filename}")
+        else:
+            QMessageBox.critical(self, "Error", f"An error occurred: {str(error)}")
 
+    @timed('display')
+    def show_display_data(self, file_path, data):
+        """用加载好的数据重建画面和标注列表"""
         try:
-            image = Image.open(file_path)
-            resized_image, ratio = resize_image(image, 800, 600)
-            self.image_ratio = ratio
-            self.x_offset = (800 - resized_image.width) / 2
-            self.y_offset = (450 - resized_image.height) / 2  # 调整为450，图片和标注更匹配
+            if data['annotation_path'] is None:
+                QMessageBox.critical(self, "File Not Found", "No corresponding JSON or XML annotation file found.")
+                return
+
+            if self.skimming:
+                # 快速浏览时只换图片，标注等停下后再绘制
+                self.show_loading()
+                self.decode_info_label.setText(format_decode_info(data['decode_info']))
+                self.graphics_scene.addPixmap(QPixmap.fromImage(data['qimage'])).setZValue(-2)
+                self.graphics_view.fitInView(self.graphics_scene.itemsBoundingRect(), Qt.KeepAspectRatio)
+                self.prefetcher.prefetch_around(self.image_files, self.current_index)
+                return
 
-            self.annotations = self.parse_annotation(self.current_annotation_path, ratio, self.x_offset, self.y_offset)
+            self.current_annotation_path = data['annotation_path']
+            self.directory_watcher.watch_file(self.current_annotation_path)
+            self.image_ratio = data['ratio']
+            self.x_offset = data['x_offset']
+            self.y_offset = data['y_offset']
+            # 复制一份标注，后续的添加/删除不会改动缓存中的数据
+            self.annotations = [dict(annotation) for annotation in data['annotations']]
+            for annotation in self.annotations:
+                if annotation['label'] in self.hidden_labels:
+                    annotation['visible'] = False
+            self.annotation_index = AnnotationGridIndex(self.annotations)
+            self.decode_info_label.setText(format_decode_info(data['decode_info']))
 
             # 在QGraphicsScene中显示图像
-            qimage = QImage(resized_image.tobytes(), resized_image.width, resized_image.height, resized_image.width * 3, QImage.Format_RGB888)
-            pixmap = QPixmap.fromImage(qimage)
+            pixmap = QPixmap.fromImage(data['qimage'])
 
+            self.tile_layer.reset()
             self.graphics_scene.clear()  # 清空之前的图像和标注
-            self.graphics_scene.addPixmap(pixmap)
+            self.annotation_items.clear()  # 图形项已随场景一起删除
+            pixmap_item = self.graphics_scene.addPixmap(pixmap)
+            pixmap_item.setZValue(-2)  # 底图位于瓦片和标注之下
+            self.tile_layer.set_image(file_path, data['decode_info']['source_size'], self.image_ratio)
             self.graphics_view.fitInView(self.graphics_scene.itemsBoundingRect(), Qt.KeepAspectRatio)
+            self.fit_scale = self.graphics_view.transform().m11()
+            if self.restored_view is not None:
+                # 恢复会话中上次查看时的缩放和位置
+                restored_file, zoom, center = self.restored_view
+                self.restored_view = None
+                if restored_file == file_path:
+                    self.graphics_view.scale(zoom, zoom)
+                    self.graphics_view.centerOn(*center)
+            self.tile_layer.schedule_update()
 
             # 更新标注显示
             self.update_annotation_checkboxes()
+            if self.compare_dir:
+                self.update_comparison()
             self.update_canvas_annotations()
+            self.displayed_file_path = file_path
+            if perf.enabled:
+                # 从按键到图片和标注完整显示的延迟
+                perf.record('switch', (time.perf_counter() - self.display_requested_at) * 1000)
 
-        except FileNotFoundError as e:
-            QMessageBox.critical(self, "File Not Found", f"Could not find the file: {e.filename}")
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"An error occurred: {str(e)}")
+            # 显示完成后预取前后的图片
+            self.prefetcher.prefetch_around(self.image_files, self.current_index)
 
         except FileNotFoundError as e:
             QMessageBox.critical(self, "File Not Found", f"Could not find the file: {e.filename}")
         except Exception as e:
             QMessageBox.critical(self, "Error", f"An error occurred: {str(e)}")
 
+    def on_quality_changed(self, index):
+        """切换缩放质量模式并重新显示当前图片"""
+        self.prefetcher.set_quality(self.quality_combo.itemData(index))
+        if self.current_file_path:
+            self.update_annotations_display(self.current_file_path)
+
     def get_label_color(self, label):
         """根据标签名称获取颜色，如果没有分配颜色，则分配新的颜色"""
         if label not in self.label_color_map:
@@ -295,62 +4321,17 @@ class ImageAnnotationViewer(QWidget):
             self.label_color_map[label] = color
             self.color_index += 1
         return self.label_color_map[label]
-    def parse_annotation(self, annotation_path, ratio, x_offset, y_offset):
-        annotations = []
-        if annotation_path.endswith('.json'):
-            with open(annotation_path, 'r') as file:
-                data = json.load(file)
-                for i, shape in enumerate(data['shapes']):
-                    points = shape['points']
-                    label = shape['label']
-                    scaled_points = [(x * ratio + x_offset, y * ratio + y_offset) for x, y in points]
-                    annotations.append({'type': 'polygon', 'points': scaled_points, 'label': label, 'index': i})
-        elif annotation_path.endswith('.xml'):
-            tree = ET.parse(annotation_path)
-            root = tree.getroot()
-            for i, obj in enumerate(root.findall('object')):
-                label = obj.find('name').text
-                bndbox = obj.find('bndbox')
-                xmin = int(float(bndbox.find('xmin').text) * ratio + x_offset)
-                ymin = int(float(bndbox.find('ymin').text) * ratio + y_offset)
-                xmax = int(float(bndbox.find('xmax').text) * ratio + x_offset)
-                ymax = int(float(bndbox.find('ymax').text) * ratio + y_offset)
-                points = [(xmin, ymin), (xmax, ymin), (xmax, ymax), (xmin, ymax)]
-                annotations.append({'type': 'rectangle', 'points': points, 'label': label, 'index': i})
-        return annotations
 
+    @timed('panel')
     def update_annotation_checkboxes(self):
-        """更新标签复选框，并为每个标签添加删除按钮"""
-        # 首先清空之前的复选框和按钮
-        for i in reversed(range(self.label_frame_layout.count())):
-            widget = self.label_frame_layout.itemAt(i).widget()
-            if widget:
-                widget.deleteLater()
+        """刷新右侧标注列表（切换图片时整体重置模型，不再为每个标注创建控件）"""
+        self.annotation_model.set_annotations(self.annotations)
 
-        self.annotation_checkboxes.clear()
-
-        for annotation in self.annotations:
-            # 创建复选框
-            checkbox = QCheckBox(f"{annotation['label']} #{annotation['index']}")
-            checkbox.setFixedHeight(20)  # 固定高度，紧凑排列
-            checkbox.setChecked(True)  # 默认显示所有标签
-            checkbox.stateChanged.connect(self.update_canvas_annotations)
-            self.annotation_checkboxes[annotation['index']] = checkbox
-
-            # 创建删除按钮，确保每个按钮对应正确的标注
-            delete_button = QPushButton("删除")
-            delete_button.setFixedHeight(20)  # 固定高度，紧凑排列
-            delete_button.clicked.connect(lambda _, index=annotation['index']: self.confirm_delete_annotation(index))
-
-            # 将复选框和删除按钮加入标签选择框，使用垂直布局
-            container = QWidget()
-            layout = QVBoxLayout(container)
-            layout.setSpacing(5)  # 控制组件之间的间距
-            layout.addWidget(checkbox)
-            layout.addWidget(delete_button)  # 删除按钮放在标签名称下方
-            self.label_frame_layout.addWidget(container)
-
-        self.label_frame.setWidget(self.label_frame_content)
+    def on_annotation_view_clicked(self, proxy_index):
+        """点击 "删除" 列时删除对应的标注"""
+        if proxy_index.column() == AnnotationListModel.COLUMN_DELETE:
+            row = self.annotation_filter_model.mapToSource(proxy_index).row()
+            self.confirm_delete_annotation(self.annotations[row]['index'])
 
     def confirm_delete_annotation(self, index):
         """弹出确认对话框，确认是否删除标签"""
@@ -367,59 +4348,106 @@ class ImageAnnotationViewer(QWidget):
         except IndexError as e:
             print(f"Error: {str(e)}")
 
+    @timed('scene')
     def update_canvas_annotations(self):
-        """根据注释内容在图片上绘制多边形和矩形，并根据复选框状态控制显示"""
-        # 清除现有的标注
-        for item in self.graphics_scene.items():
-            if isinstance(item, (QGraphicsPolygonItem, QGraphicsRectItem, QGraphicsEllipseItem, QGraphicsTextItem)):
-                self.graphics_scene.removeItem(item)
-
-        # 遍历标注并绘制
+        """为每个标注创建一次图形项组，之后只根据复选框状态切换可见性，不再重复绘制"""
         for annotation in self.annotations:
-            if self.annotation_checkboxes[annotation['index']].isChecked():
-                # 获取对应标签的颜色
-                color = self.get_label_color(annotation['label'])
+            item = self.annotation_items.get(annotation['index'])
+            if item is None:
+                item = self.add_annotation_item(annotation)
+            item.setVisible(annotation.get('visible', True))
+        self.layout_annotation_labels()
 
-                if annotation['type'] == 'polygon':
-                    self.draw_polygon_annotation(annotation, color)
-                elif annotation['type'] == 'rectangle':
-                    self.draw_rectangle_annotation(annotation, color)
+    def layout_annotation_labels(self):
+        """隐藏会与前面标签重叠的标签名称，编号小的标签优先显示
+
+        标签和标注一起随视图缩放，场景坐标中的重叠关系与缩放无关，只在标注变化时重新计算。
+        """
+        self.label_layout_timer.stop()
+        cell_size = 64
+        placed = {}  # 网格单元 -> [已显示标签的场景矩形, ...]
+        for index in sorted(self.annotation_items):
+            group = self.annotation_items[index]
+            label = group.label_item
+            if not group.isVisible():
+                continue
+            rect = label.mapRectToScene(label.boundingRect())
+            cells = [(col, row)
+                     for col in range(int(math.floor(rect.left() / cell_size)), int(math.floor(rect.right() / cell_size)) + 1)
+                     for row in range(int(math.floor(rect.top() / cell_size)), int(math.floor(rect.bottom() / cell_size)) + 1)]
+            overlaps = any(rect.intersects(other) for cell in cells for other in placed.get(cell, ()))
+            label.setVisible(not overlaps)
+            if not overlaps:
+                for cell in cells:
+                    placed.setdefault(cell, []).append(rect)
+
+    def add_annotation_item(self, annotation):
+        """创建标注的图形项组（形状、顶点、标签）并加入场景"""
+        # 获取对应标签的颜色，对比模式下按匹配状态着色
+        status = annotation.get('compare')
+        color = QColor(COMPARE_COLORS[status]) if status else self.get_label_color(annotation['label'])
+        group = QGraphicsItemGroup()
+        if annotation['type'] == 'polygon':
+            self.draw_polygon_annotation(annotation, color, group)
+        elif annotation['type'] == 'rectangle':
+            self.draw_rectangle_annotation(annotation, color, group)
+        self.graphics_scene.addItem(group)
+        self.annotation_items[annotation['index']] = group
+        self.label_layout_timer.start()
+        return group
+
+    def remove_annotation_item(self, index):
+        """删除一个标注的图形项组，并把后面的标注编号前移"""
+        group = self.annotation_items.pop(index, None)
+        if group is not None:
+            self.graphics_scene.removeItem(group)
+        shifted = {}
+        for item_index, item in self.annotation_items.items():
+            if item_index > index:
+                item_index -= 1
+                annotation = self.annotations[item_index]
+                item.label_item.setPlainText(f"{annotation['label']} #{item_index}")
+            shifted[item_index] = item
+        self.annotation_items = shifted
+        self.label_layout_timer.start()
 
-    def draw_polygon_annotation(self, annotation, color):
+    def set_annotation_visible(self, index, visible):
+        """只切换一个标注的可见性；某个标签的标注全部取消勾选后，之后的图片中也默认隐藏该标签"""
+        item = self.annotation_items.get(index)
+        if item is not None:
+            item.setVisible(visible)
+            self.label_layout_timer.start()
+        label = self.annotations[index]['label']
+        if visible:
+            self.hidden_labels.discard(label)
+        elif not any(a.get('visible', True) for a in self.annotations if a['label'] == label):
+            self.hidden_labels.add(label)
+
+    def draw_polygon_annotation(self, annotation, color, group):
         """绘制多边形标注，使用给定的颜色，并在多边形外显示标签"""
-        polygon = QPolygonF()
-        for point in annotation['points']:
-            polygon.append(QPointF(point[0], point[1]))  # 将标注的点加入多边形
-        polygon_item = QGraphicsPolygonItem(polygon)
-        polygon_item.setPen(QPen(color, 2))  # 设置多边形线条颜色和宽度
-        self.graphics_scene.addItem(polygon_item)
-
-        # 绘制顶点标记，使用相同的颜色
-        for point in annotation['points']:
-            ellipse = QGraphicsEllipseItem(point[0] - 2, point[1] - 2, 4, 4)  # 小圆标记顶点
-            ellipse.setBrush(QBrush(color))  # 设置顶点填充颜色与线条相同
-            ellipse.setPen(QPen(color))  # 设置边框颜色与线条相同
-            self.graphics_scene.addItem(ellipse)
+        # 多边形和顶点标记由一个图形项按缩放级别绘制
+        group.addToGroup(PolygonAnnotationItem(annotation['points'], color))
 
         # 在多边形的第一个点附近显示标签名称
         label_text = f"{annotation['label']} #{annotation['index']}"
         label = QGraphicsTextItem(label_text)
         label.setDefaultTextColor(color)
         # 设置标签的位置，偏移以避免与标注重叠
-        first_point = annotation['points'][0]
+        first_x, first_y = annotation['points'][0].tolist()
         label_offset_x, label_offset_y = 10, -20  # 向右下偏移标签显示位置
-        label.setPos(first_point[0] + label_offset_x, first_point[1] + label_offset_y)
+        label.setPos(first_x + label_offset_x, first_y + label_offset_y)
 
-        self.graphics_scene.addItem(label)
+        group.addToGroup(label)
+        group.label_item = label
 
-    def draw_rectangle_annotation(self, annotation, color):
+    def draw_rectangle_annotation(self, annotation, color, group):
         """绘制矩形标注，使用给定的颜色，并在矩形的外部显示标签"""
-        x1, y1 = annotation['points'][0]
-        x2, y2 = annotation['points'][2]  # 矩形对角线的两个点
+        x1, y1 = annotation['points'][0].tolist()
+        x2, y2 = annotation['points'][2].tolist()  # 矩形对角线的两个点
         rect = QRectF(QPointF(x1, y1), QPointF(x2, y2))  # 创建矩形
         rect_item = QGraphicsRectItem(rect)
         rect_item.setPen(QPen(color, 2))  # 设置矩形边框颜色和宽度
-        self.graphics_scene.addItem(rect_item)
+        group.addToGroup(rect_item)
 
         # 在矩形的右上角显示标签名称，并偏移一些以防重叠
         label_text = f"{annotation['label']} #{annotation['index']}"
@@ -429,67 +4457,61 @@ class ImageAnnotationViewer(QWidget):
         label_offset_x, label_offset_y = 10, -10  # 偏移标签显示位置
         label.setPos(x1 + label_offset_x, y1 + label_offset_y)
 
-        self.graphics_scene.addItem(label)
+        group.addToGroup(label)
+        group.label_item = label
 
     def handle_click_on_annotation(self, scene_pos):
-        """处理用户点击的标注区域，切换标签显示状态并同步复选框"""
-        for annotation in self.annotations:
-            # 检查点击位置是否在多边形内部
-            if annotation['type'] == 'polygon':
-                polygon = QPolygonF([QPointF(point[0], point[1]) for point in annotation['points']])
-                if polygon.containsPoint(scene_pos, Qt.OddEvenFill):
-                    self.toggle_annotation_display(annotation['index'])
-                    break
-            # 检查点击位置是否在矩形内部
-            elif annotation['type'] == 'rectangle':
-                x1, y1 = annotation['points'][0]
-                x2, y2 = annotation['points'][2]
-                rect = QRectF(QPointF(x1, y1), QPointF(x2, y2))
-                if rect.contains(scene_pos):
-                    self.toggle_annotation_display(annotation['index'])
-                    break
+        """处理用户点击的标注区域，切换标签显示状态并同步复选框；重叠时切换面积最小的标注"""
+        hits = self.annotation_index.hit_test(scene_pos.x(), scene_pos.y())
+        if hits:
+            self.toggle_annotation_display(hits[0]['index'])
 
     def toggle_annotation_display(self, index):
         """切换标注的显示状态，并更新复选框的勾选状态"""
-        checkbox = self.annotation_checkboxes[index]
-        checkbox.setChecked(not checkbox.isChecked())  # 切换复选框状态，更新显示
-        self.update_canvas_annotations()  # 重新更新画布标注
+        annotation = self.annotations[index]
+        # 通过模型修改，模型发出 visibility_changed 更新画布
+        self.annotation_model.set_visible(index, not annotation.get('visible', True))
 
+    @timed('edit')
     def delete_annotation(self, index):
         """根据标注的 index 来删除标注，而不是依赖列表索引"""
         try:
             # 查找要删除的标注
-            annotation_to_delete = next((a for a in self.annotations if a['index'] == index), None)
-            if annotation_to_delete is None:
+            row = next((row for row, a in enumerate(self.annotations) if a['index'] == index), None)
+            if row is None:
                 raise IndexError("标注索引无效！")
+            annotation_to_delete = self.annotations[row]
 
-            # 从内存中删除标注
-            self.annotations = [a for a in self.annotations if a['index'] != index]
+            # 从内存中删除标注（原地删除，列表模型引用的是同一个列表）
+            # 按行号删除：标注中的坐标是 NumPy 数组，list.index 的相等比较会出错
+            self.annotation_model.remove_row(row)
+            self.annotation_index.remove(annotation_to_delete)
 
-            # 删除文件中的标注
+            # 删除文件中的标注（修改内存中的文档，由标注存储在后台写回）
+            document = self.annotation_store.document(self.current_annotation_path)
             if self.current_annotation_path.endswith('.json'):
-                with open(self.current_annotation_path, 'r+') as file:
-                    data = json.load(file)
-                    data['shapes'] = [s for i, s in enumerate(data['shapes']) if i != index]
-                    file.seek(0)
-                    json.dump(data, file, indent=4)
-                    file.truncate()
+                del document['shapes'][index]
 
             elif self.current_annotation_path.endswith('.xml'):
-                tree = ET.parse(self.current_annotation_path)
-                root = tree.getroot()
+                root = document.getroot()
                 objects = root.findall('object')
                 object_to_delete = objects[index]
                 root.remove(object_to_delete)
-                tree.write(self.current_annotation_path)
+            self.annotation_store.mark_dirty(self.current_annotation_path)
+            self.edited_images.add(self.current_file_path)
+
+            self.prefetcher.invalidate(self.current_file_path)
+            self.thumbnail_loader.invalidate(self.current_file_path)
 
             # 重新对 annotations 进行索引编号，确保索引连续有效
             for i, annotation in enumerate(self.annotations):
                 annotation['index'] = i  # 重新编号索引
 
-            # 更新UI，重新生成复选框并同步显示
-            self.update_annotation_checkboxes()
-            self.update_canvas_annotations()
+            # 更新UI：只删除被删标注的图形项和列表行，并刷新后面各行的编号
+            self.remove_annotation_item(index)
+            self.annotation_model.refresh_labels(index)
+            if self.compare_dir:
+                self.update_comparison()
 
         except IndexError as e:
             print(f"Error: {str(e)}")
@@ -504,6 +4526,8 @@ class ImageAnnotationViewer(QWidget):
 
         self.last_label_name = label_name
 
+        if not self.current_annotation_path:
+            return  # 图片还在加载
         if self.current_annotation_path.endswith('.json'):
             # 进入多边形标注模式
             self.graphics_view.enter_annotation_mode('polygon')
@@ -553,66 +4577,335 @@ class ImageAnnotationViewer(QWidget):
         self.graphics_view.mousePressEvent = handle_click
 
     def convert_to_original_coordinates(self, points):
-        """将显示在屏幕上的坐标转换为原始图像的坐标"""
-        original_points = []
-        for x, y in points:
-            original_x = (x - self.x_offset) / self.image_ratio
-            original_y = (y - self.y_offset) / self.image_ratio
-            original_points.append((original_x, original_y))
-        return original_points
+        """将显示在屏幕上的坐标转换为原始图像的坐标，返回 (N, 2) 浮点数组"""
+        return display_to_image(points, self.image_ratio, self.x_offset, self.y_offset)
+
+    def convert_to_display_coordinates(self, points):
+        """将原始图像的坐标转换为屏幕上的显示坐标，返回 (N, 2) 浮点数组"""
+        return image_to_display(points, self.image_ratio, self.x_offset, self.y_offset)
 
+    @timed('edit')
     def save_polygon_to_json(self, label_name, points):
         """保存多边形标注到 JSON 文件"""
         # 将屏幕坐标转换为原始图像的坐标
         original_points = self.convert_to_original_coordinates(points)
-        with open(self.current_annotation_path, 'r+') as file:
-            data = json.load(file)
-            # 添加新的多边形
-            new_shape = {'label': label_name, 'points': original_points, 'shape_type': 'polygon'}
-            data['shapes'].append(new_shape)
-            file.seek(0)
-            json.dump(data, file, indent=4)
-            file.truncate()
+        data = self.annotation_store.document(self.current_annotation_path)
+        # 添加新的多边形，由标注存储在后台写回文件
+        data['shapes'].append(labelme_shape(label_name, original_points))
+        self.annotation_store.mark_dirty(self.current_annotation_path)
+        self.edited_images.add(self.current_file_path)
+        self.prefetcher.invalidate(self.current_file_path)
+        self.thumbnail_loader.invalidate(self.current_file_path)
 
-        # 更新UI
-        self.annotations.append(
-            {'type': 'polygon', 'points': points, 'label': label_name, 'index': len(self.annotations)})
-        self.update_annotation_checkboxes()
-        self.update_canvas_annotations()
+        # 更新UI：显示坐标由保存的原图坐标换算得到，与重新加载文件后的显示一致
+        annotation = add_annotation_geometry(
+            {'type': 'polygon', 'points': self.convert_to_display_coordinates(original_points),
+             'label': label_name, 'index': len(self.annotations)})
+        self.annotation_model.append_annotation(annotation)
+        self.annotation_index.insert(annotation)
+        self.add_annotation_item(annotation)
+        if self.compare_dir:
+            self.update_comparison()
 
+    @timed('edit')
     def save_rectangle_to_xml(self, label_name, points):
         """保存矩形标注到 XML 文件"""
-        # 将屏幕坐标转换为原始图像的坐标
-        original_points = self.convert_to_original_coordinates(points)
-        x1, y1 = original_points[0]
-        x1_1, y1_1 = points[0]
-        x2, y2 = original_points[1]
-        x2_2, y2_2 = points[1]
-        tree = ET.parse(self.current_annotation_path)
-        root = tree.getroot()
-
-        # 创建新的 object 标签
-        obj = ET.Element('object')
-        ET.SubElement(obj, 'name').text = label_name
-        bndbox = ET.SubElement(obj, 'bndbox')
-        ET.SubElement(bndbox, 'xmin').text = str(int(min(x1, x2)))
-        ET.SubElement(bndbox, 'ymin').text = str(int(min(y1, y2)))
-        ET.SubElement(bndbox, 'xmax').text = str(int(max(x1, x2)))
-        ET.SubElement(bndbox, 'ymax').text = str(int(max(y1, y2)))
-        root.append(obj)
-
-        tree.write(self.current_annotation_path)
-        # 更新内存中的标注并重新显示
-        points = [(int(min(x1_1, x2_2)), int(min(y1_1, y2_2))), (int(max(x1_1, x2_2)), int(min(y1_1, y2_2))),
-                  (int(max(x1_1, x2_2)), int(max(y1_1, y2_2))), (int(min(x1_1, x2_2)), int(max(y1_1, y2_2)))]
-        self.annotations.append(
+        # 将屏幕坐标转换为原始图像的坐标，VOC 的 bndbox 是整数像素，四舍五入而不是截断
+        obj, (xmin, ymin, xmax, ymax) = voc_object(label_name, self.convert_to_original_coordinates(points))
+        tree = self.annotation_store.document(self.current_annotation_path)
+        tree.getroot().append(obj)
+
+        self.annotation_store.mark_dirty(self.current_annotation_path)
+        self.edited_images.add(self.current_file_path)
+        self.prefetcher.invalidate(self.current_file_path)
+        self.thumbnail_loader.invalidate(self.current_file_path)
+        # 更新内存中的标注并重新显示，显示坐标由保存的整数坐标换算得到，与重新加载文件后的显示一致
+        points = self.convert_to_display_coordinates(rectangle_corners(xmin, ymin, xmax, ymax))
+        annotation = add_annotation_geometry(
             {'type': 'rectangle', 'points': points, 'label': label_name, 'index': len(self.annotations)})
-        self.update_annotation_checkboxes()
-        self.update_canvas_annotations()
+        self.annotation_model.append_annotation(annotation)
+        self.annotation_index.insert(annotation)
+        self.add_annotation_item(annotation)
+        if self.compare_dir:
+            self.update_comparison()
+
+    def convert_current_annotation(self):
+        """把当前图片的标注在 LabelMe JSON 与 VOC XML 之间转换，转换后可以用另一种形状编辑
+
+        原标注文件改名为 .bak 保留；转换为 XML 时多边形保存为外接矩形。
+        """
+        source = self.current_annotation_path
+        if not source:
+            return  # 图片还在加载或没有标注文件
+        target = 'voc' if source.endswith('.json') else 'labelme'
+        output_path = source.rsplit('.', 1)[0] + ANNOTATION_FORMATS[target]
+        notes = []
+        if target == 'voc' and any(a['type'] == 'polygon' for a in self.annotations):
+            notes.append("多边形将保存为外接矩形。")
+        if os.path.exists(output_path):
+            notes.append(f"{os.path.basename(output_path)} 已存在，将被覆盖。")
+        message = f"把 {os.path.basename(source)} 转换为 {os.path.basename(output_path)}，原文件改名为 .bak 保留。"
+        if QMessageBox.question(self, '转换标注格式', '\n'.join([message] + notes)) != QMessageBox.Yes:
+            return
+
+        # 先写回未保存的修改，转换读取的是文件中的最新内容
+        self.annotation_store.flush(source, release=True)
+        self.annotation_store.wait_pending(source)
+        result = convert_annotation_file({'image_path': self.current_file_path, 'annotation_path': source,
+                                          'target': target, 'output_path': output_path})
+        if result['error']:
+            QMessageBox.critical(self, "Error", f"转换标注失败: {result['error']}")
+            return
+        try:
+            os.replace(source, source + '.bak')
+        except OSError as e:
+            QMessageBox.critical(self, "Error", f"无法重命名原标注文件: {e}")
+        self.edited_images.add(self.current_file_path)
+        self.prefetcher.invalidate(self.current_file_path)
+        self.thumbnail_loader.invalidate(self.current_file_path)
+        self.current_annotation_path = None  # 重新加载完成前不能编辑标注
+        self.update_annotations_display(self.current_file_path)
+
+    def batch_edit_annotations(self):
+        """打开批量编辑对话框，编辑当前加载的所有图片（不受搜索筛选影响）的标注"""
+        if not self.image_files:
+            QMessageBox.information(self, '批量编辑标注', '请先加载图片文件夹')
+            return
+        dialog = BatchEditDialog(self)
+        dialog.preview_button.clicked.connect(lambda: self.run_batch_edit(dialog, dry_run=True))
+        dialog.apply_button.clicked.connect(lambda: self.run_batch_edit(dialog, dry_run=False))
+        dialog.exec_()
+        dialog.deleteLater()
+
+    def run_batch_edit(self, dialog, dry_run):
+        """在后台线程中运行批量编辑（dry_run 为 True 时只统计），显示可以取消的进度"""
+        try:
+            operations = dialog.operations()
+        except ValueError as e:
+            QMessageBox.warning(dialog, '批量编辑标注', str(e))
+            return
+        if not dry_run and QMessageBox.question(
+                dialog, '批量编辑标注',
+                f"修改 {len(self.image_files)} 张图片的标注文件，删除的形状无法撤销。继续？") != QMessageBox.Yes:
+            return
+        # 先写回并释放内存中的标注文档：批量编辑读取文件中的最新内容，之后也不会被旧的文档覆盖
+        self.annotation_store.flush_all(wait=True)
+        self.annotation_store.release_all()
+        worker = self.batch_edit_worker = BatchEditWorker(list(self.image_files), operations, dry_run)
+        progress = QProgressDialog('正在统计将要修改的标注…' if dry_run else '正在批量编辑标注…', '取消',
+                                   0, len(self.image_files), dialog)
+        progress.setWindowModality(Qt.WindowModal)
+        progress.setMinimumDuration(0)
+        worker.progress.connect(lambda done, total: progress.setValue(done))
+        progress.canceled.connect(worker.cancel)
+        worker.finished.connect(lambda: self.on_batch_edit_finished(dialog, progress, worker, operations))
+        worker.start()
+
+    def on_batch_edit_finished(self, dialog, progress, worker, operations):
+        progress.canceled.disconnect()  # 关闭进度对话框时也会发出 canceled
+        progress.close()
+        progress.deleteLater()
+        self.batch_edit_worker = None
+        if worker.error:
+            QMessageBox.critical(dialog, "Error", f"批量编辑标注失败: {worker.error}")
+            return
+        summary = worker.summary
+        dialog.summary_edit.setPlainText(format_edit_summary(summary, operations))
+        if not summary['dry_run'] and summary['changed']:
+            # 与外部程序修改标注相同：丢弃缓存的预览和缩略图，搜索前重新索引，当前图片只更新变化的标注
+            self.on_directory_changed({'added': [], 'removed': [], 'modified': [], 'annotations': summary['changed']})
+
+    def on_directory_changed(self, changes):
+        """外部程序修改了已加载目录中的文件：合并新增或删除的图片，只重新解析变化的标注文件"""
+        stale = set(changes['modified'])
+        for file_path, annotation_path in changes['annotations']:
+            if self.annotation_store.is_own_write(annotation_path):
+                continue  # 本程序自己写回引起的通知
+            if not self.annotation_store.reload(annotation_path):
+                print(f"Warning: {annotation_path} 被外部程序修改，但还有未保存的修改，保留当前的标注")
+                continue
+            stale.add(file_path)
+        for file_path in stale.union(changes['removed']):
+            self.prefetcher.invalidate(file_path)
+            self.thumbnail_loader.invalidate(file_path)
+        self.edited_images.update(stale)
+        self.edited_images.update(changes['added'])
+        if changes['added'] or changes['removed']:
+            self.merge_image_files(changes['added'], changes['removed'])
+        if self.current_file_path in changes['modified']:
+            self.update_annotations_display(self.current_file_path)  # 图片本身变了，重新加载
+        elif self.current_file_path in stale:
+            self.reload_current_annotations()
+        self.thumbnail_view.schedule_request()
+
+    def merge_image_files(self, added, removed):
+        """把新增和删除的图片合并到列表中；当前图片被删除时显示原位置上的下一张"""
+        current = self.current_file_path
+        root = self.file_model.root
+        self.file_model.remove_files(removed)
+        self.file_model.insert_files(sorted(added, key=lambda path: image_sort_key(os.path.relpath(path, root))))
+        if current is not None and current not in removed:
+            self.current_index = self.file_model.position(current)
+        elif current is not None:
+            target = min(self.file_model.position(current), len(self.image_files) - 1)
+            if target >= 0 and self.file_model.row_of(target) < 0:
+                # 筛选状态下跳到之后（或之前）最近的匹配
+                following = self.file_model.neighbor(target, 1)
+                target = following if following >= 0 else self.file_model.neighbor(target, -1)
+            if target >= 0:
+                self.current_index = target
+                self.update_image_display(self.image_files[target])
+            else:
+                self.current_index = 0
+                self.current_file_path = None
+                self.show_loading()
+                self.decode_info_label.setText("")
+        self.update_image_count_label()
+
+    def reload_current_annotations(self):
+        """当前图片的标注文件被外部修改：重新解析，只更新画布和列表中增加、删除或改变的标注"""
+        file_path = self.current_file_path
+        if file_path != self.displayed_file_path or self.current_annotation_path is None:
+            # 还没有显示（正在加载，或之前没有标注文件），重新显示即可
+            self.update_annotations_display(file_path)
+            return
+        annotation_path = find_annotation_path(file_path)
+        if annotation_path != self.current_annotation_path:
+            # 标注文件换了格式或被删除，重新加载整张图片
+            self.current_annotation_path = None
+            self.update_annotations_display(file_path)
+            return
+        try:
+            annotations = parse_annotation_file(annotation_path, self.image_ratio, self.x_offset, self.y_offset)
+        except Exception as e:
+            # 其他程序可能还没写完，写完后会再收到一次通知
+            print(f"Error: 无法解析标注文件 {annotation_path}: {e}")
+            return
+        self.patch_annotations(annotations)
+
+    @timed('edit')
+    def patch_annotations(self, annotations):
+        """把当前显示的标注更新为 annotations：未变的标注保留图形项和勾选状态，只增删变化的部分"""
+        def shape_key(annotation):
+            return annotation['type'], annotation['label'], annotation['points'].tobytes()
+
+        old = self.annotations
+        matcher = difflib.SequenceMatcher(None, [shape_key(a) for a in old], [shape_key(a) for a in annotations],
+                                          autojunk=False)
+        opcodes = [opcode for opcode in matcher.get_opcodes() if opcode[0] != 'equal']
+        if not opcodes:
+            return
+        for _, i1, i2, _, _ in opcodes:
+            for annotation in old[i1:i2]:
+                self.graphics_scene.removeItem(self.annotation_items.pop(annotation['index']))
+                self.annotation_index.remove(annotation)
+        # 新标注与 show_display_data 一样默认隐藏已隐藏的标签
+        for _, _, _, j1, j2 in opcodes:
+            for annotation in annotations[j1:j2]:
+                if annotation['label'] in self.hidden_labels:
+                    annotation['visible'] = False
+        # 从后往前替换，前面的行号不受影响；列表模型和 self.annotations 是同一个列表
+        for _, i1, i2, j1, j2 in reversed(opcodes):
+            self.annotation_model.replace_rows(i1, i2 - i1, annotations[j1:j2])
+        # 保留的标注按新的位置重新编号；新标注的编号已经是它在文件中的位置
+        items, self.annotation_items = self.annotation_items, {}
+        added = []
+        for i, annotation in enumerate(self.annotations):
+            if annotation is annotations[i]:
+                added.append(annotation)
+                continue
+            item = items[annotation['index']]
+            if annotation['index'] != i:
+                annotation['index'] = i
+                item.label_item.setPlainText(f"{annotation['label']} #{i}")
+            self.annotation_items[i] = item
+        for annotation in added:
+            self.annotation_index.insert(annotation)
+            self.add_annotation_item(annotation).setVisible(annotation.get('visible', True))
+        self.annotation_model.refresh_labels(opcodes[0][1])
+        self.label_layout_timer.start()
+        if self.compare_dir:
+            self.update_comparison()
+
+    def on_annotation_write_failed(self, annotation_path, message):
+        QMessageBox.critical(self, "Error", f"保存标注文件失败 {annotation_path}: {message}")
+
+    def closeEvent(self, event):
+        """关闭窗口时保存会话、写回未保存的标注，并停止目录扫描、后台预取和瓦片解码"""
+        self.save_session()
+        self.annotation_store.shutdown()
+        self.stop_scanner()
+        self.stop_index_builder()
+        if self.batch_edit_worker is not None:
+            self.batch_edit_worker.cancel()
+            self.batch_edit_worker.wait()
+        if self.index_db is not None:
+            self.index_db.close()
+        self.prefetcher.shutdown()
+        self.tile_layer.shutdown()
+        self.thumbnail_loader.shutdown()
+        self.directory_watcher.shutdown()
+        super().closeEvent(event)
 
 
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
-    viewer = ImageAnnotationViewer()
+    parser = argparse.ArgumentParser(description="图像标注查看工具")
+    parser.add_argument('path', nargs='?', help="启动时打开的图片目录或图片（默认恢复上次的会话）")
+    parser.add_argument('--cache-mb', type=int, default=CACHE_MAX_BYTES // (1024 * 1024),
+                        help="解码缓存容量（MB）")
+    parser.add_argument('--prefetch', type=int, default=PREFETCH_DEPTH, help="当前图片前后各预取几张")
+    parser.add_argument('--preview-cache-mb', type=int, default=PREVIEW_CACHE_MAX_BYTES // (1024 * 1024),
+                        help="磁盘预览缓存容量上限（MB），0 表示不使用")
+    parser.add_argument('--stats', metavar='DIR', help="不启动界面，统计数据集目录中的标注并输出报告")
+    parser.add_argument('--index', metavar='FILE', help="统计结果索引文件的位置（默认在用户缓存目录中）")
+    parser.add_argument('--workers', type=int, default=None, help="解析标注使用的进程数（默认为 CPU 核数）")
+    parser.add_argument('--no-recursive', action='store_true', help="统计时不包含子文件夹")
+    parser.add_argument('--json', action='store_true', help="以 JSON 格式输出统计报告")
+    parser.add_argument('--convert', metavar='SRC', help="不启动界面，批量转换标注格式；SRC 为图片目录或 COCO JSON 文件")
+    parser.add_argument('--to', choices=CONVERT_TARGETS, default='coco', help="转换的目标格式（默认 coco）")
+    parser.add_argument('--output', metavar='PATH',
+                        help="转换输出：COCO 为输出文件，labelme/voc 为输出目录（默认写在图片旁边）")
+    parser.add_argument('--overwrite', action='store_true', help="转换时覆盖已存在的目标标注文件")
+    parser.add_argument('--compare', nargs=2, metavar=('LABELS', 'PREDICTIONS'),
+                        help="不启动界面，按 IoU 匹配比较两个目录中同名图片的标注，输出各标签的精确率和召回率")
+    parser.add_argument('--iou', type=float, default=COMPARE_IOU_THRESHOLD,
+                        help=f"比较时判定匹配的 IoU 阈值（默认 {COMPARE_IOU_THRESHOLD}）")
+    parser.add_argument('--edit', metavar='DIR', help="不启动界面，批量重命名、合并、删除标签或按面积、顶点数过滤形状")
+    parser.add_argument('--rename', action='append', metavar='OLD=NEW',
+                        help="把标签 OLD 改为 NEW；OLD 可以是逗号分隔的多个标签（合并），可重复")
+    parser.add_argument('--delete', action='append', metavar='LABEL', help="删除该标签的所有形状，可重复")
+    parser.add_argument('--min-area', type=float, help="删除面积（原图像素）小于该值的形状")
+    parser.add_argument('--max-area', type=float, help="删除面积（原图像素）大于该值的形状")
+    parser.add_argument('--min-vertices', type=int, help="删除顶点数少于该值的多边形")
+    parser.add_argument('--max-vertices', type=int, help="删除顶点数多于该值的多边形")
+    parser.add_argument('--filter-label', action='append', metavar='LABEL',
+                        help="面积和顶点数过滤只作用于这些标签（默认所有标签），可重复")
+    parser.add_argument('--dry-run', action='store_true', help="批量编辑时只统计将要修改的形状和文件，不写入")
+    parser.add_argument('--perf', action='store_true', help="记录各阶段耗时并显示计时浮层（F12 切换显示）")
+    parser.add_argument('--perf-log', metavar='FILE', help="把各阶段耗时以 JSON lines 格式追加到文件，退出时写入 p50/p95 汇总")
+    args, qt_args = parser.parse_known_args()
+
+    if args.stats:
+        sys.exit(run_stats_command(args))
+    if args.convert:
+        sys.exit(run_convert_command(args))
+    if args.compare:
+        sys.exit(run_compare_command(args))
+    if args.edit:
+        sys.exit(run_edit_command(args))
+
+    if args.perf or args.perf_log:
+        perf.enable(args.perf_log)
+    app = QApplication(sys.argv[:1] + qt_args)
+    viewer = ImageAnnotationViewer(cache_size_mb=args.cache_mb, prefetch_depth=args.prefetch,
+                                   preview_cache_mb=args.preview_cache_mb)
     viewer.show()
-    sys.exit(app.exec_())
\ No newline at end of file
+    # 窗口显示后再打开目录；NumPy 和 Pillow 在后台线程解码第一张图片时才导入
+    QTimer.singleShot(0, lambda: viewer.open_path(args.path))
+    exit_code = app.exec_()
+    if perf.enabled:
+        for name, stats in sorted(perf.summary().items()):
+            print(f"{name}: n={stats['count']} p50={stats['p50']:.1f} ms p95={stats['p95']:.1f} ms "
+                  f"max={stats['max']:.1f} ms", file=sys.stderr)
+        perf.close()
+    sys.exit(exit_code)
@@ -0,0 +1,82 @@
+"""标注点击命中测试的微基准：对比逐个构造 QPolygonF 的线性扫描与 AnnotationGridIndex
+
+用法：python benchmarks/bench_hit_test.py --polygons 10000 --queries 2000
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt5.QtCore import Qt, QPointF
+from PyQt5.QtGui import QPolygonF
+
+from ImageAnnotationViewer import AnnotationGridIndex, add_annotation_geometry, DISPLAY_WIDTH, DISPLAY_HEIGHT
+
+
+def make_annotations(count, vertices, seed):
+    """在显示区域内随机生成 count 个凸多边形标注"""
+    rng = random.Random(seed)
+    annotations = []
+    for i in range(count):
+        cx, cy = rng.uniform(0, DISPLAY_WIDTH), rng.uniform(0, DISPLAY_HEIGHT)
+        radius = rng.uniform(2, 20)
+        points = [(cx + radius * math.cos(2 * math.pi * k / vertices), cy + radius * math.sin(2 * math.pi * k / vertices))
+                  for k in range(vertices)]
+        annotations.append({'type': 'polygon', 'points': points, 'label': f'label{i % 20}', 'index': i})
+    return annotations
+
+
+def linear_hit_test(annotations, x, y):
+    """旧实现：每次点击为每个标注构造 QPolygonF 并逐个测试"""
+    point = QPointF(x, y)
+    for annotation in annotations:
+        polygon = QPolygonF([QPointF(px, py) for px, py in annotation['points']])
+        if polygon.containsPoint(point, Qt.OddEvenFill):
+            return annotation
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="标注命中测试微基准")
+    parser.add_argument('--polygons', type=int, default=10000)
+    parser.add_argument('--vertices', type=int, default=12)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    annotations = make_annotations(args.polygons, args.vertices, args.seed)
+    rng = random.Random(args.seed + 1)
+    queries = [(rng.uniform(0, DISPLAY_WIDTH), rng.uniform(0, DISPLAY_HEIGHT)) for _ in range(args.queries)]
+
+    start = time.perf_counter()
+    for annotation in annotations:
+        add_annotation_geometry(annotation)
+    index = AnnotationGridIndex(annotations)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    grid_hits = sum(1 for x, y in queries if index.hit_test(x, y))
+    grid_us = (time.perf_counter() - start) / len(queries) * 1e6
+
+    # 线性扫描很慢，只抽取一部分查询
+    linear_queries = queries[:max(1, len(queries) // 20)]
+    start = time.perf_counter()
+    linear_hits = sum(1 for x, y in linear_queries if linear_hit_test(annotations, x, y) is not None)
+    linear_us = (time.perf_counter() - start) / len(linear_queries) * 1e6
+
+    # 两种方法命中的查询应一致
+    grid_subset_hits = sum(1 for x, y in linear_queries if index.hit_test(x, y))
+    print(f"polygons={args.polygons} vertices={args.vertices} queries={args.queries}")
+    print(f"grid build: {build_ms:.1f} ms")
+    print(f"grid hit test: {grid_us:.1f} us/query ({grid_hits} hits)")
+    print(f"linear hit test: {linear_us:.1f} us/query ({linear_hits} hits on {len(linear_queries)} queries, "
+          f"grid: {grid_subset_hits})")
+    print(f"speedup: {linear_us / grid_us:.0f}x")
+
+
+if __name__ == '__main__':
+    main()
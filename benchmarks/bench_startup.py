@@ -0,0 +1,109 @@
+"""启动基准：计时从启动进程到窗口显示、第一张图片完整显示的时间
+
+第一次启动时没有会话，需要扫描目录；关闭时保存会话，第二次启动直接使用文件列表快照恢复。
+数据集中的图片和标注都是同一对文件的硬链接，十万张图片也只占很少的磁盘空间。
+
+用法：python benchmarks/bench_startup.py --images 100000
+"""
+import argparse
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_dataset(directory, count):
+    """生成 count 张图片（同一张 JPEG 和 LabelMe JSON 的硬链接）"""
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(0)
+    source = os.path.join(directory, '.source')
+    os.makedirs(source)
+    buffer = io.BytesIO()
+    Image.fromarray(rng.integers(0, 256, (1080, 1920, 3), dtype=np.uint8)).save(buffer, 'JPEG', quality=90)
+    shapes = [{'label': f'label{i % 5}', 'shape_type': 'polygon',
+               'points': (rng.uniform(0, 1, (12, 2)) * (1920, 1080)).tolist()} for i in range(20)]
+    sources = {}
+    for extension, data in (('.jpg', buffer.getvalue()),
+                            ('.json', json.dumps({'shapes': shapes, 'imageWidth': 1920, 'imageHeight': 1080}).encode())):
+        # 硬链接数有上限，每 50000 个链接换一个源文件
+        sources[extension] = []
+        for part in range((count + 49999) // 50000):
+            path = os.path.join(source, f'{part}{extension}')
+            with open(path, 'wb') as file:
+                file.write(data)
+            sources[extension].append(path)
+    for i in range(count):
+        for extension, paths in sources.items():
+            os.link(paths[i // 50000], os.path.join(directory, f'img{i:06d}{extension}'))
+
+
+def child(directory, timeout):
+    """在子进程中启动查看器，输出各时间点（秒），第一张图片显示后关闭窗口（保存会话）"""
+    start = time.perf_counter()
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    sys.path.insert(0, REPO)
+    import ImageAnnotationViewer as viewer_module
+    from PyQt5.QtCore import QTimer
+    from PyQt5.QtWidgets import QApplication
+
+    app = QApplication([])
+    viewer = viewer_module.ImageAnnotationViewer()
+    viewer.show()
+    result = {'window_s': time.perf_counter() - start, 'numpy_imported': 'numpy' in sys.modules}
+    QTimer.singleShot(0, lambda: viewer.open_path(directory))
+
+    def poll():
+        if viewer.displayed_file_path or time.perf_counter() - start > timeout:
+            result['first_image_s'] = time.perf_counter() - start if viewer.displayed_file_path else None
+            result['images'] = len(viewer.image_files)
+            timer.stop()
+            viewer.close()
+            app.quit()
+
+    timer = QTimer()
+    timer.timeout.connect(poll)
+    timer.start(5)
+    app.exec_()
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="启动基准")
+    parser.add_argument('--images', type=int, default=100000)
+    parser.add_argument('--runs', type=int, default=3, help="恢复会话的启动次数")
+    parser.add_argument('--timeout', type=float, default=120.0)
+    parser.add_argument('--child', metavar='DIR', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child, args.timeout)
+        return
+
+    directory = tempfile.mkdtemp(prefix='bench-startup-')
+    cache_dir = tempfile.mkdtemp(prefix='bench-cache-')
+    try:
+        make_dataset(directory, args.images)
+        env = dict(os.environ, XDG_CACHE_HOME=cache_dir)
+        for run in range(args.runs + 1):
+            output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', directory,
+                                     '--timeout', str(args.timeout)],
+                                    env=env, check=True, capture_output=True, text=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            first_image = '-' if result['first_image_s'] is None else f"{result['first_image_s']:.3f} s"
+            print(f"{'scan' if run == 0 else 'restore'}: window {result['window_s']:.3f} s, "
+                  f"first image {first_image}, images {result['images']}, "
+                  f"numpy imported before window: {result['numpy_imported']}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,271 @@
+"""查看器端到端基准：在无界面的 Qt（offscreen）中对合成数据集计时
+
+生成的数据集包括大尺寸 JPEG、带很多多边形和内嵌 imageData 的 LabelMe JSON、带很多矩形框的 VOC XML。
+依次计时 load_files、用 update_image_display 切换图片（冷/热两轮）、按键重复频率的快速浏览、切换标注显示、
+添加/删除标注的往返，
+记录吞吐量和进程峰值内存，结果写入 JSON 文件，便于比较不同提交之间的差异。
+
+用法：python benchmarks/bench_viewer.py --images 40 --output results.json
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from PIL import Image
+from PyQt5.QtCore import QT_VERSION_STR
+from PyQt5.QtWidgets import QApplication, QMessageBox
+
+from ImageAnnotationViewer import ImageAnnotationViewer, perf, DISPLAY_WIDTH, DISPLAY_HEIGHT, NAVIGATION_SETTLE_MS
+
+
+def make_jpeg(width, height, seed, quality=90):
+    """生成一张带渐变和噪声的 JPEG，返回编码后的字节"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([x * 255 // max(1, width - 1), y * 255 // max(1, height - 1),
+                     (x + y) * 255 // max(1, width + height - 2)], axis=-1)
+    noise = rng.integers(0, 32, size=(height, width, 3))
+    pixels = np.clip(base + noise, 0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, 'JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def make_polygon(rng, width, height, vertices):
+    cx, cy = rng.uniform(0, width), rng.uniform(0, height)
+    radius = rng.uniform(0.01, 0.08) * min(width, height)
+    angles = np.sort(rng.uniform(0, 2 * np.pi, vertices))
+    radii = radius * rng.uniform(0.6, 1.0, vertices)
+    return np.column_stack([cx + radii * np.cos(angles), cy + radii * np.sin(angles)]).tolist()
+
+
+def generate_dataset(directory, args):
+    """生成合成数据集：一半图片配 LabelMe JSON（多边形 + imageData），一半配 VOC XML（矩形框）"""
+    rng = np.random.default_rng(args.seed)
+    width, height = args.width, args.height
+    jpeg = make_jpeg(width, height, args.seed)
+    image_data = base64.b64encode(jpeg).decode('ascii') if args.image_data else None
+    labels = [f'label{i}' for i in range(args.labels)]
+    for i in range(args.images):
+        name = f'img{i:05d}'
+        with open(os.path.join(directory, name + '.jpg'), 'wb') as file:
+            file.write(jpeg)
+        if i % 2 == 0:
+            shapes = [{'label': labels[int(rng.integers(len(labels)))],
+                       'points': make_polygon(rng, width, height, args.vertices),
+                       'group_id': None, 'shape_type': 'polygon', 'flags': {}}
+                      for _ in range(args.polygons)]
+            document = {'version': '5.0.1', 'flags': {}, 'shapes': shapes, 'imagePath': name + '.jpg',
+                        'imageData': image_data, 'imageHeight': height, 'imageWidth': width}
+            with open(os.path.join(directory, name + '.json'), 'w') as file:
+                json.dump(document, file)
+        else:
+            objects = []
+            for _ in range(args.boxes):
+                x1, x2 = sorted(rng.integers(0, width, 2).tolist())
+                y1, y2 = sorted(rng.integers(0, height, 2).tolist())
+                objects.append(f"<object><name>{labels[int(rng.integers(len(labels)))]}</name><pose>Unspecified</pose>"
+                               f"<truncated>0</truncated><difficult>0</difficult><bndbox><xmin>{x1}</xmin>"
+                               f"<ymin>{y1}</ymin><xmax>{x2}</xmax><ymax>{y2}</ymax></bndbox></object>")
+            with open(os.path.join(directory, name + '.xml'), 'w') as file:
+                file.write(f"<annotation><folder>bench</folder><filename>{name}.jpg</filename><size><width>{width}"
+                           f"</width><height>{height}</height><depth>3</depth></size>{''.join(objects)}</annotation>")
+
+
+def wait_until(app, condition, timeout=120):
+    end = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > end:
+            raise TimeoutError("等待超时")
+        app.processEvents()
+        time.sleep(0.001)
+
+
+def peak_rss_mb():
+    """进程的峰值常驻内存（MB），Linux 上 ru_maxrss 单位为 KB，macOS 上为字节"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def timing(samples):
+    samples = sorted(samples)
+    count = len(samples)
+    return {'count': count, 'total_ms': round(sum(samples), 3),
+            'p50_ms': round(samples[(count - 1) // 2], 3), 'p95_ms': round(samples[int(0.95 * (count - 1))], 3),
+            'max_ms': round(samples[-1], 3), 'per_second': round(count / (sum(samples) / 1000), 2) if sum(samples) else None}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(app, directory, args):
+    results = {}
+    viewer = ImageAnnotationViewer(cache_size_mb=args.cache_mb, prefetch_depth=args.prefetch, preview_cache_mb=0)
+    viewer.resize(1200, 800)
+    viewer.show()
+    app.processEvents()
+
+    # 加载目录：直到扫描结束且第一张图片显示出来
+    start = time.perf_counter()
+    viewer.load_files(directory)
+    wait_until(app, lambda: not viewer.scan_in_progress and viewer.displayed_file_path is not None)
+    results['load_files'] = {'ms': round((time.perf_counter() - start) * 1000, 3), 'images': len(viewer.image_files)}
+    if viewer.index_builder is not None:
+        viewer.index_builder.wait()  # 标注索引在后台更新，不计入后面的计时
+        app.processEvents()
+
+    # 切换图片：第一轮多数图片需要解码（预取只能提前几张），第二轮图片在解码缓存中。
+    # 每次都等图片和标注完整显示，关闭快速浏览的延迟绘制
+    viewer.navigation_settle_ms = 0
+    for name in ('switch_cold', 'switch_warm'):
+        samples = []
+        for index in range(len(viewer.image_files)):
+            viewer.current_index = index
+            start = time.perf_counter()
+            viewer.update_image_display(viewer.image_files[index])
+            wait_until(app, lambda: viewer.displayed_file_path == viewer.image_files[index])
+            samples.append((time.perf_counter() - start) * 1000)
+        results[name] = timing(samples)
+
+    # 快速浏览：按住按键时以按键重复的频率连续切换，记录事件循环最长的停顿和停下后完整显示的耗时
+    viewer.navigation_settle_ms = NAVIGATION_SETTLE_MS
+    viewer.prefetcher.clear()
+    viewer.current_index = 0
+    viewer.update_image_display(viewer.image_files[0])
+    wait_until(app, lambda: viewer.displayed_file_path == viewer.image_files[0])
+    gaps = []
+    last = time.perf_counter()
+    for index in range(1, min(len(viewer.image_files), args.skim + 1)):
+        deadline = last + args.key_repeat_ms / 1000
+        while time.perf_counter() < deadline:
+            app.processEvents()
+            time.sleep(0.001)
+        now = time.perf_counter()
+        gaps.append((now - last) * 1000 - args.key_repeat_ms)
+        last = now
+        viewer.next_image()
+    start = time.perf_counter()
+    wait_until(app, lambda: viewer.displayed_file_path == viewer.current_file_path)
+    results['skim'] = {'keys': len(gaps), 'key_repeat_ms': args.key_repeat_ms,
+                       'max_stall_ms': round(max(gaps), 3) if gaps else None,
+                       'p95_stall_ms': round(sorted(gaps)[int(0.95 * (len(gaps) - 1))], 3) if gaps else None,
+                       'settle_ms': round((time.perf_counter() - start) * 1000, 3)}
+
+    # 在 JSON 和 XML 图片上分别测切换显示和添加/删除往返
+    for kind, index in (('json', 0), ('xml', 1)):
+        if index >= len(viewer.image_files):
+            continue
+        viewer.current_index = index
+        viewer.update_image_display(viewer.image_files[index])
+        wait_until(app, lambda: viewer.displayed_file_path == viewer.image_files[index])
+        count = len(viewer.annotations)
+
+        samples = []
+        for i in range(args.toggles):
+            start = time.perf_counter()
+            viewer.toggle_annotation_display(i % count)
+            app.processEvents()
+            samples.append((time.perf_counter() - start) * 1000)
+        results[f'toggle_{kind}'] = timing(samples)
+
+        rng = random.Random(args.seed)
+        samples = []
+        for _ in range(args.edits):
+            x, y = rng.uniform(50, DISPLAY_WIDTH - 50), rng.uniform(50, DISPLAY_HEIGHT - 50)
+            start = time.perf_counter()
+            if kind == 'json':
+                viewer.save_polygon_to_json('bench', [(x, y), (x + 30, y), (x + 15, y + 25)])
+            else:
+                viewer.save_rectangle_to_xml('bench', [(x, y), (x + 30, y + 25)])
+            viewer.delete_annotation(len(viewer.annotations) - 1)
+            app.processEvents()
+            samples.append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        viewer.annotation_store.flush_all(wait=True)
+        results[f'add_delete_{kind}'] = timing(samples)
+        results[f'add_delete_{kind}']['flush_ms'] = round((time.perf_counter() - start) * 1000, 3)
+        assert len(viewer.annotations) == count, "添加/删除往返后标注数量不一致"
+
+    viewer.close()
+    app.processEvents()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="查看器端到端基准（offscreen Qt + 合成数据集）")
+    parser.add_argument('--images', type=int, default=40)
+    parser.add_argument('--width', type=int, default=4000)
+    parser.add_argument('--height', type=int, default=3000)
+    parser.add_argument('--polygons', type=int, default=300, help="每个 JSON 中的多边形数")
+    parser.add_argument('--vertices', type=int, default=50, help="每个多边形的顶点数")
+    parser.add_argument('--boxes', type=int, default=500, help="每个 XML 中的矩形框数")
+    parser.add_argument('--labels', type=int, default=20)
+    parser.add_argument('--no-image-data', dest='image_data', action='store_false', help="JSON 中不内嵌 imageData")
+    parser.add_argument('--toggles', type=int, default=200)
+    parser.add_argument('--edits', type=int, default=50)
+    parser.add_argument('--skim', type=int, default=30, help="快速浏览时连续切换的次数")
+    parser.add_argument('--key-repeat-ms', type=int, default=33, help="快速浏览时两次按键的间隔")
+    parser.add_argument('--cache-mb', type=int, default=512)
+    parser.add_argument('--prefetch', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--dataset', metavar='DIR', help="使用（或生成到）指定目录，默认在临时目录中生成并在结束后删除")
+    parser.add_argument('--output', metavar='FILE', help="结果 JSON 文件，默认只打印")
+    args = parser.parse_args()
+
+    # 不读写用户的缓存目录，保证每次运行条件一致
+    cache_dir = tempfile.mkdtemp(prefix='bench-cache-')
+    os.environ['XDG_CACHE_HOME'] = cache_dir
+    directory = args.dataset or tempfile.mkdtemp(prefix='bench-dataset-')
+    try:
+        os.makedirs(directory, exist_ok=True)
+        start = time.perf_counter()
+        if not any(name.endswith('.jpg') for name in os.listdir(directory)):
+            generate_dataset(directory, args)
+        generate_s = time.perf_counter() - start
+
+        app = QApplication([sys.argv[0]])
+        QMessageBox.critical = staticmethod(lambda *a, **k: print(f"QMessageBox: {a[1:]}", file=sys.stderr))
+        perf.enable()
+        results = run(app, directory, args)
+        report = {
+            'benchmark': 'bench_viewer', 'commit': git_commit(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(), 'qt': QT_VERSION_STR, 'platform': platform.platform(),
+            'params': {key: value for key, value in vars(args).items() if key not in ('output', 'dataset')},
+            'generate_s': round(generate_s, 3), 'results': results,
+            'stages': {name: {key: round(value, 3) if isinstance(value, float) else value for key, value in stats.items()}
+                       for name, stats in perf.summary().items()},
+            'peak_rss_mb': round(peak_rss_mb(), 1),
+        }
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        if not args.dataset:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    print(text)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()